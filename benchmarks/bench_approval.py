@@ -0,0 +1,265 @@
+"""Approval workflow load test and consistency check
+
+Runs the full approval path against local stand-ins: `mock_blob_server.py`
+(or real Azurite via --blob-connection-string) and `mock_sap_server.py`.
+The Function is loaded --instances times as independent modules, each with
+its own in-memory cache and HTTP clients, to model a scaled-out app sharing
+one storage account. Every simulated request goes through:
+
+    create   POST /api/create-so-request
+    status   tools/call check_approval_status (--status-checks times)
+    decide   --racers concurrent approve/reject calls on random instances;
+             each racer flips to the opposite decision with --conflict-ratio
+    status   tools/call check_approval_status once all racers are done
+
+Afterwards it reads back every blob and the SAP create counts and checks:
+
+    duplicated     two creates returned the same request ID
+    lost           a created request has no blob
+    undecided      a request is still pending after its racers finished, although
+                   none failed (an approval SAP refused is reopened and counted
+                   separately as `reopened`)
+    multi-decided  more than one racer succeeded for a request
+    mismatch       the successful racer's decision differs from the stored status
+    sap creates    approved requests created exactly once in SAP, rejected never
+    stale status   the final status check disagrees with blob storage
+
+Throughput and p50/p95/p99 latency are reported per operation. The exit code
+is 1 when any check fails.
+
+Usage:
+    python benchmarks/bench_approval.py --requests 2000 --concurrency 200 --instances 3 --racers 2
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import peak_rss_mb, summarize  # noqa: E402
+from mock_blob_server import connection_string  # noqa: E402
+from mock_http import start_server_process  # noqa: E402
+
+SALES_ORDER = {
+    "SalesOrderType": "OR", "SalesOrganization": "1710", "DistributionChannel": "10",
+    "OrganizationDivision": "00", "SoldToParty": "10100001", "TransactionCurrency": "USD",
+    "to_Item": [{"Material": "TG0011", "RequestedQuantity": "5"}]
+}
+
+
+def load_instances(count: int) -> list:
+    path = os.path.join(os.path.dirname(ROOT), "function_app.py")
+    instances = []
+    for index in range(count):
+        spec = importlib.util.spec_from_file_location(f"function_app_instance{index}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        instances.append(module)
+    return instances
+
+
+class Harness:
+    def __init__(self, instances: list, args):
+        self.instances = instances
+        self.args = args
+        self.latencies = {op: [] for op in ("create", "approve", "reject", "status", "list")}
+        self.errors = {op: 0 for op in self.latencies}
+        self.error_samples = {}
+        self.requests = {}
+        self.created_ids = []
+
+    async def call(self, op: str, handler, req):
+        started = time.perf_counter()
+        response = await handler(req)
+        self.latencies[op].append(time.perf_counter() - started)
+        return response
+
+    async def status(self, request_id: str) -> str:
+        import azure.functions as func
+        fa = random.choice(self.instances)
+        body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+                           "params": {"name": "check_approval_status", "arguments": {"request_id": request_id}}})
+        response = await self.call("status", fa.mcp_sse_endpoint, func.HttpRequest("POST", "/api/sse", headers={},
+                                                                                  body=body.encode()))
+        envelope = json.loads(response.get_body())
+        if "result" not in envelope:
+            self.errors["status"] += 1
+            return "error"
+        return json.loads(envelope["result"]["content"][0]["text"]).get("status", "unknown")
+
+    async def decide(self, request_id: str, decision: str) -> int:
+        import azure.functions as func
+        fa = random.choice(self.instances)
+        handler = fa.approve_request if decision == "approve" else fa.reject_request
+        body = {"request_id": request_id, "comments": "load test", "reason": "load test"}
+        response = await self.call(decision, handler, func.HttpRequest(
+            "POST", f"/api/{decision}-request", headers={}, body=json.dumps(body).encode()))
+        if response.status_code not in (200, 409):
+            self.errors[decision] += 1
+            self.error_samples.setdefault(f"{decision} {response.status_code}", response.get_body()[:300].decode())
+        return response.status_code
+
+    async def flow(self, index: int):
+        import azure.functions as func
+        args = self.args
+        marker = f"LOAD-{index:06d}"
+        fa = random.choice(self.instances)
+        body = {"created_by": "load.test@contoso.com", "justification": "load test",
+                "sales_order_data": {**SALES_ORDER, "PurchaseOrderByCustomer": marker}}
+        response = await self.call("create", fa.create_so_request, func.HttpRequest(
+            "POST", "/api/create-so-request", headers={}, body=json.dumps(body).encode()))
+        if response.status_code != 201:
+            self.errors["create"] += 1
+            return
+        request_id = json.loads(response.get_body())["request_id"]
+        self.created_ids.append(request_id)
+        record = self.requests.setdefault(request_id, {"marker": marker, "wins": []})
+
+        for _ in range(args.status_checks):
+            await self.status(request_id)
+        intended = "reject" if random.random() < args.reject_ratio else "approve"
+        racers = [intended if random.random() >= args.conflict_ratio else
+                  ("approve" if intended == "reject" else "reject") for _ in range(args.racers)]
+        statuses = await asyncio.gather(*(self.decide(request_id, decision) for decision in racers))
+        record["wins"] = [decision for decision, status in zip(racers, statuses) if status == 200]
+        record["failed"] = any(status not in (200, 409) for status in statuses)
+        record["final_status_check"] = await self.status(request_id)
+
+        if args.list_every and index % args.list_every == 0:
+            fa = random.choice(self.instances)
+            response = await self.call("list", fa.list_approval_requests,
+                                       func.HttpRequest("GET", "/api/list-approval-requests", headers={}, body=b""))
+            if response.status_code != 200:
+                self.errors["list"] += 1
+
+    async def run(self) -> float:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def bounded(index):
+            async with semaphore:
+                await self.flow(index)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(index) for index in range(self.args.requests)))
+        return time.perf_counter() - started
+
+
+def verify(harness: Harness, container_client, sap_posts: dict) -> dict:
+    stored = {}
+    for blob in container_client.list_blobs(name_starts_with="SO-REQ-"):
+        stored[blob.name[:-len(".json")]] = json.loads(container_client.download_blob(blob.name).readall())
+
+    checks = {"duplicated": len(harness.created_ids) - len(set(harness.created_ids)),
+              "lost": 0, "undecided": 0, "reopened": 0, "multi_decided": 0, "mismatch": 0, "sap_creates": 0, "stale_status": 0}
+    expected_status = {"approve": "approved", "reject": "rejected"}
+    for request_id, record in harness.requests.items():
+        blob = stored.get(request_id)
+        if blob is None:
+            checks["lost"] += 1
+            continue
+        status = blob.get("status")
+        if status == "pending":
+            checks["reopened" if record.get("failed") and blob.get("last_error") else "undecided"] += 1
+        if len(record["wins"]) > 1:
+            checks["multi_decided"] += 1
+        if record["wins"] and expected_status[record["wins"][0]] != status:
+            checks["mismatch"] += 1
+        creates = sap_posts.get(f"A_SalesOrder:{record['marker']}", 0)
+        if creates != (1 if status == "approved" else 0):
+            checks["sap_creates"] += 1
+        if record.get("final_status_check") != status:
+            checks["stale_status"] += 1
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="Approval requests to create")
+    parser.add_argument("--concurrency", type=int, default=100, help="Request flows in flight at once")
+    parser.add_argument("--instances", type=int, default=2, help="Function instances sharing blob storage")
+    parser.add_argument("--racers", type=int, default=2, help="Concurrent decisions per request")
+    parser.add_argument("--reject-ratio", type=float, default=0.3)
+    parser.add_argument("--conflict-ratio", type=float, default=0.2, help="Chance a racer sends the opposite decision")
+    parser.add_argument("--status-checks", type=int, default=1, help="Status checks before deciding")
+    parser.add_argument("--list-every", type=int, default=0, help="List all requests every N flows (0 = never)")
+    parser.add_argument("--sap-latency-ms", type=float, default=20)
+    parser.add_argument("--blob-latency-ms", type=float, default=2)
+    parser.add_argument("--blob-connection-string", help="Use this storage (e.g. Azurite) instead of the stand-in")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Optional path for JSON results")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    processes = []
+    try:
+        sap, sap_url = start_server_process(os.path.join(ROOT, "mock_sap_server.py"),
+                                            "--latency-ms", str(args.sap_latency_ms))
+        processes.append(sap)
+        blob_connection_string = args.blob_connection_string
+        if not blob_connection_string:
+            blob, blob_url = start_server_process(os.path.join(ROOT, "mock_blob_server.py"),
+                                                  "--latency-ms", str(args.blob_latency_ms))
+            processes.append(blob)
+            blob_connection_string = connection_string(blob_url)
+
+        os.environ.update({
+            "SAP_BASE_URL": sap_url, "SAP_USER": "load", "SAP_PASS": "load", "TEAMS_WEBHOOK_URL": "",
+            "AZURE_STORAGE_CONNECTION_STRING": blob_connection_string,
+            "BLOB_CONTAINER_NAME": f"approval-load-{uuid.uuid4().hex[:8]}"
+        })
+        logging.getLogger().addHandler(logging.NullHandler())
+        logging.getLogger().setLevel(logging.WARNING)
+
+        from azure.storage.blob import BlobServiceClient
+        import httpx
+        container_client = BlobServiceClient.from_connection_string(blob_connection_string).get_container_client(
+            os.environ["BLOB_CONTAINER_NAME"])
+        container_client.create_container()
+
+        harness = Harness(load_instances(args.instances), args)
+        elapsed = asyncio.run(harness.run())
+        sap_posts = httpx.get(f"{sap_url}/__mock/stats").json()["posts"]
+        checks = verify(harness, container_client, sap_posts)
+        if args.blob_connection_string:
+            container_client.delete_container()
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    calls = sum(len(values) for values in harness.latencies.values())
+    print(f"{args.requests} requests, {calls} calls in {elapsed:.1f}s = {calls / elapsed:.1f} calls/s "
+          f"across {args.instances} instances, peak RSS {peak_rss_mb()} MB")
+    print(f"{'operation':<10}{'calls':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    operations = {}
+    for op, values in harness.latencies.items():
+        if not values:
+            continue
+        operations[op] = {**summarize(values), "errors": harness.errors[op]}
+        stats = operations[op]
+        print(f"{op:<10}{stats['requests']:>8}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+              f"{stats['errors']:>8}")
+    for key, sample in harness.error_samples.items():
+        print(f"first error ({key}): {sample}")
+    print("\nconsistency: " + ", ".join(f"{name} {count}" for name, count in checks.items()))
+    failed = any(count for name, count in checks.items() if name != "reopened")
+    print("FAILED" if failed else "OK")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "seconds": round(elapsed, 3), "calls_per_second": round(calls / elapsed, 1),
+                       "operations": operations, "checks": checks}, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
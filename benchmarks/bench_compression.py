@@ -0,0 +1,152 @@
+"""WAN transfer-time benchmark for compressed SAP feeds and client responses
+
+Serves a synthetic A_SalesOrder Atom feed from a local throttled HTTP server
+(a stand-in for the VPN/hybrid link to the on-prem gateway) and times
+`fetch_odata_response` with and without gzip negotiation. It also measures
+the client-side leg by compressing the resulting JSON-RPC envelope.
+
+Usage:
+    python benchmarks/bench_compression.py --rows 500 2000 --bandwidth-kbps 2000 --rtt-ms 40
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from odata_fixtures import build_atom_feed, synthetic_rows  # noqa: E402
+
+
+class SlowLinkServer:
+    """Minimal HTTP/1.1 server that throttles response bytes to a fixed bandwidth"""
+
+    def __init__(self, bandwidth_kbps: int, rtt_ms: int):
+        self.bytes_per_second = bandwidth_kbps * 1000 / 8
+        self.rtt = rtt_ms / 1000
+        self.feed = b""
+        self.gzip_feed = b""
+        self.server = None
+        self.port = 0
+
+    def set_feed(self, feed: bytes):
+        self.feed = feed
+        self.gzip_feed = gzip.compress(feed, compresslevel=6)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            headers = {}
+            await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            use_gzip = "gzip" in headers.get("accept-encoding", "")
+            body = self.gzip_feed if use_gzip else self.feed
+            head = (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/atom+xml;type=feed\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                + ("Content-Encoding: gzip\r\n" if use_gzip else "")
+                + "Connection: close\r\n\r\n"
+            )
+            await asyncio.sleep(self.rtt)
+            writer.write(head.encode())
+            chunk_size = 16 * 1024
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                await asyncio.sleep(len(chunk) / self.bytes_per_second)
+                writer.write(chunk)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def run(args):
+    link = SlowLinkServer(args.bandwidth_kbps, args.rtt_ms)
+    await link.start()
+    os.environ["SAP_BASE_URL"] = f"http://127.0.0.1:{link.port}"
+    os.environ.setdefault("SAP_USER", "bench")
+    os.environ.setdefault("SAP_PASS", "bench")
+    import function_app
+
+    results = []
+    try:
+        for rows in args.rows:
+            link.set_feed(build_atom_feed("A_SalesOrder", synthetic_rows("A_SalesOrder", rows)))
+            for encoding in ("identity", function_app.SAP_ACCEPT_ENCODING):
+                function_app.SAP_ACCEPT_ENCODING = encoding
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    resp = await function_app.fetch_odata_response("salesorders", f"$top={rows}")
+                    timings.append(time.perf_counter() - started)
+                    assert resp.status_code == 200, resp.get_body()[:200]
+                wire = len(link.gzip_feed) if encoding != "identity" else len(link.feed)
+                results.append({
+                    "leg": "sap_to_function",
+                    "rows": rows,
+                    "encoding": encoding,
+                    "wire_bytes": wire,
+                    "median_seconds": round(sorted(timings)[len(timings) // 2], 4)
+                })
+
+            # Client leg: JSON-RPC envelope back through APIM at the same link speed
+            envelope = json.dumps({
+                "jsonrpc": "2.0", "id": 1,
+                "result": {"content": [{"type": "text", "text": resp.get_body().decode()}]}
+            }).encode()
+            started = time.perf_counter()
+            compressed = gzip.compress(envelope, compresslevel=function_app.RESPONSE_COMPRESSION_LEVEL)
+            compress_seconds = time.perf_counter() - started
+            for label, size, cpu in (("identity", len(envelope), 0.0), ("gzip", len(compressed), compress_seconds)):
+                results.append({
+                    "leg": "function_to_client",
+                    "rows": rows,
+                    "encoding": label,
+                    "wire_bytes": size,
+                    "median_seconds": round(size / link.bytes_per_second + link.rtt + cpu, 4)
+                })
+    finally:
+        await link.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--bandwidth-kbps", type=int, default=4000, help="Simulated link bandwidth")
+    parser.add_argument("--rtt-ms", type=int, default=40, help="Simulated round-trip latency")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Optional path for JSON results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{'leg':<20}{'rows':>8}{'encoding':>16}{'wire bytes':>14}{'seconds':>10}")
+    for r in results:
+        print(f"{r['leg']:<20}{r['rows']:>8}{r['encoding']:>16}{r['wire_bytes']:>14}{r['median_seconds']:>10}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"bandwidth_kbps": args.bandwidth_kbps, "rtt_ms": args.rtt_ms, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""End-to-end throughput and latency against a local mock S/4HANA gateway
+
+Starts `mock_sap_server.py` in a separate process (so its CPU and memory do
+not count against the Function), points SAP_BASE_URL at it and drives the
+Function handlers in-process with concurrent clients:
+
+    mcp query      tools/call query_s4hana on every entity in ALL_ODATA, $top=--top
+    mcp create     tools/call create_s4hana_entity salesorderitems (CSRF fetch + POST)
+    copilot so     POST /api/query-sales-orders
+    copilot bp     POST /api/query-business-partners
+
+For each concurrency level it reports requests per second, p50/p95/p99 latency
+per scenario and overall, error count and peak RSS of this process. Requests
+are built as func.HttpRequest objects, so the Functions host itself (gRPC,
+HTTP front end) is not part of the measurement. Sales order creation is left
+out because it routes to Blob Storage and Teams.
+
+Results are written as JSON with the git revision; pass a previous file to
+--compare to print the change in RPS and p95 per scenario.
+
+Usage:
+    python benchmarks/bench_e2e.py --concurrency 1 8 32 --requests 400 --rows 200 --latency-ms 20 \\
+        --output results/e2e-$(git rev-parse --short HEAD).json --compare results/e2e-main.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from mock_http import start_server_process  # noqa: E402
+from mock_sap_server import add_arguments  # noqa: E402
+
+ORDER_ITEM = {"SalesOrder": "0000000001", "Material": "TG0011", "RequestedQuantity": "5",
+              "RequestedQuantityUnit": "PC"}
+
+
+def start_mock_server(args) -> tuple:
+    return start_server_process(os.path.join(ROOT, "mock_sap_server.py"),
+                                "--rows", str(args.rows), "--page-size", str(args.page_size),
+                                "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                                "--wide-properties", str(args.wide_properties))
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2)
+    }
+
+
+def build_scenarios(fa, top: int) -> list:
+    """(name, handler, route, body) tuples; the mix cycles through them in order"""
+    def tools_call(name, arguments):
+        return json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+                           "params": {"name": name, "arguments": arguments}}).encode()
+
+    scenarios = [("mcp query", fa.mcp_sse_endpoint, "/api/sse",
+                  tools_call("query_s4hana", {"entity": entity, "query": f"$top={top}"}))
+                 for entity in fa.ALL_ODATA]
+    scenarios += [
+        ("mcp create", fa.mcp_sse_endpoint, "/api/sse",
+         tools_call("create_s4hana_entity", {"entity": "salesorderitems", "payload": ORDER_ITEM})),
+        ("copilot so", fa.query_sales_orders_copilot, "/api/query-sales-orders",
+         json.dumps({"customer": "10100001", "top": top}).encode()),
+        ("copilot bp", fa.query_business_partners_copilot, "/api/query-business-partners",
+         json.dumps({"top": top}).encode())
+    ]
+    return scenarios
+
+
+def is_error(response) -> bool:
+    if response.status_code != 200:
+        return True
+    # JSON-RPC errors come back as HTTP 200; tools/call responses carry the handler's outcome
+    return getattr(response, "mcp_outcome", "ok") != "ok"
+
+
+async def run_level(fa, scenarios: list, concurrency: int, total: int) -> dict:
+    import azure.functions as func
+
+    latencies = {name: [] for name, *_ in scenarios}
+    errors = {name: 0 for name, *_ in scenarios}
+    next_index = 0
+
+    async def client():
+        nonlocal next_index
+        while next_index < total:
+            name, handler, route, body = scenarios[next_index % len(scenarios)]
+            next_index += 1
+            req = func.HttpRequest("POST", route, headers={"Content-Type": "application/json"}, body=body)
+            started = time.perf_counter()
+            response = await handler(req)
+            latencies[name].append(time.perf_counter() - started)
+            if is_error(response):
+                errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    everything = [value for values in latencies.values() for value in values]
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(everything) / elapsed, 1),
+        "errors": sum(errors.values()),
+        "peak_rss_mb": peak_rss_mb(),
+        "overall": summarize(everything),
+        "scenarios": {name: {**summarize(values), "errors": errors[name]} for name, values in latencies.items()}
+    }
+
+
+async def run(args, fa) -> list:
+    scenarios = build_scenarios(fa, args.top)
+    # Warm up: imports, HTTP client, connection pool, adaptive limiter
+    await run_level(fa, scenarios, min(args.concurrency), len(scenarios) * 2)
+    return [await run_level(fa, scenarios, concurrency, args.requests) for concurrency in args.concurrency]
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                                  check=True, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "-C", ROOT, "status", "--porcelain", "--", "../function_app.py"],
+                               capture_output=True, text=True).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: list, previous_path: str):
+    with open(previous_path) as f:
+        previous = {level["concurrency"]: level for level in json.load(f)["results"]}
+    print(f"\nvs {previous_path}")
+    print(f"{'concurrency':>11}  {'scenario':<14}{'rps':>16}{'p95 ms':>22}")
+    for level in results:
+        before = previous.get(level["concurrency"])
+        if not before:
+            continue
+        rows = [("overall", level["overall"], before["overall"])]
+        rows += [(name, stats, before["scenarios"][name])
+                 for name, stats in level["scenarios"].items() if name in before["scenarios"]]
+        for name, now, then in rows:
+            rps = f"{before['rps']} -> {level['rps']}" if name == "overall" else ""
+            change = (now["p95_ms"] - then["p95_ms"]) / then["p95_ms"] * 100 if then["p95_ms"] else 0.0
+            print(f"{level['concurrency']:>11}  {name:<14}{rps:>16}{then['p95_ms']:>9} -> {now['p95_ms']:<7}"
+                  f" ({change:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=300, help="Requests per concurrency level")
+    parser.add_argument("--top", type=int, default=50, help="$top for every query")
+    parser.add_argument("--log-level", default="WARNING", help="Root log level while measuring")
+    parser.add_argument("--output", help="Optional path for JSON results")
+    parser.add_argument("--compare", help="Previous JSON results to diff against")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args)
+    try:
+        os.environ["SAP_BASE_URL"] = base_url
+        os.environ.setdefault("SAP_USER", "bench")
+        os.environ.setdefault("SAP_PASS", "bench")
+        os.environ["TEAMS_WEBHOOK_URL"] = ""
+        logging.getLogger().addHandler(logging.NullHandler())
+        logging.getLogger().setLevel(args.log_level)
+        import function_app
+        results = asyncio.run(run(args, function_app))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{'concurrency':>11}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'peak RSS MB':>13}")
+    for level in results:
+        overall = level["overall"]
+        print(f"{level['concurrency']:>11}{level['rps']:>9}{overall['p50_ms']:>9}{overall['p95_ms']:>9}"
+              f"{overall['p99_ms']:>9}{level['errors']:>8}{level['peak_rss_mb']:>13}")
+        for name, stats in level["scenarios"].items():
+            print(f"{'':>11}  {name:<14}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+                  f"{stats['errors']:>8}")
+
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({
+                "revision": git_revision(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+                "results": results
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
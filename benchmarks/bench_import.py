@@ -0,0 +1,115 @@
+"""Cold-start import time of function_app.py, per module, with a budget check
+
+Starts --runs fresh interpreters with `python -X importtime`, each importing
+function_app and answering one tools/list call, as a cold Function worker
+would for its first invocation. It reports the median of:
+
+    import         wall time of `import function_app`
+    first call     tools/list right after the import (any lazy import it hits)
+    per module     cumulative import time of each module function_app imports
+                   directly (children are included in their parent)
+
+The check fails (exit code 1) when the median import exceeds --budget-ms, or
+when a module in --deferred is loaded by the import or by tools/list.
+Those modules (xmltodict, requests, the Storage SDK, azure.identity, pyarrow)
+are only needed by SAP reads, Teams notifications, approvals and Parquet
+exports, so they load on first use. Absolute times depend on the machine; calibrate --budget-ms on the
+CI runner and keep the --deferred check as the portable part.
+
+Usage:
+    python benchmarks/bench_import.py --runs 7 --budget-ms 400
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED = ["xmltodict", "requests", "azure.storage.blob", "azure.identity", "pyarrow"]
+
+PROBE = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import function_app
+imported = time.perf_counter()
+import azure.functions as func
+body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/list"}).encode()
+asyncio.run(function_app.mcp_sse_endpoint(func.HttpRequest("POST", "/api/sse", headers={}, body=body)))
+print(json.dumps({"import_ms": (imported - started) * 1000, "first_call_ms": (time.perf_counter() - imported) * 1000,
+                  "modules": sorted(sys.modules)}))
+"""
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def direct_imports(stderr: str) -> dict:
+    """Cumulative microseconds of each module imported directly by function_app"""
+    children = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        if not indent:
+            # A top-level entry closes the block; function_app's own line ends its children
+            if name == "function_app":
+                return children
+            children = {}
+        elif len(indent) == 2:
+            children[name] = int(cumulative)
+    return children
+
+
+def run_once() -> dict:
+    env = {**os.environ, "SAP_BASE_URL": os.environ.get("SAP_BASE_URL", "http://mock-s4hana:8000"),
+           "TEAMS_WEBHOOK_URL": ""}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    measured["per_module"] = direct_imports(result.stderr)
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=400, help="Maximum median import time")
+    parser.add_argument("--deferred", nargs="*", default=DEFERRED, help="Modules that must not load at start-up")
+    parser.add_argument("--top", type=int, default=15, help="Modules listed in the report")
+    parser.add_argument("--output", help="Optional path for JSON results")
+    args = parser.parse_args()
+
+    # One warm-up run so every measured run reads compiled bytecode from __pycache__
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    first_call_ms = statistics.median(r["first_call_ms"] for r in runs)
+    modules = {name: statistics.median(r["per_module"].get(name, 0) for r in runs) / 1000
+               for name in {name for r in runs for name in r["per_module"]}}
+    loaded = set(runs[-1]["modules"])
+    violations = [name for name in args.deferred if name in loaded]
+
+    print(f"import function_app  {import_ms:8.1f} ms  (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"first tools/list     {first_call_ms:8.1f} ms")
+    print(f"\n{'module':<36}{'ms':>9}{'share':>8}")
+    for name, ms in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{name:<36}{ms:>9.1f}{ms / import_ms * 100:>7.0f}%")
+    print("\ndeferred modules loaded at start-up: " + (", ".join(violations) or "none"))
+
+    failed = import_ms > args.budget_ms or bool(violations)
+    print("FAILED" if failed else "OK")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "import_ms": round(import_ms, 1), "first_call_ms": round(first_call_ms, 1),
+                       "modules_ms": {k: round(v, 1) for k, v in modules.items()}, "deferred_loaded": violations}, f,
+                      indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Per-request logging cost: CPU time and log volume shipped to Application Insights
+
+Runs the same request mix against the current function_app and a baseline
+revision loaded from git (default: the parent commit of the logging overhaul)
+and reports CPU time per request plus records/bytes that reach the root
+logger's handlers. It runs at the Functions default level (Information) and
+at Warning, where eagerly formatted messages still cost CPU although nothing
+is shipped. The byte count is a proxy for Application Insights trace
+ingestion. The current revision is measured with and without sampling.
+
+Request mix (per iteration):
+    tools/call query_s4hana          salesorders, --rows entries
+    tools/call create_s4hana_entity  salesorderitems (CSRF fetch + POST)
+    tools/call create_s4hana_entity  salesorders (approval routing)
+
+SAP is served by an in-process httpx.MockTransport and approval blob writes
+are replaced with a no-op, so only the Function's own work is measured.
+Because XML parsing dominates that mix, the logging-heavy helpers on the
+approval path (clean_sap_payload and the notification senders) are also
+timed on their own with timeit.
+
+Usage:
+    python benchmarks/bench_logging.py --baseline-ref HEAD~1 --iterations 200 --repeat 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from odata_fixtures import build_atom_feed, synthetic_rows  # noqa: E402
+
+os.environ.setdefault("SAP_BASE_URL", "http://mock-s4hana:8000")
+os.environ.setdefault("SAP_USER", "bench")
+os.environ.setdefault("SAP_PASS", "bench")
+os.environ["TEAMS_WEBHOOK_URL"] = ""
+
+SALES_ORDER_PAYLOAD = {
+    "SalesOrderType": "OR", "SalesOrganization": "1710", "DistributionChannel": "10",
+    "OrganizationDivision": "00", "SoldToParty": "10100001", "PurchaseOrderByCustomer": "PO-4711",
+    "TransactionCurrency": "USD", "RequestedDeliveryDate": "2025-03-01", "PricingDate": "2025-02-01",
+    "justification": "Quarterly replenishment for the west region distribution centre",
+    "created_by": "copilot.user@contoso.com", "contact_email": "buyer@contoso.com",
+    "contact_phone": "+1 555 0100", "notes": "Deliver to dock 4 " * 20,
+    "to_Item": [{"Material": f"TG{i:04d}", "RequestedQuantity": str(i + 1)} for i in range(20)]
+}
+
+
+class CountingHandler(logging.Handler):
+    """Formats every record like the Functions host would and counts the bytes"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        self.records = 0
+        self.bytes = 0
+
+    def emit(self, record):
+        self.records += 1
+        self.bytes += len(self.format(record).encode("utf-8"))
+
+
+def load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_baseline(ref: str, workdir: str):
+    source = subprocess.run(["git", "-C", ROOT, "show", f"{ref}:function_app.py"],
+                            check=True, capture_output=True, text=True).stdout
+    path = os.path.join(workdir, "function_app_baseline.py")
+    with open(path, "w") as f:
+        f.write(source)
+    return load_module("function_app_baseline", path)
+
+
+def sap_transport(feed: bytes):
+    import httpx
+
+    def handler(request):
+        if request.method == "POST":
+            return httpx.Response(201, json={"d": json.loads(request.content)})
+        if request.headers.get("X-CSRF-Token") == "Fetch":
+            return httpx.Response(200, headers={"X-CSRF-Token": "bench-token"}, json={"d": {"results": []}})
+        return httpx.Response(200, content=feed, headers={"Content-Type": "application/atom+xml"})
+    return httpx.MockTransport(handler)
+
+
+async def run_mix(fa, iterations: int, feed: bytes):
+    import azure.functions as func
+    import httpx
+
+    async def no_blob(request_id, request_data):
+        return True
+
+    fa.save_approval_request_to_blob = no_blob
+    fa._sap_http_client = httpx.AsyncClient(transport=sap_transport(feed))
+    fa._sap_http_client_loop = asyncio.get_running_loop()
+
+    calls = [
+        {"name": "query_s4hana", "arguments": {"entity": "salesorders", "query": "$top=50"}},
+        {"name": "create_s4hana_entity", "arguments": {"entity": "salesorderitems",
+                                                       "payload": SALES_ORDER_PAYLOAD["to_Item"][0]}},
+        {"name": "create_s4hana_entity", "arguments": {"entity": "salesorders", "payload": SALES_ORDER_PAYLOAD}},
+    ]
+    bodies = [json.dumps({"jsonrpc": "2.0", "id": i, "method": "tools/call", "params": p}).encode()
+              for i, p in enumerate(calls)]
+
+    started = time.process_time()
+    for _ in range(iterations):
+        for body in bodies:
+            req = func.HttpRequest("POST", "/api/sse", headers={}, body=body)
+            resp = await fa.mcp_sse_endpoint(req)
+            assert resp.status_code == 200, resp.get_body()[:200]
+    cpu = time.process_time() - started
+    await fa._sap_http_client.aclose()
+    return cpu
+
+
+def set_sampling(fa, per_minute: int):
+    for category in fa.LOG_CATEGORIES:
+        for f in fa.get_logger(category).filters:
+            if isinstance(f, fa.RateLimitedSampler):
+                f.per_minute = per_minute
+                f.windows.clear()
+
+
+def measure(fa, iterations: int, feed: bytes, level: int = logging.INFO) -> dict:
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    counter = CountingHandler()
+    root.addHandler(counter)
+    try:
+        cpu = asyncio.run(run_mix(fa, iterations, feed))
+    finally:
+        root.removeHandler(counter)
+    requests = iterations * 3
+    return {
+        "cpu_ms_per_request": round(cpu * 1000 / requests, 3),
+        "records_per_request": round(counter.records / requests, 2),
+        "log_bytes_per_request": round(counter.bytes / requests)
+    }
+
+
+def time_helpers(fa, level: int, number: int = 2000) -> float:
+    """Microseconds per approval-path helper round (payload cleanup + notifications)"""
+    import timeit
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(CountingHandler())
+    teams_data = {"request_id": "SO-REQ-1", "customer": "10100001", "justification": SALES_ORDER_PAYLOAD["justification"]}
+
+    def helpers():
+        fa.clean_sap_payload(SALES_ORDER_PAYLOAD)
+        fa.send_notification("approver@contoso.com", "Sales Order Approval Required", SALES_ORDER_PAYLOAD["notes"])
+        fa.send_teams_notification("", teams_data)
+
+    return min(timeit.repeat(helpers, number=number, repeat=5)) * 1e6 / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline-ref", default="HEAD~1", help="git revision of the baseline function_app.py")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=5, help="Sales orders in the mocked query response")
+    parser.add_argument("--output", help="Optional path for JSON results")
+    args = parser.parse_args()
+
+    feed = build_atom_feed("A_SalesOrder", synthetic_rows("A_SalesOrder", args.rows))
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = load_baseline(args.baseline_ref, workdir)
+        current = load_module("function_app", os.path.join(ROOT, "function_app.py"))
+        # Warm up both (imports, lazy clients) before measuring
+        measure(baseline, 5, feed)
+        measure(current, 5, feed)
+        configs = []
+        for level in (logging.INFO, logging.WARNING):
+            configs += [(f"baseline ({args.baseline_ref})", baseline, level, None),
+                        ("current, no sampling", current, level, 0),
+                        ("current", current, level, current.LOG_SAMPLE_PER_MINUTE)]
+        # Interleave repeats and keep the fastest run of each configuration to damp noise
+        best = {}
+        for _ in range(args.repeat):
+            for name, fa, level, per_minute in configs:
+                if per_minute is not None:
+                    set_sampling(fa, per_minute)
+                result = measure(fa, args.iterations, feed, level)
+                key = (name, logging.getLevelName(level))
+                if key not in best or result["cpu_ms_per_request"] < best[key]["cpu_ms_per_request"]:
+                    best[key] = result
+        results = [{"revision": name, "level": level, **r} for (name, level), r in best.items()]
+
+        set_sampling(current, 0)
+        helper_results = []
+        for level in (logging.INFO, logging.WARNING):
+            for name, fa in ((f"baseline ({args.baseline_ref})", baseline), ("current, no sampling", current)):
+                helper_results.append({"revision": name, "level": logging.getLevelName(level),
+                                       "helper_us": round(time_helpers(fa, level), 1)})
+
+    print(f"{'revision':<24}{'level':>9}{'cpu ms/req':>12}{'records/req':>13}{'log bytes/req':>15}")
+    for r in results:
+        print(f"{r['revision']:<24}{r['level']:>9}{r['cpu_ms_per_request']:>12}"
+              f"{r['records_per_request']:>13}{r['log_bytes_per_request']:>15}")
+    print(f"\n{'revision':<24}{'level':>9}{'approval helpers us':>21}")
+    for r in helper_results:
+        print(f"{r['revision']:<24}{r['level']:>9}{r['helper_us']:>21}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"iterations": args.iterations, "rows": args.rows, "results": results,
+                       "helpers": helper_results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
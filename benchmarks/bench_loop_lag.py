@@ -0,0 +1,162 @@
+"""Event-loop lag under a mix of large and small SAP reads
+
+Drives `query_s4hana` against `mock_sap_server.py` with --concurrency clients,
+where --large-ratio of the calls read --large-top sales orders (a feed of
+several hundred KB) and the rest read --small-top. Meanwhile a probe task
+sleeps --probe-ms in a loop and records how late it wakes up: that lateness
+is the time every other call on the worker was stalled.
+
+Each --modes entry runs in a fresh interpreter with the matching settings:
+
+    inline    SAP_PARSE_WORKERS=0, every feed parsed on the event loop (the old behaviour)
+    thread    large feeds parsed in the thread pool
+    process   large feeds parsed in the process pool
+
+and reports loop lag p50/p95/p99/max, small- and large-read latency, calls
+per second and how many parses ran where. With threads, xmltodict still holds
+the GIL, so the CPU is shared rather than added. However, the loop gets a turn
+every switch interval instead of waiting for the whole parse. A process pool
+adds real cores at the cost of shipping the result back.
+
+Usage:
+    python benchmarks/bench_loop_lag.py --requests 400 --concurrency 16 --large-ratio 0.1 --large-top 3000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import is_error, peak_rss_mb, percentile, summarize  # noqa: E402
+from mock_http import start_server_process  # noqa: E402
+
+MODES = {
+    "inline": {"SAP_PARSE_WORKERS": "0"},
+    "thread": {"SAP_PARSE_EXECUTOR": "thread"},
+    "process": {"SAP_PARSE_EXECUTOR": "process"}
+}
+
+
+async def probe(interval: float, samples: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+async def workload(fa, args) -> dict:
+    import azure.functions as func
+
+    rng = random.Random(args.seed)
+    kinds = ["large" if rng.random() < args.large_ratio else "small" for _ in range(args.requests)]
+    bodies = {kind: json.dumps({"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {
+        "name": "query_s4hana", "arguments": {"entity": "salesorders", "query": f"$top={top}"}}}).encode()
+        for kind, top in (("large", args.large_top), ("small", args.small_top))}
+    latencies = {"large": [], "small": []}
+    errors = 0
+    lag, stop = [], asyncio.Event()
+    pending = iter(kinds)
+
+    async def client():
+        nonlocal errors
+        for kind in pending:
+            started = time.perf_counter()
+            response = await fa.mcp_sse_endpoint(func.HttpRequest("POST", "/api/sse", headers={}, body=bodies[kind]))
+            latencies[kind].append(time.perf_counter() - started)
+            errors += is_error(response)
+
+    # Warm up connections, CSRF-free read path and the pool before measuring
+    await fa.mcp_sse_endpoint(func.HttpRequest("POST", "/api/sse", headers={}, body=bodies["large"]))
+    probe_task = asyncio.create_task(probe(args.probe_ms / 1000, lag, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    ordered = sorted(lag)
+    return {
+        "seconds": round(elapsed, 3),
+        "calls_per_second": round(args.requests / elapsed, 1),
+        "loop_lag": {**summarize(ordered), "max_ms": round(ordered[-1] * 1000, 2) if ordered else 0,
+                     "p999_ms": round(percentile(ordered, 99.9) * 1000, 2) if ordered else 0},
+        "small": summarize(latencies["small"]),
+        "large": summarize(latencies["large"]),
+        "errors": errors,
+        "parses": {key[0]: int(value) for key, value in fa.SAP_FEED_PARSES_TOTAL.series.items()},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def run_child(args):
+    """One mode in this interpreter; prints its results as the last line of stdout"""
+    os.environ.update({"SAP_BASE_URL": args.sap_url, "SAP_USER": "bench", "SAP_PASS": "bench",
+                       "TEAMS_WEBHOOK_URL": "", "ODATA_MAX_TOP": str(max(args.large_top, 1000)),
+                       "SAP_PARSE_OFFLOAD_BYTES": str(args.offload_bytes), **MODES[args.child]})
+    logging.getLogger().addHandler(logging.NullHandler())
+    logging.getLogger().setLevel(logging.WARNING)
+    import function_app
+    print(json.dumps(asyncio.run(workload(function_app, args))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--requests", type=int, default=300, help="Calls per mode")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--large-ratio", type=float, default=0.1, help="Share of calls reading --large-top rows")
+    parser.add_argument("--large-top", type=int, default=3000)
+    parser.add_argument("--small-top", type=int, default=5)
+    parser.add_argument("--offload-bytes", type=int, default=262144, help="SAP_PARSE_OFFLOAD_BYTES for the run")
+    parser.add_argument("--probe-ms", type=float, default=5, help="Sleep interval of the lag probe")
+    parser.add_argument("--latency-ms", type=float, default=10, help="Mock SAP round trip")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Optional path for JSON results")
+    parser.add_argument("--child", choices=list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument("--sap-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    sap, sap_url = start_server_process(os.path.join(ROOT, "mock_sap_server.py"),
+                                        "--rows", str(max(args.large_top, args.small_top)),
+                                        "--latency-ms", str(args.latency_ms))
+    results = {}
+    try:
+        for mode in args.modes:
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--child", mode,
+                                    "--sap-url", sap_url], capture_output=True, text=True, check=True)
+            results[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+    finally:
+        sap.terminate()
+        sap.wait()
+
+    print(f"{args.requests} calls per mode, {args.concurrency} clients, {args.large_ratio:.0%} reading "
+          f"{args.large_top} rows, the rest {args.small_top}")
+    print(f"{'mode':<9}{'calls/s':>8}{'lag p50':>9}{'p99':>8}{'max':>8}{'small p50':>11}{'p99':>8}"
+          f"{'large p50':>11}{'p99':>8}{'errors':>8}  parses")
+    for mode, result in results.items():
+        lag, small, large = result["loop_lag"], result["small"], result["large"]
+        parses = ", ".join(f"{name} {count}" for name, count in sorted(result["parses"].items()))
+        print(f"{mode:<9}{result['calls_per_second']:>8}{lag['p50_ms']:>9}{lag['p99_ms']:>8}{lag['max_ms']:>8}"
+              f"{small['p50_ms']:>11}{small['p99_ms']:>8}{large['p50_ms']:>11}{large['p99_ms']:>8}"
+              f"{result['errors']:>8}  {parses}")
+    print("(milliseconds; lag is how late a --probe-ms sleep on the event loop woke up)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "modes": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Per-stage CPU time and memory of the OData read path
+
+Times each stage `query_s4hana` runs on a feed, in isolation and in order,
+using the output of the previous stage as input:
+
+    xmltodict.parse      fetch_odata_response: Atom feed -> nested dicts
+    extract properties   fetch_odata_response: feed/entry/content/m:properties
+    json.dumps rows      fetch_odata_response: rows -> function response body
+    re-parse + indent    handle_query_tool: json.loads of that body, json.dumps(indent=2)
+    envelope json.dumps  handle_query_tool: JSON-RPC envelope with the text content
+    envelope gzip        compress_response for clients sending Accept-Encoding: gzip
+
+The stages mirror the code as it stands; the last row runs the real
+fetch_odata_response + handle_query_tool (SAP served by httpx.MockTransport,
+no gzip) so a change to function_app.py shows up there even before the stage
+list is updated. Shares are relative to the sum of the stages and the
+dominant stage is marked with `<`. Times are the fastest of --repeat runs;
+memory is the tracemalloc peak of a single run above what was allocated
+before it.
+
+Feeds come in two shapes: narrow (the A_SalesOrder properties) and wide (the
+same plus --extra-properties filler columns, like SAP rows with custom fields).
+Wide feeds above --wide-max-rows are skipped; at 100k rows they need several
+GB for the parsed tree alone.
+
+Usage:
+    python benchmarks/bench_parse.py --rows 10 100 1000 10000 100000 --output parse.json
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from odata_fixtures import ENTITY_SCHEMAS, build_atom_feed, synthetic_rows, wide_schema  # noqa: E402
+
+os.environ.setdefault("SAP_BASE_URL", "http://mock-s4hana:8000")
+os.environ.setdefault("SAP_USER", "bench")
+os.environ.setdefault("SAP_PASS", "bench")
+# Large feeds are slow by design here; keep the slow-query log quiet
+os.environ.setdefault("SLOW_QUERY_THRESHOLD_SECONDS", "3600")
+
+
+def stage_functions(fa) -> list:
+    """(name, fn) pairs; each fn takes the previous stage's output"""
+    import xmltodict
+
+    def extract(parsed):
+        entries = parsed.get("feed", {}).get("entry", [])
+        if isinstance(entries, dict):
+            entries = [entries]
+        return [entry.get("content", {}).get("m:properties", {}) for entry in entries]
+
+    def reparse(body):
+        return json.dumps(json.loads(body.decode()), indent=2)
+
+    def envelope(text):
+        return json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}]}}).encode()
+
+    return [
+        ("xmltodict.parse", xmltodict.parse),
+        ("extract properties", extract),
+        ("json.dumps rows", lambda rows: json.dumps(rows).encode()),
+        ("re-parse + indent", reparse),
+        ("envelope json.dumps", envelope),
+        ("envelope gzip", lambda body: gzip.compress(body, compresslevel=fa.RESPONSE_COMPRESSION_LEVEL, mtime=0))
+    ]
+
+
+def time_call(fn, arg, repeat: int, budget: float) -> float:
+    """Fastest of `repeat` runs; small inputs are looped to fill `budget` seconds per run"""
+    started = time.perf_counter()
+    fn(arg)
+    single = time.perf_counter() - started
+    number = max(1, min(1000, int(budget / max(single, 1e-7))))
+    best = single
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn(arg)
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def peak_memory(fn, arg) -> int:
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(arg)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def actual_read_path(fa, feed: bytes):
+    """Callable running the real query_s4hana handler against `feed`"""
+    import httpx
+
+    loop = asyncio.new_event_loop()
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, content=feed, headers={"Content-Type": "application/atom+xml"}))
+
+    async def call():
+        if fa._sap_http_client is None or fa._sap_http_client_loop is not loop:
+            fa._sap_http_client = httpx.AsyncClient(transport=transport)
+            fa._sap_http_client_loop = loop
+        response = await fa.handle_query_tool(1, {"entity": "salesorders", "query": "$top=100000"})
+        assert b'"result"' in response.get_body()[:64], response.get_body()[:200]
+        return response
+
+    def run(_):
+        return loop.run_until_complete(call())
+
+    def close():
+        loop.run_until_complete(fa._sap_http_client.aclose())
+        fa._sap_http_client = None
+        loop.close()
+    return run, close
+
+
+def measure(fa, shape: str, rows: int, schema: list, args) -> list:
+    feed = build_atom_feed("A_SalesOrder", synthetic_rows("A_SalesOrder", rows, schema=schema))
+    results = []
+    value = feed
+    for name, fn in stage_functions(fa):
+        seconds = time_call(fn, value, args.repeat, args.budget)
+        memory = peak_memory(fn, value)
+        results.append({"stage": name, "seconds": seconds, "peak_bytes": memory})
+        value = fn(value)
+    run, close = actual_read_path(fa, feed)
+    try:
+        seconds = time_call(run, None, args.repeat, args.budget)
+        memory = peak_memory(run, None)
+    finally:
+        close()
+    results.append({"stage": "query_s4hana (actual)", "seconds": seconds, "peak_bytes": memory})
+    return [{"shape": shape, "rows": rows, "feed_bytes": len(feed), **r} for r in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--shapes", nargs="+", choices=["narrow", "wide"], default=["narrow", "wide"])
+    parser.add_argument("--extra-properties", type=int, default=60, help="Filler columns in the wide shape")
+    parser.add_argument("--wide-max-rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=0.2, help="Seconds per timing run for small inputs")
+    parser.add_argument("--output", help="Optional path for JSON results")
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    import function_app
+
+    schemas = {"narrow": ENTITY_SCHEMAS["A_SalesOrder"], "wide": wide_schema("A_SalesOrder", args.extra_properties)}
+    results = []
+    print(f"{'shape':<7}{'rows':>8}{'feed MB':>9}  {'stage':<24}{'ms':>11}{'share':>8}{'peak MB':>10}")
+    for shape in args.shapes:
+        for rows in args.rows:
+            if shape == "wide" and rows > args.wide_max_rows:
+                continue
+            measured = measure(function_app, shape, rows, schemas[shape], args)
+            stages_total = sum(r["seconds"] for r in measured[:-1])
+            dominant = max(measured[:-1], key=lambda r: r["seconds"])["stage"]
+            for r in measured:
+                r["share"] = round(r["seconds"] / stages_total, 3)
+                marker = " <" if r["stage"] == dominant else ""
+                print(f"{shape:<7}{rows:>8}{r['feed_bytes'] / 1e6:>9.2f}  {r['stage']:<24}{r['seconds'] * 1000:>11.3f}"
+                      f"{r['share'] * 100:>7.0f}%{r['peak_bytes'] / 1e6:>10.2f}{marker}")
+            print()
+            results += measured
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
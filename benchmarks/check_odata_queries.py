@@ -0,0 +1,61 @@
+"""Query guard and replica planner check on tricky OData query strings
+
+Runs each case through prepare_odata_query (what SAP receives) and, for
+Business Partner reads, BpReplica._plan (what SQLite is asked), and checks
+the values survive: literals with `+` (time zone offsets), `&` and `%`
+inside quotes, percent-encoded input and custom options. No SAP or blob
+service is needed. Exits with 1 when any case fails.
+
+Usage:
+    python benchmarks/check_odata_queries.py
+"""
+import os
+import sys
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (entity, client query, $filter SAP must receive after decoding)
+GUARD_CASES = [
+    ("salesorders", "$filter=LastChangeDateTime ge datetimeoffset'2024-01-01T00:00:00+01:00'",
+     "LastChangeDateTime ge datetimeoffset'2024-01-01T00:00:00+01:00'"),
+    ("salesorders", "$filter=LastChangeDateTime ge datetimeoffset'2024-01-01T00:00:00%2B01:00'",
+     "LastChangeDateTime ge datetimeoffset'2024-01-01T00:00:00+01:00'"),
+    ("salesorders", "$filter=PurchaseOrderByCustomer eq 'A%26B+C'", "PurchaseOrderByCustomer eq 'A&B+C'"),
+    ("salesorders", "$filter=PurchaseOrderByCustomer eq '100%25'", "PurchaseOrderByCustomer eq '100%'"),
+    ("businesspartners", "?$filter=SearchTerm1 eq 'R+D'&sap-client=100", "SearchTerm1 eq 'R+D'")
+]
+
+# (entity, client query, SQL parameters the replica must bind before LIMIT/OFFSET)
+REPLICA_CASES = [
+    ("businesspartners", "$filter=SearchTerm1 eq 'R+D'&$top=5", ["R+D"]),
+    ("customers", "$filter=startswith(CustomerName,'A%26B+')&$top=5", ["A&B+", "A&B+" + chr(0x10FFFF)])
+]
+
+
+def main():
+    os.environ.setdefault("TEAMS_WEBHOOK_URL", "")
+    import function_app as fa
+
+    failures = 0
+    for entity, query, expected in GUARD_CASES:
+        prepared, _ = fa.prepare_odata_query(entity, query)
+        sent = dict(fa.split_odata_query(prepared)).get("$filter")
+        ok = sent == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} guard    {query}\n         -> {urllib.parse.unquote(prepared)}")
+
+    replica = fa.BpReplica(":memory:", 3600)
+    for entity, query, expected in REPLICA_CASES:
+        plan = replica._plan(entity, query, {"properties": set()})
+        params = plan[1][:-2] if plan else None
+        ok = params == expected
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} replica  {query}\n         -> {params}")
+
+    print("FAILED" if failures else "OK")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Local Azure Blob Storage stand-in (Azurite-compatible subset)
+
+Implements the Blob REST calls the Function makes, path-style like Azurite
+(/devstoreaccount1/<container>/<blob>), in memory:
+
+    PUT/GET/HEAD/DELETE   container (?restype=container), list (&comp=list&prefix=)
+    PUT/GET/HEAD/DELETE   block blob, with ranged GET
+    PUT                   staged upload (&comp=block&blockid=, then &comp=blocklist)
+    If-Match / If-None-Match on blob reads and writes (412 ConditionNotMet,
+    409 BlobAlreadyExists), with a fresh ETag on every write
+
+Requests are not authenticated. Point the Function at it with the connection
+string printed on start-up (the Azurite development account). Real Azurite
+works just as well wherever the harnesses accept a connection string.
+
+Usage:
+    python benchmarks/mock_blob_server.py --port 10000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import re
+import sys
+import uuid
+from email.utils import formatdate
+from urllib.parse import parse_qsl, unquote
+from xml.sax.saxutils import escape
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_http import MockHttpServer  # noqa: E402
+
+ACCOUNT = "devstoreaccount1"
+# Well-known Azurite development key; the stand-in does not check signatures
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+
+def connection_string(base_url: str) -> str:
+    return (f"DefaultEndpointsProtocol=http;AccountName={ACCOUNT};AccountKey={ACCOUNT_KEY};"
+            f"BlobEndpoint={base_url}/{ACCOUNT};")
+
+
+class MockBlobStorage(MockHttpServer):
+    """In-memory block blobs with ETag preconditions"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0):
+        super().__init__(latency_ms, jitter_ms)
+        self.containers = {}
+        self.uncommitted = {}
+        self.precondition_failures = 0
+        self._etag = 0
+
+    def _next_etag(self) -> str:
+        self._etag += 1
+        return f'"0x8DC{self._etag:013X}"'
+
+    def _error(self, status: int, code: str, message: str, headers: dict) -> tuple:
+        headers.update({"x-ms-error-code": code, "Content-Type": "application/xml"})
+        body = f'<?xml version="1.0" encoding="utf-8"?><Error><Code>{code}</Code><Message>{message}</Message></Error>'
+        return status, headers, body.encode()
+
+    def respond(self, method: str, target: str, headers: dict, body: bytes) -> tuple:
+        path, _, query = target.partition("?")
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        response_headers = {
+            "x-ms-request-id": str(uuid.uuid4()),
+            "x-ms-version": headers.get("x-ms-version", "2021-08-06"),
+            "Date": formatdate(usegmt=True)
+        }
+        if path == "/__mock/stats":
+            stats = {"requests": self.requests, "precondition_failures": self.precondition_failures,
+                     "blobs": {name: len(blobs) for name, blobs in self.containers.items()}}
+            return 200, {"Content-Type": "application/json"}, json.dumps(stats).encode()
+
+        account, _, rest = unquote(path).lstrip("/").partition("/")
+        container, _, blob_name = rest.partition("/")
+        if account != ACCOUNT or not container:
+            return self._error(400, "InvalidUri", "Only path-style container and blob URIs are supported",
+                               response_headers)
+        if not blob_name and params.get("restype") == "container":
+            return self._container(method, container, params, response_headers)
+        blobs = self.containers.get(container)
+        if blobs is None:
+            return self._error(404, "ContainerNotFound", "The specified container does not exist.", response_headers)
+        if method == "PUT" and params.get("comp") in ("block", "blocklist"):
+            return self._block(params, container, blobs, blob_name, headers, body, response_headers)
+        return self._blob(method, blobs, blob_name, headers, body, response_headers)
+
+    def _container(self, method: str, container: str, params: dict, response_headers: dict) -> tuple:
+        if method == "PUT":
+            if container in self.containers:
+                return self._error(409, "ContainerAlreadyExists", "The specified container already exists.",
+                                   response_headers)
+            self.containers[container] = {}
+            response_headers.update({"ETag": self._next_etag(), "Last-Modified": formatdate(usegmt=True)})
+            return 201, response_headers, b""
+        if container not in self.containers:
+            return self._error(404, "ContainerNotFound", "The specified container does not exist.", response_headers)
+        if method == "DELETE":
+            del self.containers[container]
+            return 202, response_headers, b""
+        if params.get("comp") == "list":
+            return self._list(container, params.get("prefix", ""), response_headers)
+        response_headers.update({"ETag": '"0x8DC0000000000000"', "Last-Modified": formatdate(usegmt=True),
+                                 "x-ms-lease-state": "available", "x-ms-lease-status": "unlocked"})
+        return 200, response_headers, b""
+
+    def _list(self, container: str, prefix: str, response_headers: dict) -> tuple:
+        entries = []
+        for name, blob in sorted(self.containers[container].items()):
+            if not name.startswith(prefix):
+                continue
+            entries.append(
+                f"<Blob><Name>{escape(name)}</Name><Properties><Last-Modified>{blob['last_modified']}</Last-Modified>"
+                f"<Etag>{blob['etag']}</Etag><Content-Length>{len(blob['data'])}</Content-Length>"
+                f"<Content-Type>{blob['content_type']}</Content-Type><BlobType>BlockBlob</BlobType>"
+                f"</Properties></Blob>")
+        body = (f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ServiceEndpoint="http://127.0.0.1/{ACCOUNT}"'
+                f' ContainerName="{container}"><Prefix>{escape(prefix)}</Prefix><Blobs>{"".join(entries)}</Blobs>'
+                f"<NextMarker /></EnumerationResults>")
+        response_headers["Content-Type"] = "application/xml"
+        return 200, response_headers, body.encode()
+
+    def _block(self, params: dict, container: str, blobs: dict, name: str, headers: dict, body: bytes,
+               response_headers: dict) -> tuple:
+        staged = self.uncommitted.setdefault((container, name), {})
+        if params["comp"] == "block":
+            staged[base64.b64decode(params.get("blockid", ""))] = body
+            return 201, response_headers, b""
+        block_ids = [base64.b64decode(block_id) for block_id in
+                     re.findall(rb"<(?:Latest|Uncommitted|Committed)>([^<]*)</", body)]
+        missing = [block_id for block_id in block_ids if block_id not in staged]
+        if missing:
+            return self._error(400, "InvalidBlockList", "The specified block list is invalid.", response_headers)
+        blob = {"data": b"".join(staged[block_id] for block_id in block_ids), "etag": self._next_etag(),
+                "last_modified": formatdate(usegmt=True),
+                "content_type": headers.get("x-ms-blob-content-type", "application/octet-stream")}
+        blobs[name] = blob
+        del self.uncommitted[(container, name)]
+        response_headers.update({"ETag": blob["etag"], "Last-Modified": blob["last_modified"],
+                                 "x-ms-request-server-encrypted": "true"})
+        return 201, response_headers, b""
+
+    def _blob(self, method: str, blobs: dict, name: str, headers: dict, body: bytes, response_headers: dict) -> tuple:
+        blob = blobs.get(name)
+        if_match = headers.get("if-match")
+        if_none_match = headers.get("if-none-match")
+        if if_match and (blob is None or if_match not in ("*", blob["etag"])):
+            self.precondition_failures += 1
+            return self._error(412, "ConditionNotMet", "The condition specified using HTTP conditional header(s) "
+                               "is not met.", response_headers)
+        if if_none_match and blob is not None and if_none_match in ("*", blob["etag"]):
+            self.precondition_failures += 1
+            if method == "PUT":
+                return self._error(409, "BlobAlreadyExists", "The specified blob already exists.", response_headers)
+            return self._error(412 if if_none_match == "*" else 304, "ConditionNotMet",
+                               "The condition specified using HTTP conditional header(s) is not met.",
+                               response_headers)
+
+        if method == "PUT":
+            blob = {"data": body, "etag": self._next_etag(), "last_modified": formatdate(usegmt=True),
+                    "content_type": headers.get("x-ms-blob-content-type", "application/octet-stream")}
+            blobs[name] = blob
+            response_headers.update({"ETag": blob["etag"], "Last-Modified": blob["last_modified"],
+                                     "x-ms-request-server-encrypted": "true"})
+            return 201, response_headers, b""
+        if blob is None:
+            return self._error(404, "BlobNotFound", "The specified blob does not exist.", response_headers)
+        if method == "DELETE":
+            del blobs[name]
+            return 202, response_headers, b""
+
+        data = blob["data"]
+        response_headers.update({"ETag": blob["etag"], "Last-Modified": blob["last_modified"],
+                                 "Content-Type": blob["content_type"], "x-ms-blob-type": "BlockBlob",
+                                 "Accept-Ranges": "bytes", "x-ms-server-encrypted": "true"})
+        if method == "HEAD":
+            response_headers["x-ms-content-length"] = str(len(data))
+            return 200, response_headers, data
+        byte_range = headers.get("x-ms-range") or headers.get("range")
+        if not byte_range:
+            return 200, response_headers, data
+        start, _, end = byte_range.partition("=")[2].partition("-")
+        start = int(start)
+        end = min(int(end) if end else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            response_headers["Content-Range"] = f"bytes */{len(data)}"
+            return self._error(416, "InvalidRange", "The range specified is invalid for the current size of the "
+                               "resource.", response_headers)
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return 206, response_headers, data[start:end + 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10000, help="0 picks a free port")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fixed delay before every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Additional uniform random delay")
+    args = parser.parse_args()
+
+    async def serve():
+        storage = MockBlobStorage(args.latency_ms, args.jitter_ms)
+        await storage.start(args.host, args.port)
+        print(f"LISTENING http://{args.host}:{storage.port}", flush=True)
+        print(f"AZURE_STORAGE_CONNECTION_STRING={connection_string(f'http://{args.host}:{storage.port}')}", flush=True)
+        await storage.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Shared plumbing for the local HTTP stand-ins used by the benchmarks"""
+import asyncio
+import gzip
+import random
+import subprocess
+import sys
+
+REASONS = {200: "OK", 201: "Created", 202: "Accepted", 206: "Partial Content", 304: "Not Modified",
+           400: "Bad Request", 403: "Forbidden", 404: "Not Found", 409: "Conflict", 412: "Precondition Failed",
+           416: "Range Not Satisfiable"}
+
+
+class MockHttpServer:
+    """asyncio HTTP/1.1 server with keep-alive; subclasses implement respond()"""
+
+    # Gzip responses above 1 KB when the client accepts it
+    compress = False
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.requests = 0
+        self.server = None
+        self.port = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def respond(self, method: str, target: str, headers: dict, body: bytes) -> tuple:
+        """Return (status, headers, body) for one request"""
+        raise NotImplementedError
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+
+                self.requests += 1
+                if self.latency or self.jitter:
+                    await asyncio.sleep(self.latency + random.random() * self.jitter)
+                status, response_headers, payload = self.respond(method, target, headers, body)
+
+                if self.compress and "gzip" in headers.get("accept-encoding", "") and len(payload) > 1024:
+                    payload = gzip.compress(payload, compresslevel=6)
+                    response_headers["Content-Encoding"] = "gzip"
+                keep_alive = headers.get("connection", "").lower() != "close"
+                head = [f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}", f"Content-Length: {len(payload)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f"{k}: {v}" for k, v in response_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (b"" if method == "HEAD" else payload))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def start_server_process(script: str, *args: str) -> tuple:
+    """Run a stand-in on a free port in its own process; returns (process, base URL)"""
+    process = subprocess.Popen([sys.executable, script, "--port", "0", *args], stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("LISTENING "):
+        process.kill()
+        raise RuntimeError(f"{script} failed to start: {line!r}")
+    return process, line.split()[1]
@@ -0,0 +1,170 @@
+"""Local SAP Gateway stand-in serving synthetic OData V2 feeds
+
+Serves every entity set in `odata_fixtures.ENTITY_SCHEMAS` (all of
+`ALL_ODATA`) under /sap/opu/odata/sap/<SERVICE>/<EntitySet>:
+
+    GET   Atom feed, or JSON (verbose) for `$format=json` / `Accept: application/json`;
+          honours $top and $skip, pages with a `next` link ($skiptoken) beyond
+          --page-size, and gzips when the client accepts it
+    GET   $metadata returns EDMX for all of them with an ETag (304 on If-None-Match)
+    GET   with `X-CSRF-Token: Fetch` returns a token and session cookie
+    POST  requires that token and echoes the payload back as 201 Created
+    GET   /__mock/stats returns request and create counts (per entity set and
+          PurchaseOrderByCustomer) so harnesses can check for duplicate creates
+
+Every response is delayed by --latency-ms (+ up to --jitter-ms) to model the
+gateway round trip. HTTP/1.1 keep-alive is supported so connection pooling in
+the Function behaves as it would against a real gateway.
+
+Usage:
+    python benchmarks/mock_sap_server.py --port 8000 --rows 1000 --page-size 500 --latency-ms 50
+    SAP_BASE_URL=http://127.0.0.1:8000 func start
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import uuid
+import zlib
+from collections import Counter
+from urllib.parse import parse_qsl, unquote, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_http import MockHttpServer  # noqa: E402
+from odata_fixtures import (ENTITY_KEYS, ENTITY_SCHEMAS, build_atom_feed, build_json_feed,  # noqa: E402
+                            build_metadata, synthetic_rows, wide_schema)
+
+SERVICE_PREFIX = "/sap/opu/odata/sap/"
+
+
+class MockSapGateway(MockHttpServer):
+    """SAP Gateway OData V2 semantics on top of MockHttpServer"""
+
+    compress = True
+
+    def __init__(self, rows: int = 100, page_size: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 wide_properties: int = 0, seed: int = 42):
+        super().__init__(latency_ms, jitter_ms)
+        self.rows = rows
+        self.page_size = page_size
+        self.wide_properties = wide_properties
+        self.seed = seed
+        self.csrf_token = uuid.uuid4().hex
+        # Creates per "<EntitySet>:<PurchaseOrderByCustomer>" so harnesses can detect duplicates
+        self.posts = Counter()
+        self._rows = {}
+        self._bodies = {}
+        self._metadata = {}
+
+    def entity_rows(self, entity_set: str) -> list:
+        if entity_set not in self._rows:
+            schema = wide_schema(entity_set, self.wide_properties) if self.wide_properties else None
+            self._rows[entity_set] = synthetic_rows(entity_set, self.rows, schema=schema, seed=self.seed)
+        return self._rows[entity_set]
+
+    def respond(self, method: str, target: str, headers: dict, body: bytes):
+        path, _, query = target.partition("?")
+        if path == "/__mock/stats":
+            stats = {"requests": self.requests, "posts": dict(self.posts)}
+            return 200, {"Content-Type": "application/json"}, json.dumps(stats).encode()
+        if not path.startswith(SERVICE_PREFIX):
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+        service, _, entity_set = unquote(path[len(SERVICE_PREFIX):]).partition("/")
+        entity_set = entity_set.split("(", 1)[0].rstrip("/")
+        response_headers = {}
+
+        if headers.get("x-csrf-token", "").lower() == "fetch":
+            response_headers["X-CSRF-Token"] = self.csrf_token
+            response_headers["Set-Cookie"] = f"SAP_SESSIONID_MCK_100={self.csrf_token}; path=/"
+
+        if method == "POST":
+            if headers.get("x-csrf-token") != self.csrf_token:
+                return 403, {"X-CSRF-Token": "Required", "Content-Type": "text/plain"}, b"CSRF token validation failed"
+            if entity_set not in ENTITY_SCHEMAS:
+                return 404, {"Content-Type": "text/plain"}, f"Resource {entity_set} not found".encode()
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"Content-Type": "text/plain"}, b"Malformed JSON payload"
+            self.posts[f"{entity_set}:{payload.get('PurchaseOrderByCustomer', '')}"] += 1
+            for key in ENTITY_KEYS.get(entity_set, []):
+                payload.setdefault(key, f"{random.randrange(10**9):010d}")
+            response_headers["Content-Type"] = "application/json"
+            return 201, response_headers, json.dumps({"d": payload}).encode()
+
+        if entity_set == "$metadata":
+            metadata = self._metadata.setdefault(service, build_metadata(service))
+            etag = f'W/"{zlib.crc32(metadata):08x}"'
+            response_headers["ETag"] = etag
+            if headers.get("if-none-match") == etag:
+                return 304, response_headers, b""
+            response_headers["Content-Type"] = "application/xml"
+            return 200, response_headers, metadata
+        if not entity_set:
+            # Service document; also what a CSRF fetch against the service root sees
+            response_headers["Content-Type"] = "application/json"
+            sets = [name for name in ENTITY_SCHEMAS if name.startswith("A_")]
+            return 200, response_headers, json.dumps({"d": {"EntitySets": sets}}).encode()
+        if entity_set not in ENTITY_SCHEMAS:
+            return 404, {"Content-Type": "text/plain"}, f"Resource {entity_set} not found".encode()
+
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        as_json = params.get("$format") == "json" or (
+            "application/json" in headers.get("accept", "") and "xml" not in headers.get("accept", ""))
+        skip = int(params.get("$skiptoken") or params.get("$skip") or 0)
+        end = min(self.rows, skip + int(params["$top"])) if params.get("$top") else self.rows
+        count = max(0, end - skip)
+        if self.page_size:
+            count = min(count, self.page_size)
+        next_link = None
+        if skip + count < end:
+            # The next page carries the remaining $top so the client's limit still holds
+            next_params = {k: v for k, v in params.items() if k not in ("$skip", "$skiptoken", "$top")}
+            next_params.update({"$skiptoken": str(skip + count), "$top": str(end - skip - count)})
+            next_link = f"{entity_set}?{urlencode(next_params, safe='$')}"
+
+        cache_key = (entity_set, skip, count, next_link, as_json)
+        if cache_key not in self._bodies:
+            rows = self.entity_rows(entity_set)[skip:skip + count]
+            if as_json:
+                self._bodies[cache_key] = json.dumps(build_json_feed(rows, next_link=next_link)).encode()
+            else:
+                base_url = f"http://{headers.get('host', 'mock-s4hana')}{SERVICE_PREFIX}{service}/"
+                self._bodies[cache_key] = build_atom_feed(entity_set, rows, base_url=base_url, next_link=next_link)
+        response_headers["Content-Type"] = "application/json" if as_json else "application/atom+xml;type=feed"
+        return 200, response_headers, self._bodies[cache_key]
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--rows", type=int, default=100, help="Rows available per entity set")
+    parser.add_argument("--page-size", type=int, default=0, help="Server-driven page size (0 = no paging)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Fixed delay before every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Additional uniform random delay")
+    parser.add_argument("--wide-properties", type=int, default=0, help="Filler properties added to every row")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        gateway = MockSapGateway(args.rows, args.page_size, args.latency_ms, args.jitter_ms, args.wide_properties)
+        await gateway.start(args.host, args.port)
+        # First line of output is machine-readable so harnesses can start the server on port 0
+        print(f"LISTENING http://{args.host}:{gateway.port}", flush=True)
+        await gateway.server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
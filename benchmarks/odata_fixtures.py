@@ -0,0 +1,245 @@
+"""Synthetic S/4HANA OData V2 payloads shared by the benchmark scripts"""
+import random
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import escape
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+METADATA_NS = "http://schemas.microsoft.com/ado/2007/08/dataservices/metadata"
+DATA_NS = "http://schemas.microsoft.com/ado/2007/08/dataservices"
+
+# Representative property sets per entity set: (name, Edm type)
+ENTITY_SCHEMAS = {
+    "A_BusinessPartner": [
+        ("BusinessPartner", "Edm.String"), ("Customer", "Edm.String"), ("Supplier", "Edm.String"),
+        ("BusinessPartnerCategory", "Edm.String"), ("BusinessPartnerFullName", "Edm.String"),
+        ("BusinessPartnerGrouping", "Edm.String"), ("BusinessPartnerName", "Edm.String"),
+        ("SearchTerm1", "Edm.String"), ("CreationDate", "Edm.DateTime"), ("LastChangeDate", "Edm.DateTime"),
+        ("IsNaturalPerson", "Edm.String"), ("BusinessPartnerIsBlocked", "Edm.Boolean")
+    ],
+    "A_BusinessPartnerAddress": [
+        ("BusinessPartner", "Edm.String"), ("AddressID", "Edm.String"), ("CityName", "Edm.String"),
+        ("Country", "Edm.String"), ("PostalCode", "Edm.String"), ("StreetName", "Edm.String"),
+        ("HouseNumber", "Edm.String"), ("Region", "Edm.String"), ("ValidityStartDate", "Edm.DateTimeOffset")
+    ],
+    "A_BusinessPartnerContact": [
+        ("RelationshipNumber", "Edm.String"), ("BusinessPartnerCompany", "Edm.String"),
+        ("BusinessPartnerPerson", "Edm.String"), ("ValidityEndDate", "Edm.DateTime"),
+        ("IsStandardRelationship", "Edm.Boolean")
+    ],
+    "A_Customer": [
+        ("Customer", "Edm.String"), ("CustomerName", "Edm.String"), ("CustomerAccountGroup", "Edm.String"),
+        ("CustomerClassification", "Edm.String"), ("CreationDate", "Edm.DateTime"),
+        ("DeletionIndicator", "Edm.Boolean"), ("OrderIsBlockedForCustomer", "Edm.String")
+    ],
+    "A_Supplier": [
+        ("Supplier", "Edm.String"), ("SupplierName", "Edm.String"), ("SupplierAccountGroup", "Edm.String"),
+        ("CreationDate", "Edm.DateTime"), ("DeletionIndicator", "Edm.Boolean")
+    ],
+    "A_SalesOrder": [
+        ("SalesOrder", "Edm.String"), ("SalesOrderType", "Edm.String"), ("SalesOrganization", "Edm.String"),
+        ("DistributionChannel", "Edm.String"), ("OrganizationDivision", "Edm.String"),
+        ("SoldToParty", "Edm.String"), ("CreationDate", "Edm.DateTime"),
+        ("LastChangeDateTime", "Edm.DateTimeOffset"), ("PurchaseOrderByCustomer", "Edm.String"),
+        ("SalesOrderDate", "Edm.DateTime"), ("TotalNetAmount", "Edm.Decimal"),
+        ("TransactionCurrency", "Edm.String"), ("OverallSDProcessStatus", "Edm.String"),
+        ("RequestedDeliveryDate", "Edm.DateTime"), ("PricingDate", "Edm.DateTime")
+    ],
+    "A_SalesOrderItem": [
+        ("SalesOrder", "Edm.String"), ("SalesOrderItem", "Edm.String"), ("Material", "Edm.String"),
+        ("RequestedQuantity", "Edm.Decimal"), ("RequestedQuantityUnit", "Edm.String"),
+        ("NetAmount", "Edm.Decimal"), ("TransactionCurrency", "Edm.String"), ("Plant", "Edm.String"),
+        ("SalesOrderItemCategory", "Edm.String")
+    ],
+    "A_SalesOrderHeaderPartner": [
+        ("SalesOrder", "Edm.String"), ("PartnerFunction", "Edm.String"), ("Customer", "Edm.String"),
+        ("Supplier", "Edm.String"), ("Personnel", "Edm.String")
+    ],
+    "A_SalesOrderItemPartner": [
+        ("SalesOrder", "Edm.String"), ("SalesOrderItem", "Edm.String"), ("PartnerFunction", "Edm.String"),
+        ("Customer", "Edm.String")
+    ],
+    "A_SalesOrderScheduleLine": [
+        ("SalesOrder", "Edm.String"), ("SalesOrderItem", "Edm.String"), ("ScheduleLine", "Edm.String"),
+        ("RequestedDeliveryDate", "Edm.DateTime"), ("ScheduleLineOrderQuantity", "Edm.Decimal"),
+        ("ConfdOrderQtyByMatlAvailCheck", "Edm.Decimal")
+    ],
+    "A_SalesOrderText": [
+        ("SalesOrder", "Edm.String"), ("Language", "Edm.String"), ("LongTextID", "Edm.String"),
+        ("LongText", "Edm.String")
+    ],
+    "A_SalesOrderItemText": [
+        ("SalesOrder", "Edm.String"), ("SalesOrderItem", "Edm.String"), ("Language", "Edm.String"),
+        ("LongTextID", "Edm.String"), ("LongText", "Edm.String")
+    ]
+}
+
+# Key properties per entity set (used for entry ids and mock CSRF/POST responses)
+ENTITY_KEYS = {
+    "A_BusinessPartner": ["BusinessPartner"],
+    "A_BusinessPartnerAddress": ["BusinessPartner", "AddressID"],
+    "A_BusinessPartnerContact": ["RelationshipNumber", "BusinessPartnerCompany", "BusinessPartnerPerson", "ValidityEndDate"],
+    "A_Customer": ["Customer"],
+    "A_Supplier": ["Supplier"],
+    "A_SalesOrder": ["SalesOrder"],
+    "A_SalesOrderItem": ["SalesOrder", "SalesOrderItem"],
+    "A_SalesOrderHeaderPartner": ["SalesOrder", "PartnerFunction"],
+    "A_SalesOrderItemPartner": ["SalesOrder", "SalesOrderItem", "PartnerFunction"],
+    "A_SalesOrderScheduleLine": ["SalesOrder", "SalesOrderItem", "ScheduleLine"],
+    "A_SalesOrderText": ["SalesOrder", "Language", "LongTextID"],
+    "A_SalesOrderItemText": ["SalesOrder", "SalesOrderItem", "Language", "LongTextID"]
+}
+
+_BASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def wide_schema(entity_set: str, extra_properties: int = 60) -> list:
+    """Return the entity schema padded with filler string properties (SAP-like wide rows)"""
+    schema = list(ENTITY_SCHEMAS[entity_set])
+    schema += [(f"YY1_CustomField{i:03d}", "Edm.String") for i in range(extra_properties)]
+    return schema
+
+
+def _value(name: str, edm_type: str, index: int, rng: random.Random):
+    """Generate a deterministic property value; None means m:null"""
+    if name in ("SalesOrder", "BusinessPartner", "Customer", "Supplier", "SoldToParty"):
+        if name == "SoldToParty":
+            return f"{10100000 + rng.randrange(200)}"
+        return f"{index + 1:010d}" if name == "SalesOrder" else f"{10100000 + index}"
+    if name in ("SalesOrderItem", "ScheduleLine", "AddressID", "RelationshipNumber"):
+        return f"{(index % 9 + 1) * 10}"
+    if edm_type == "Edm.Decimal":
+        return f"{rng.uniform(1, 50000):.2f}"
+    if edm_type == "Edm.Boolean":
+        return "true" if rng.random() < 0.1 else "false"
+    if edm_type == "Edm.DateTime":
+        return (_BASE_DATE + timedelta(days=rng.randrange(700))).strftime("%Y-%m-%dT00:00:00")
+    if edm_type == "Edm.DateTimeOffset":
+        return (_BASE_DATE + timedelta(seconds=rng.randrange(60_000_000))).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if rng.random() < 0.05:
+        return None
+    if name == "TransactionCurrency":
+        return rng.choice(["USD", "EUR", "JPY"])
+    return f"{name[:6].upper()}{rng.randrange(1000):03d}"
+
+
+def synthetic_rows(entity_set: str, count: int, *, schema: list = None, seed: int = 42, offset: int = 0) -> list:
+    """Generate `count` rows (plain property dicts) for an entity set"""
+    schema = schema or ENTITY_SCHEMAS[entity_set]
+    rows = []
+    for index in range(offset, offset + count):
+        rng = random.Random(seed * 1_000_003 + index)
+        rows.append({name: _value(name, edm_type, index, rng) for name, edm_type in schema})
+    return rows
+
+
+def _entry_key(entity_set: str, row: dict) -> str:
+    keys = ENTITY_KEYS.get(entity_set, [])
+    parts = [f"{k}='{row.get(k, '')}'" for k in keys]
+    return f"{entity_set}({','.join(parts)})"
+
+
+def build_atom_feed(entity_set: str, rows: list, *, base_url: str = "http://mock-s4hana/sap/opu/odata/sap/SERVICE/",
+                    next_link: str = None) -> bytes:
+    """Serialize rows as an SAP Gateway style Atom feed (with a server-driven paging link if given)"""
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        f'<feed xml:base="{base_url}" xmlns="{ATOM_NS}" xmlns:m="{METADATA_NS}" xmlns:d="{DATA_NS}">',
+        f'<id>{base_url}{entity_set}</id><title type="text">{entity_set}</title>',
+        f'<updated>{_BASE_DATE.strftime("%Y-%m-%dT%H:%M:%SZ")}</updated>',
+        f'<author><name/></author><link href="{entity_set}" rel="self" title="{entity_set}"/>'
+    ]
+    for row in rows:
+        key = escape(_entry_key(entity_set, row))
+        parts.append(
+            f'<entry><id>{base_url}{key}</id><title type="text">{key}</title>'
+            f'<updated>{_BASE_DATE.strftime("%Y-%m-%dT%H:%M:%SZ")}</updated>'
+            f'<category term="SERVICE.{entity_set}Type" scheme="http://schemas.microsoft.com/ado/2007/08/dataservices/scheme"/>'
+            f'<link href="{key}" rel="edit" title="{entity_set}Type"/>'
+            '<content type="application/xml"><m:properties>'
+        )
+        # SAP Gateway omits m:type on feed properties; nulls carry m:null="true"
+        for name, value in row.items():
+            if value is None:
+                parts.append(f'<d:{name} m:null="true"/>')
+            else:
+                parts.append(f'<d:{name}>{escape(str(value))}</d:{name}>')
+        parts.append('</m:properties></content></entry>')
+    if next_link:
+        parts.append(f'<link href="{escape(next_link)}" rel="next"/>')
+    parts.append('</feed>')
+    return "".join(parts).encode("utf-8")
+
+
+def build_json_feed(rows: list, *, next_link: str = None) -> dict:
+    """Serialize rows as an OData V2 JSON (verbose) feed body"""
+    feed = {"results": rows}
+    if next_link:
+        feed["__next"] = next_link
+    return {"d": feed}
+
+
+# $metadata facets: MaxLength per string property (default 40; LongText unbounded) and deep-insert navigation
+_MAX_LENGTHS = {
+    "SalesOrder": 10, "BusinessPartner": 10, "Customer": 10, "Supplier": 10, "SoldToParty": 10,
+    "SalesOrderItem": 6, "ScheduleLine": 4, "SalesOrderType": 4, "SalesOrganization": 4, "DistributionChannel": 2,
+    "OrganizationDivision": 2, "TransactionCurrency": 5, "RequestedQuantityUnit": 3, "Plant": 4,
+    "PartnerFunction": 2, "Language": 2, "LongTextID": 4, "PurchaseOrderByCustomer": 35, "BusinessPartnerFullName": 81
+}
+NAVIGATION = {
+    "A_BusinessPartner": [("to_BusinessPartnerAddress", "A_BusinessPartnerAddress", "*"), ("to_Customer", "A_Customer", "0..1"),
+                          ("to_Supplier", "A_Supplier", "0..1")],
+    "A_SalesOrder": [("to_Item", "A_SalesOrderItem", "*"), ("to_Partner", "A_SalesOrderHeaderPartner", "*"),
+                     ("to_Text", "A_SalesOrderText", "*")],
+    "A_SalesOrderItem": [("to_Partner", "A_SalesOrderItemPartner", "*"), ("to_ScheduleLine", "A_SalesOrderScheduleLine", "*"),
+                         ("to_Text", "A_SalesOrderItemText", "*")]
+}
+
+
+def _facets(name: str, edm_type: str, keys: list) -> str:
+    facets = ' Nullable="false"' if name in keys else ''
+    if edm_type == "Edm.String" and name != "LongText":
+        facets += f' MaxLength="{_MAX_LENGTHS.get(name, 40)}"'
+    elif edm_type == "Edm.Decimal":
+        facets += ' Precision="16" Scale="3"'
+    elif edm_type == "Edm.DateTimeOffset":
+        facets += ' Precision="7"'
+    return facets
+
+
+def build_metadata(namespace: str = "SERVICE") -> bytes:
+    """EDMX (OData V2) $metadata for every entity set in ENTITY_SCHEMAS, with key, facet and navigation elements"""
+    types, associations, association_sets, sets = [], [], [], []
+    for entity_set, schema in ENTITY_SCHEMAS.items():
+        keys = ENTITY_KEYS.get(entity_set, [])
+        parts = [f'<EntityType Name="{entity_set}Type"><Key>']
+        parts += [f'<PropertyRef Name="{key}"/>' for key in keys]
+        parts.append('</Key>')
+        parts += [f'<Property Name="{name}" Type="{edm_type}"{_facets(name, edm_type, keys)}/>'
+                  for name, edm_type in schema]
+        for nav, target, multiplicity in NAVIGATION.get(entity_set, []):
+            association = f"assoc_{entity_set}_{nav}"
+            parts.append(f'<NavigationProperty Name="{nav}" Relationship="{namespace}.{association}" '
+                         f'FromRole="FromRole_{association}" ToRole="ToRole_{association}"/>')
+            associations.append(
+                f'<Association Name="{association}">'
+                f'<End Type="{namespace}.{entity_set}Type" Multiplicity="1" Role="FromRole_{association}"/>'
+                f'<End Type="{namespace}.{target}Type" Multiplicity="{multiplicity}" Role="ToRole_{association}"/>'
+                '</Association>')
+            association_sets.append(
+                f'<AssociationSet Name="{association}_Set" Association="{namespace}.{association}">'
+                f'<End EntitySet="{entity_set}" Role="FromRole_{association}"/>'
+                f'<End EntitySet="{target}" Role="ToRole_{association}"/></AssociationSet>')
+        parts.append('</EntityType>')
+        types.append("".join(parts))
+        sets.append(f'<EntitySet Name="{entity_set}" EntityType="{namespace}.{entity_set}Type"/>')
+    return "".join([
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<edmx:Edmx Version="1.0" xmlns:edmx="http://schemas.microsoft.com/ado/2007/06/edmx" '
+        f'xmlns:m="{METADATA_NS}" xmlns:sap="http://www.sap.com/Protocols/SAPData">',
+        '<edmx:DataServices m:DataServiceVersion="2.0">',
+        f'<Schema Namespace="{namespace}" xml:lang="en" xmlns="http://schemas.microsoft.com/ado/2008/09/edm">',
+        *types, *associations,
+        f'<EntityContainer Name="{namespace}_Entities" m:IsDefaultEntityContainer="true">',
+        *sets, *association_sets,
+        '</EntityContainer></Schema></edmx:DataServices></edmx:Edmx>'
+    ]).encode("utf-8")
@@ -0,0 +1,205 @@
+"""Deterministic replay of captured tools/call traffic
+
+Re-issues a workload recorded with TRAFFIC_CAPTURE_ENABLED=true against
+`mock_sap_server.py` and `mock_blob_server.py`, keeping the original call
+order and spacing (open loop: a slow call does not delay the next one).
+--speed compresses time, e.g. 4 replays an hour of traffic in 15 minutes at
+four times the arrival rate; 0 issues everything as fast as possible.
+Captures from several instances are merged by timestamp.
+
+Captures are gzipped JSON lines, one object per call, with arguments already
+anonymized by the Function (literals replaced by keyed pseudonyms, so
+repeated values stay repeated; entity names, paging and $select are kept).
+Pass files or directories, e.g. a download of the capture prefix:
+
+    az storage blob download-batch -s salesorderrequest --pattern 'diagnostics/traffic/2025/03/*' -d captures
+
+Per tool the report compares recorded and replayed p50/p95 latency and mean
+response size, and shows errors. It also reports how far calls started behind
+schedule (lag), which grows when the Function cannot keep up with the offered
+rate. Recorded latency includes the real gateway; replayed latency reflects
+the mock's --latency-ms, so compare replays with each other (before/after a
+change, or speed 1 vs N) rather than with production.
+
+Usage:
+    python benchmarks/replay_traffic.py captures/ --speed 4 --latency-ms 40 --rows 200 --output replay.json
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, ROOT)
+
+from bench_e2e import is_error, peak_rss_mb, summarize  # noqa: E402
+from mock_blob_server import connection_string  # noqa: E402
+from mock_http import start_server_process  # noqa: E402
+from mock_sap_server import add_arguments  # noqa: E402
+
+
+def capture_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files += [os.path.join(directory, name) for name in names if name.endswith((".jsonl", ".jsonl.gz"))]
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def load_capture(paths: list) -> list:
+    """All records from plain or gzipped (multi-member) JSON-lines files, ordered by time"""
+    records = []
+    for path in capture_files(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+def select_window(records: list, start: float, duration: float, limit: int) -> list:
+    if not records:
+        return records
+    first = records[0]["t"] + start
+    selected = [r for r in records if r["t"] >= first and (not duration or r["t"] < first + duration)]
+    return selected[:limit] if limit else selected
+
+
+async def replay(fa, records: list, speed: float) -> dict:
+    import azure.functions as func
+
+    results = []
+    in_flight = peak_in_flight = 0
+    origin = records[0]["t"]
+    started = time.perf_counter()
+
+    async def issue(index: int, record: dict):
+        nonlocal in_flight, peak_in_flight
+        due = (record["t"] - origin) / speed if speed else 0
+        delay = due - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag = max(0.0, time.perf_counter() - started - due)
+        body = json.dumps({"jsonrpc": "2.0", "id": index, "method": "tools/call",
+                           "params": {"name": record["tool"], "arguments": record["args"]}}).encode()
+        in_flight += 1
+        peak_in_flight = max(peak_in_flight, in_flight)
+        call_started = time.perf_counter()
+        try:
+            response = await fa.mcp_sse_endpoint(func.HttpRequest("POST", "/api/sse", headers={}, body=body))
+        finally:
+            in_flight -= 1
+        results.append({"tool": record["tool"], "seconds": time.perf_counter() - call_started, "lag": lag,
+                        "bytes": len(response.get_body()), "error": is_error(response)})
+
+    await asyncio.gather(*(issue(index, record) for index, record in enumerate(records)))
+    return {"seconds": time.perf_counter() - started, "results": results, "peak_in_flight": peak_in_flight}
+
+
+def report(records: list, replayed: dict, speed: float) -> dict:
+    span = records[-1]["t"] - records[0]["t"]
+    results = replayed["results"]
+    tools = {}
+    for tool in sorted({r["tool"] for r in records}):
+        recorded = [r for r in records if r["tool"] == tool]
+        now = [r for r in results if r["tool"] == tool]
+        tools[tool] = {
+            "recorded": {**summarize([r["ms"] / 1000 for r in recorded]),
+                         "mean_bytes": round(sum(r["bytes"] for r in recorded) / len(recorded)),
+                         "errors": sum(r["outcome"] != "ok" for r in recorded)},
+            "replayed": {**summarize([r["seconds"] for r in now]),
+                         "mean_bytes": round(sum(r["bytes"] for r in now) / len(now)),
+                         "errors": sum(r["error"] for r in now)}
+        }
+    return {
+        "calls": len(records),
+        "recorded_span_seconds": round(span, 3),
+        "speed": speed,
+        "seconds": round(replayed["seconds"], 3),
+        "offered_rps": round(len(records) * (speed or 1) / span, 1) if span and speed else None,
+        "achieved_rps": round(len(results) / replayed["seconds"], 1),
+        "peak_in_flight": replayed["peak_in_flight"],
+        "lag": summarize([r["lag"] for r in results]),
+        "peak_rss_mb": peak_rss_mb(),
+        "tools": tools
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="Capture files (.jsonl or .jsonl.gz) or directories")
+    parser.add_argument("--speed", type=float, default=1, help="Time compression factor (0 = no waiting)")
+    parser.add_argument("--start", type=float, default=0, help="Skip this many seconds of the capture")
+    parser.add_argument("--duration", type=float, default=0, help="Replay only this many seconds (0 = all)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many calls")
+    parser.add_argument("--blob-latency-ms", type=float, default=2)
+    parser.add_argument("--log-level", default="WARNING", help="Root log level while replaying")
+    parser.add_argument("--output", help="Optional path for JSON results")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    records = select_window(load_capture(args.captures), args.start, args.duration, args.limit)
+    if not records:
+        sys.exit("No calls in the selected capture window")
+
+    processes = []
+    try:
+        sap, sap_url = start_server_process(os.path.join(ROOT, "mock_sap_server.py"),
+                                            "--rows", str(args.rows), "--page-size", str(args.page_size),
+                                            "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                                            "--wide-properties", str(args.wide_properties))
+        processes.append(sap)
+        blob, blob_url = start_server_process(os.path.join(ROOT, "mock_blob_server.py"),
+                                              "--latency-ms", str(args.blob_latency_ms))
+        processes.append(blob)
+
+        os.environ.update({
+            "SAP_BASE_URL": sap_url, "SAP_USER": "replay", "SAP_PASS": "replay", "TEAMS_WEBHOOK_URL": "",
+            "AZURE_STORAGE_CONNECTION_STRING": connection_string(blob_url),
+            "BLOB_CONTAINER_NAME": f"replay-{uuid.uuid4().hex[:8]}",
+            # Never capture the replay itself
+            "TRAFFIC_CAPTURE_ENABLED": "false"
+        })
+        logging.getLogger().addHandler(logging.NullHandler())
+        logging.getLogger().setLevel(args.log_level)
+
+        from azure.storage.blob import BlobServiceClient
+        BlobServiceClient.from_connection_string(connection_string(blob_url)).create_container(
+            os.environ["BLOB_CONTAINER_NAME"])
+        import function_app
+        summary = report(records, asyncio.run(replay(function_app, records, args.speed)), args.speed)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    print(f"{summary['calls']} calls spanning {summary['recorded_span_seconds']}s replayed at {args.speed}x in "
+          f"{summary['seconds']}s: offered {summary['offered_rps']} rps, achieved {summary['achieved_rps']} rps, "
+          f"peak in flight {summary['peak_in_flight']}, peak RSS {summary['peak_rss_mb']} MB")
+    print(f"start lag p50/p95/p99 ms: {summary['lag']['p50_ms']} / {summary['lag']['p95_ms']} / "
+          f"{summary['lag']['p99_ms']}")
+    print(f"{'tool':<30}{'calls':>7}{'rec p50':>9}{'rec p95':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'rec KB':>8}{'KB':>8}{'errors':>8}")
+    for tool, stats in summary["tools"].items():
+        recorded, replayed = stats["recorded"], stats["replayed"]
+        print(f"{tool:<30}{replayed['requests']:>7}{recorded['p50_ms']:>9}{recorded['p95_ms']:>9}"
+              f"{replayed['p50_ms']:>9}{replayed['p95_ms']:>9}{replayed['p99_ms']:>9}"
+              f"{recorded['mean_bytes'] / 1024:>8.1f}{replayed['mean_bytes'] / 1024:>8.1f}"
+              f"{replayed['errors']:>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), **summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,28 @@
 import os
 import json
-import xmltodict
+import gzip
+import time
+import uuid
+import random
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import decimal
+import functools
+import hashlib
+import hmac
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict, deque
 import logging
-import requests
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 import azure.functions as func
 import httpx
-from azure.storage.blob import BlobServiceClient
+# xmltodict, requests and the Azure Storage SDK are imported on first use: /api/health and
+# tools/list need none of them, and the Blob SDK alone is ~40% of cold-start import time
 
 # --- Configuration ---
 SAP_BASE_URL = os.getenv("SAP_BASE_URL", "http://your-s4hana-server:port")
@@ -14,11 +30,213 @@ FUNCTION_APP_BASE_URL = os.getenv("FUNCTION_APP_BASE_URL", "https://your-functio
 SAP_BP_SERVICE = f"{SAP_BASE_URL}/sap/opu/odata/sap/API_BUSINESS_PARTNER"
 SAP_SO_SERVICE = f"{SAP_BASE_URL}/sap/opu/odata/sap/API_SALES_ORDER_SRV"
 
+# --- Deadline Configuration ---
+def _host_function_timeout_seconds() -> float:
+    """functionTimeout from host.json ([d.]hh:mm:ss); 5 minutes when missing or unparsable"""
+    try:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "host.json")) as f:
+            value = json.load(f).get("functionTimeout", "00:05:00")
+        days = 0
+        if "." in value.split(":")[0]:
+            day_part, value = value.split(".", 1)
+            days = int(day_part)
+        hours, minutes, seconds = value.split(":")
+        return days * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except Exception:
+        return 300.0
+
+# Every tool call gets this budget (minus a safety margin), optionally narrowed by a client hint
+MCP_FUNCTION_TIMEOUT_SECONDS = float(os.getenv("MCP_FUNCTION_TIMEOUT_SECONDS", "0")) or _host_function_timeout_seconds()
+MCP_DEADLINE_MARGIN_SECONDS = float(os.getenv("MCP_DEADLINE_MARGIN_SECONDS", "5"))
+BLOB_TIMEOUT_SECONDS = float(os.getenv("BLOB_TIMEOUT_SECONDS", "30"))
+TEAMS_WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("TEAMS_WEBHOOK_TIMEOUT_SECONDS", "10"))
+
 # --- Azure Blob Storage Configuration ---
 BLOB_STORAGE_URL = os.getenv("BLOB_STORAGE_URL", "https://your-storage-account.blob.core.windows.net/salesorderrequest")
 BLOB_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 BLOB_CONTAINER_NAME = os.getenv("BLOB_CONTAINER_NAME", "salesorderrequest")
 
+# --- Transport Compression Configuration ---
+# Content codings we ask the SAP Gateway (ICM) for; httpx decodes them while streaming
+SAP_ACCEPT_ENCODING = os.getenv("SAP_ACCEPT_ENCODING", "gzip, deflate")
+# Responses to MCP / Copilot clients smaller than this are sent uncompressed
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "6"))
+
+# --- SAP Backend Protection Configuration ---
+# Circuit breaker: open after N consecutive failures (5xx, 429, timeouts, slow calls)
+SAP_BREAKER_FAILURE_THRESHOLD = int(os.getenv("SAP_BREAKER_FAILURE_THRESHOLD", "5"))
+SAP_BREAKER_OPEN_SECONDS = float(os.getenv("SAP_BREAKER_OPEN_SECONDS", "30"))
+SAP_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("SAP_BREAKER_SLOW_CALL_SECONDS", "10"))
+# AIMD concurrency limit per SAP service, driven by observed latency
+SAP_CONCURRENCY_INITIAL = int(os.getenv("SAP_CONCURRENCY_INITIAL", "8"))
+SAP_CONCURRENCY_MIN = int(os.getenv("SAP_CONCURRENCY_MIN", "1"))
+SAP_CONCURRENCY_MAX = int(os.getenv("SAP_CONCURRENCY_MAX", "32"))
+SAP_CONCURRENCY_TARGET_LATENCY_SECONDS = float(os.getenv("SAP_CONCURRENCY_TARGET_LATENCY_SECONDS", "3"))
+SAP_CONCURRENCY_MAX_QUEUE = int(os.getenv("SAP_CONCURRENCY_MAX_QUEUE", "32"))
+SAP_CONCURRENCY_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SAP_CONCURRENCY_QUEUE_TIMEOUT_SECONDS", "5"))
+
+# --- SAP Retry Configuration ---
+SAP_RETRY_MAX_ATTEMPTS = int(os.getenv("SAP_RETRY_MAX_ATTEMPTS", "3"))
+SAP_RETRY_BASE_DELAY_SECONDS = float(os.getenv("SAP_RETRY_BASE_DELAY_SECONDS", "0.5"))
+SAP_RETRY_MAX_DELAY_SECONDS = float(os.getenv("SAP_RETRY_MAX_DELAY_SECONDS", "8"))
+# Total time (first attempt + retries) we are willing to spend on one SAP call
+SAP_RETRY_MAX_ELAPSED_SECONDS = float(os.getenv("SAP_RETRY_MAX_ELAPSED_SECONDS", "30"))
+# Retries allowed as a fraction of requests, so retries never multiply load on a struggling gateway
+SAP_RETRY_BUDGET_RATIO = float(os.getenv("SAP_RETRY_BUDGET_RATIO", "0.2"))
+# Only enable if the SAP services honour Repeatability-Request-ID; then creates are retried too
+SAP_REPEATABILITY_ENABLED = os.getenv("SAP_REPEATABILITY_ENABLED", "false").lower() == "true"
+
+# --- Metrics Configuration ---
+# Mirror metrics into OpenTelemetry (e.g. Azure Monitor exporter) in addition to /api/metrics
+METRICS_OTEL_ENABLED = os.getenv("METRICS_OTEL_ENABLED", "false").lower() == "true"
+
+# --- Health Probe Configuration ---
+HEALTH_PROBE_INTERVAL_SECONDS = float(os.getenv("HEALTH_PROBE_INTERVAL_SECONDS", "60"))
+HEALTH_PROBE_TIMEOUT_SECONDS = float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "5"))
+# Probes slower than this report the dependency (and /api/health) as degraded
+HEALTH_PROBE_LATENCY_SLO_SECONDS = float(os.getenv("HEALTH_PROBE_LATENCY_SLO_SECONDS", "2"))
+
+# --- Slow-Query Log Configuration ---
+SLOW_QUERY_THRESHOLD_SECONDS = float(os.getenv("SLOW_QUERY_THRESHOLD_SECONDS", "2"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_MAX_SHAPES = int(os.getenv("SLOW_QUERY_MAX_SHAPES", "500"))
+# Optionally persist slow-query records to blob storage as JSON lines
+SLOW_QUERY_BLOB_SPILL = os.getenv("SLOW_QUERY_BLOB_SPILL", "false").lower() == "true"
+SLOW_QUERY_SPILL_BATCH = int(os.getenv("SLOW_QUERY_SPILL_BATCH", "20"))
+SLOW_QUERY_BLOB_PREFIX = os.getenv("SLOW_QUERY_BLOB_PREFIX", "diagnostics/slow-queries/")
+
+# --- Traffic Capture Configuration ---
+# Record anonymized tools/call arguments, timings and response sizes for benchmarks/replay_traffic.py
+TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "false").lower() == "true"
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1"))
+TRAFFIC_CAPTURE_BATCH = int(os.getenv("TRAFFIC_CAPTURE_BATCH", "200"))
+TRAFFIC_CAPTURE_FLUSH_SECONDS = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_SECONDS", "60"))
+TRAFFIC_CAPTURE_BLOB_PREFIX = os.getenv("TRAFFIC_CAPTURE_BLOB_PREFIX", "diagnostics/traffic/")
+# Write to this local file instead of blob storage (local runs)
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+# Key for the literal pseudonyms; set the same value on all instances so repeated values match across them
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "").encode() or os.urandom(16)
+
+# --- SAP Cache Configuration ---
+# CSRF token + session cookies are reused per service for this long (0 fetches one per create)
+SAP_CSRF_TOKEN_TTL_SECONDS = float(os.getenv("SAP_CSRF_TOKEN_TTL_SECONDS", "900"))
+# Business Partner reads (master data) are served from memory for this long, so changes made outside this
+# server show up that much later. Off by default; 120 with WARMUP_ENABLED, whose hot-read refresh needs it
+SAP_READ_CACHE_TTL_SECONDS = float(os.getenv(
+    "SAP_READ_CACHE_TTL_SECONDS", "120" if os.getenv("WARMUP_ENABLED", "false").lower() == "true" else "0"))
+SAP_READ_CACHE_MAX_ENTRIES = int(os.getenv("SAP_READ_CACHE_MAX_ENTRIES", "256"))
+
+# --- SAP Metadata Configuration ---
+# Each service's $metadata is loaded once per worker and revalidated (If-None-Match) after this long
+SAP_METADATA_TTL_SECONDS = float(os.getenv("SAP_METADATA_TTL_SECONDS", "3600"))
+# Convert and validate create payloads against $metadata before they are sent to SAP
+SAP_PAYLOAD_VALIDATION = os.getenv("SAP_PAYLOAD_VALIDATION", "true").lower() == "true"
+
+# --- Feed Parsing Configuration ---
+# Decoded SAP feeds of at least this size are parsed in a worker pool instead of on the event loop
+SAP_PARSE_OFFLOAD_BYTES = int(os.getenv("SAP_PARSE_OFFLOAD_BYTES", "262144"))
+# thread (default) or process; 0 workers parses everything inline
+SAP_PARSE_EXECUTOR = os.getenv("SAP_PARSE_EXECUTOR", "thread").lower()
+SAP_PARSE_WORKERS = int(os.getenv("SAP_PARSE_WORKERS", "2"))
+# Offloaded parses queued or running at once; further large feeds wait for a slot
+SAP_PARSE_QUEUE_DEPTH = int(os.getenv("SAP_PARSE_QUEUE_DEPTH", "8"))
+
+# --- OData Query Guard Configuration ---
+# $top added to client queries without one, and the most a client may ask for
+ODATA_DEFAULT_TOP = int(os.getenv("ODATA_DEFAULT_TOP", "100"))
+ODATA_MAX_TOP = int(os.getenv("ODATA_MAX_TOP", "1000"))
+# Per entity set overrides as "entity=default/max", e.g. "salesorderitems=200/5000,customers=50/500"
+ODATA_TOP_LIMITS = {name.strip().lower(): tuple(int(limit) for limit in limits.split("/"))
+                    for name, _, limits in (item.partition("=") for item in os.getenv("ODATA_TOP_LIMITS", "").split(","))
+                    if limits}
+# Estimated rows SAP touches per query (see estimate_odata_cost); costlier queries get a lower $top or are rejected
+ODATA_COST_BUDGET = float(os.getenv("ODATA_COST_BUDGET", "25000"))
+# Assumed entity set size for reads that cannot use an index, and rows per row added by each $expand
+ODATA_SCAN_ROWS = float(os.getenv("ODATA_SCAN_ROWS", "100000"))
+ODATA_EXPAND_FANOUT = float(os.getenv("ODATA_EXPAND_FANOUT", "10"))
+# false only logs queries over the budget (for a first rollout)
+ODATA_COST_ENFORCE = os.getenv("ODATA_COST_ENFORCE", "true").lower() == "true"
+
+# --- Delta Sync Configuration ---
+# Changed rows are re-read from this far behind the watermark (late commits, timestamp precision)
+DELTA_SYNC_OVERLAP_SECONDS = float(os.getenv("DELTA_SYNC_OVERLAP_SECONDS", "300"))
+# Key-only scan that finds rows deleted in SAP, for entity sets synced by change timestamp
+DELTA_SYNC_RECONCILE_SECONDS = float(os.getenv("DELTA_SYNC_RECONCILE_SECONDS", "86400"))
+DELTA_SYNC_PAGE_SIZE = int(os.getenv("DELTA_SYNC_PAGE_SIZE", "1000"))
+DELTA_SYNC_BLOB_PREFIX = os.getenv("DELTA_SYNC_BLOB_PREFIX", "sync/watermarks/")
+# Entity sets whose service supports change tracking (!deltatoken links with deleted-entry tombstones)
+DELTA_SYNC_TOKEN_ENTITIES = {name.strip() for name in os.getenv("DELTA_SYNC_TOKEN_ENTITIES", "").split(",") if name.strip()}
+
+# --- Fan-out Query Configuration ---
+# query_many runs up to this many reads per call, at most QUERY_MANY_CONCURRENCY of them at once
+QUERY_MANY_MAX_QUERIES = int(os.getenv("QUERY_MANY_MAX_QUERIES", "20"))
+QUERY_MANY_CONCURRENCY = int(os.getenv("QUERY_MANY_CONCURRENCY", "4"))
+
+# --- Customer 360 Configuration ---
+CUSTOMER_360_RECENT_ORDERS = int(os.getenv("CUSTOMER_360_RECENT_ORDERS", "10"))
+# customer_360 caches its sales order projection this long (other sales order reads are never cached)
+CUSTOMER_360_ORDER_CACHE_TTL_SECONDS = float(os.getenv("CUSTOMER_360_ORDER_CACHE_TTL_SECONDS", "30"))
+
+# --- Aggregation Configuration ---
+# aggregate_s4hana reads every matching row page by page and keeps only one accumulator per group
+AGGREGATE_PAGE_SIZE = int(os.getenv("AGGREGATE_PAGE_SIZE", "1000"))
+AGGREGATE_MAX_ROWS = int(os.getenv("AGGREGATE_MAX_ROWS", "500000"))
+AGGREGATE_MAX_GROUPS = int(os.getenv("AGGREGATE_MAX_GROUPS", "10000"))
+
+# --- Export Configuration ---
+# export_s4hana writes whole entity sets to blobs under this prefix, one SAP page and one block at a time.
+# Its own container, so export readers never get access to the approval requests in BLOB_CONTAINER_NAME
+EXPORT_CONTAINER_NAME = os.getenv("EXPORT_CONTAINER_NAME", "sapexports")
+EXPORT_BLOB_PREFIX = os.getenv("EXPORT_BLOB_PREFIX", "exports/")
+# Lifetime of the read-only SAS URL returned for each export (0 = return only the blob name)
+EXPORT_URL_TTL_SECONDS = int(os.getenv("EXPORT_URL_TTL_SECONDS", "3600"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_BLOCK_BYTES = int(os.getenv("EXPORT_BLOCK_BYTES", str(4 * 1024 * 1024)))
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "5000000"))
+
+# --- Business Partner Replica Configuration ---
+# Answer query_s4hana reads of the BP_ODATA entity sets from a local SQLite copy while it is fresh
+BP_REPLICA_ENABLED = os.getenv("BP_REPLICA_ENABLED", "false").lower() == "true"
+BP_REPLICA_MAX_AGE_SECONDS = float(os.getenv("BP_REPLICA_MAX_AGE_SECONDS", "3600"))
+# Default: bp_replica.sqlite3 in the worker's temp directory
+BP_REPLICA_PATH = os.getenv("BP_REPLICA_PATH", "")
+BP_REPLICA_PAGE_SIZE = int(os.getenv("BP_REPLICA_PAGE_SIZE", "1000"))
+# Entity sets larger than this are not replicated (their reads keep going to SAP)
+BP_REPLICA_MAX_ROWS = int(os.getenv("BP_REPLICA_MAX_ROWS", "200000"))
+BP_REPLICA_LOAD_TIMEOUT_SECONDS = float(os.getenv("BP_REPLICA_LOAD_TIMEOUT_SECONDS", "600"))
+# Loaded replicas are shared through this blob so other instances download instead of reloading ("" disables)
+BP_REPLICA_BLOB_NAME = os.getenv("BP_REPLICA_BLOB_NAME", "replicas/bp_replica.sqlite3")
+
+# --- Warm-Keeping Configuration ---
+# Timer that keeps SAP connections, CSRF tokens, the storage token and hot reads warm while idle
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+WARMUP_SCHEDULE = os.getenv("WARMUP_SCHEDULE", "0 */4 * * * *")
+WARMUP_BUDGET_SECONDS = float(os.getenv("WARMUP_BUDGET_SECONDS", "20"))
+# SAP calls per run across CSRF fetches and cache refreshes, so warming never adds real load
+WARMUP_MAX_SAP_CALLS = int(os.getenv("WARMUP_MAX_SAP_CALLS", "6"))
+# A service that served a call this recently already has warm connections and is skipped
+WARMUP_SKIP_IF_USED_SECONDS = float(os.getenv("WARMUP_SKIP_IF_USED_SECONDS", "60"))
+
+# --- Tracing Configuration ---
+# "" (off), "otlp" (OTEL_EXPORTER_OTLP_* settings), "file", "console" or "global" (provider set up by the host)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").strip().lower()
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "s4hana-mcp-server")
+
+# --- Logging Configuration ---
+# Per-category levels, e.g. "sap=DEBUG,payload=INFO" (categories: LOG_CATEGORIES); unset
+# categories follow the host's level, except "payload" which defaults to WARNING
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Verbose (<= INFO) records allowed per message template per minute; 0 disables sampling
+LOG_SAMPLE_PER_MINUTE = int(os.getenv("LOG_SAMPLE_PER_MINUTE", "120"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "512"))
+LOG_REDACT_FIELDS = tuple(
+    f.strip().lower() for f in os.getenv(
+        "LOG_REDACT_FIELDS", "password,passwd,secret,token,authorization,cookie,email,phone,iban,bankaccount"
+    ).split(",") if f.strip()
+)
+
 # --- BUSINESS PARTNER API Entity Mappings ---
 BP_ODATA = {
     "businesspartners": f"{SAP_BP_SERVICE}/A_BusinessPartner",
@@ -54,6 +272,20 @@ SO_ODATA_CREATE = {
     "salesorderitemtexts": f"{SAP_SO_SERVICE}/A_SalesOrderItemText"
 }
 
+# --- CUSTOMER 360 sub-reads: name -> (entity, key field, $select, $orderby, $top; None = recent_orders) ---
+CUSTOMER_360_READS = {
+    "partner": ("businesspartners", "BusinessPartner",
+                "BusinessPartner,BusinessPartnerFullName,BusinessPartnerCategory,BusinessPartnerGrouping,SearchTerm1,"
+                "CreationDate,LastChangeDate,BusinessPartnerIsBlocked", "", 1),
+    "account": ("customers", "Customer",
+                "Customer,CustomerName,CustomerAccountGroup,CustomerClassification,DeletionIndicator", "", 1),
+    "addresses": ("businesspartneraddresses", "BusinessPartner",
+                  "AddressID,StreetName,HouseNumber,PostalCode,CityName,Region,Country", "", 20),
+    "recent_orders": ("salesorders", "SoldToParty",
+                      "SalesOrder,SalesOrderType,SalesOrderDate,PurchaseOrderByCustomer,TotalNetAmount,"
+                      "TransactionCurrency,OverallSDProcessStatus", "CreationDate desc", None)
+}
+
 # --- COMBINED MAPPINGS for MCP Tools ---
 ALL_ODATA = {**BP_ODATA, **SO_ODATA}
 ALL_ODATA = {k.lower(): v for k, v in ALL_ODATA.items()}
@@ -63,6 +295,105 @@ ALL_ODATA_CREATE = {k.lower(): v for k, v in ALL_ODATA_CREATE.items()}
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# --- Structured logging helpers ---
+LOG_CATEGORIES = ("mcp", "sap", "blob", "approval", "payload", "notify", "http", "metrics")
+_REDACTED = "***"
+
+def _parse_log_levels(spec: str) -> dict:
+    """Parse LOG_LEVELS ("sap=DEBUG,payload=WARNING") into {category: level}"""
+    levels = {}
+    for part in spec.split(","):
+        category, _, level = part.partition("=")
+        category, level = category.strip().lower(), level.strip().upper()
+        if category and isinstance(logging.getLevelName(level), int):
+            levels[category] = logging.getLevelName(level)
+    return levels
+
+class RateLimitedSampler(logging.Filter):
+    """Let at most LOG_SAMPLE_PER_MINUTE verbose (<= INFO) records through per message template
+
+    Warnings and errors always pass. The next record admitted for a throttled template
+    reports how many were dropped in between.
+    """
+
+    def __init__(self, per_minute: int):
+        super().__init__()
+        self.per_minute = per_minute
+        self.windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.per_minute <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window_start, count, suppressed = self.windows.get(key, (now, 0, 0))
+        if now - window_start >= 60:
+            window_start, count = now, 0
+        if count >= self.per_minute:
+            self.windows[key] = (window_start, count, suppressed + 1)
+            return False
+        self.windows[key] = (window_start, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg} (+{suppressed} similar records sampled out)"
+        return True
+
+def get_logger(category: str) -> logging.Logger:
+    """Category logger (s4hana_mcp.<category>) with its configured level and sampling"""
+    logger = logging.getLogger(f"s4hana_mcp.{category}")
+    if not logger.filters:
+        default = logging.WARNING if category == "payload" else logging.NOTSET
+        logger.setLevel(_log_levels.get(category, default))
+        logger.addFilter(RateLimitedSampler(LOG_SAMPLE_PER_MINUTE))
+    return logger
+
+def _redact(value, depth: int = 0):
+    if depth > 8:
+        return "..."
+    if isinstance(value, dict):
+        return {
+            k: _REDACTED if any(s in str(k).lower() for s in LOG_REDACT_FIELDS) else _redact(v, depth + 1)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_redact(v, depth + 1) for v in value]
+    return value
+
+class LogPayload:
+    """Lazily rendered, redacted and size-capped payload for log arguments
+
+    Nothing is serialized unless a handler actually formats the record.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode("utf-8", "replace")
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if isinstance(value, (dict, list)):
+            value = json.dumps(_redact(value), default=str, separators=(",", ":"))
+        text = str(value)
+        if len(text) > LOG_PAYLOAD_MAX_CHARS:
+            text = f"{text[:LOG_PAYLOAD_MAX_CHARS]}...(+{len(text) - LOG_PAYLOAD_MAX_CHARS} chars)"
+        return text
+
+_log_levels = _parse_log_levels(LOG_LEVELS)
+mcp_logger = get_logger("mcp")
+sap_logger = get_logger("sap")
+blob_logger = get_logger("blob")
+approval_logger = get_logger("approval")
+payload_logger = get_logger("payload")
+notify_logger = get_logger("notify")
+http_logger = get_logger("http")
+metrics_logger = get_logger("metrics")
+
 # --- Helper function for CORS headers ---
 def add_cors_headers(response):
     """Add CORS headers to response"""
@@ -71,23 +402,532 @@ def add_cors_headers(response):
     response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, Ocp-Apim-Subscription-Key"
     return response
 
+def jsonrpc_response(response: dict) -> func.HttpResponse:
+    """JSON-RPC envelope as a CORS-enabled response; mcp_outcome carries "error"/"ok" for metrics and capture,
+    so callers never have to re-parse the body to learn it"""
+    http_response = add_cors_headers(func.HttpResponse(json.dumps(response), mimetype="application/json"))
+    http_response.mcp_outcome = "error" if "error" in response else "ok"
+    return http_response
+
+# --- Helper functions for response compression ---
+_brotli_module = None
+
+def _get_brotli():
+    """Return the optional brotli module, or None when it is not installed"""
+    global _brotli_module
+    if _brotli_module is None:
+        try:
+            import brotli
+            _brotli_module = brotli
+        except ImportError:
+            _brotli_module = False
+    return _brotli_module or None
+
+def negotiate_response_encoding(accept_encoding: str) -> str:
+    """Pick the best content coding the client accepts ('br', 'gzip' or '' for identity)"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    def _quality(coding):
+        return accepted.get(coding, accepted.get("*", 0.0))
+
+    if _get_brotli() and _quality("br") > 0 and _quality("br") >= _quality("gzip"):
+        return "br"
+    if _quality("gzip") > 0:
+        return "gzip"
+    return ""
+
+def compress_response(req: func.HttpRequest, response: func.HttpResponse) -> func.HttpResponse:
+    """Compress a response body above RESPONSE_COMPRESSION_MIN_BYTES when the client supports it"""
+    if response.headers.get("Content-Encoding"):
+        return response
+    body = response.get_body()
+    if len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    encoding = negotiate_response_encoding(req.headers.get("Accept-Encoding", ""))
+    if not encoding:
+        return response
+
+    if encoding == "br":
+        compressed = _get_brotli().compress(body, quality=min(RESPONSE_COMPRESSION_LEVEL, 11))
+    else:
+        compressed = gzip.compress(body, compresslevel=RESPONSE_COMPRESSION_LEVEL, mtime=0)
+    if len(compressed) >= len(body):
+        return response
+
+    headers = dict(response.headers)
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    http_logger.info("[COMPRESSION] %s %s -> %s bytes", encoding, len(body), len(compressed))
+    return func.HttpResponse(
+        compressed,
+        status_code=response.status_code,
+        headers=headers,
+        mimetype=response.mimetype,
+        charset=response.charset
+    )
+
+# --- Helper functions for request deadlines ---
+# (absolute monotonic deadline, total budget) of the tool call being served
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(Exception):
+    """Raised when a tool call's time budget is used up before an operation could run or finish"""
+
+    def __init__(self, operation: str):
+        deadline = _request_deadline.get()
+        self.operation = operation
+        self.budget_seconds = round(deadline[1], 3) if deadline else None
+        super().__init__(f"Deadline exceeded during {operation} (budget {self.budget_seconds}s)")
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "DEADLINE_EXCEEDED",
+            "message": str(self),
+            "operation": self.operation,
+            "budget_seconds": self.budget_seconds
+        }
+
+    def to_response(self) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(self.to_dict()), mimetype="application/json", status_code=504)
+
+    def to_jsonrpc_error(self) -> dict:
+        return {"code": -32001, "message": str(self), "data": self.to_dict()}
+
+def request_budget_seconds(req: func.HttpRequest, params: dict = None) -> float:
+    """Budget for one call: host functionTimeout minus margin, narrowed by an optional client hint
+
+    Clients may send `X-Client-Timeout-Ms` or JSON-RPC `params._meta.timeoutMs`.
+    """
+    budget = MCP_FUNCTION_TIMEOUT_SECONDS - MCP_DEADLINE_MARGIN_SECONDS
+    hint = req.headers.get("X-Client-Timeout-Ms")
+    if not hint and isinstance(params, dict):
+        hint = (params.get("_meta") or {}).get("timeoutMs")
+    if hint:
+        try:
+            budget = min(budget, float(hint) / 1000)
+        except (TypeError, ValueError):
+            mcp_logger.warning("[DEADLINE] Ignoring invalid client timeout hint: %s", hint)
+    return max(budget, 0.1)
+
+@contextlib.contextmanager
+def request_deadline(budget_seconds: float):
+    """Scope a deadline over everything awaited inside (propagates through contextvars)"""
+    token = _request_deadline.set((time.monotonic() + budget_seconds, budget_seconds))
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+def deadline_remaining():
+    """Seconds left in the current request budget, or None outside a deadline scope"""
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline[0] - time.monotonic()
+
+def deadline_timeout(default: float, operation: str) -> float:
+    """Per-operation timeout: the operation's default trimmed to the remaining request budget"""
+    remaining = deadline_remaining()
+    if remaining is None:
+        return default
+    if remaining <= 0:
+        raise DeadlineExceeded(operation)
+    return min(default, remaining)
+
+async def run_with_deadline(coro, operation: str):
+    """Await coro, cancelling it cleanly when the request budget runs out"""
+    remaining = deadline_remaining()
+    if remaining is None:
+        return await coro
+    if remaining <= 0:
+        coro.close()
+        raise DeadlineExceeded(operation)
+    try:
+        return await asyncio.wait_for(coro, remaining)
+    except asyncio.TimeoutError:
+        if (deadline_remaining() or 0) > 0:
+            raise
+        mcp_logger.warning("[DEADLINE] %s cancelled after exceeding its budget", operation)
+        raise DeadlineExceeded(operation) from None
+
+# --- Distributed tracing (optional OpenTelemetry spans with W3C trace context) ---
+_tracer = None
+
+def _get_tracer():
+    """Return an OpenTelemetry tracer for TRACING_EXPORTER, or None when tracing is off/unavailable"""
+    global _tracer
+    if _tracer is None:
+        _tracer = False
+        if TRACING_EXPORTER:
+            try:
+                _tracer = _configure_tracer(TRACING_EXPORTER)
+            except ImportError as e:
+                http_logger.warning("[TRACING] TRACING_EXPORTER=%s but OpenTelemetry is not installed: %s", TRACING_EXPORTER, e)
+    return _tracer or None
+
+def _configure_tracer(exporter_name: str):
+    from opentelemetry import trace
+    if exporter_name == "global":
+        # Provider already configured by the host (e.g. azure-monitor-opentelemetry)
+        return trace.get_tracer("s4hana-mcp-server")
+
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    if exporter_name == "otlp":
+        # Endpoint/headers come from the standard OTEL_EXPORTER_OTLP_* settings
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE_PATH, "a", encoding="utf-8"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    elif exporter_name == "console":
+        exporter = ConsoleSpanExporter()
+    else:
+        http_logger.warning("[TRACING] Unknown TRACING_EXPORTER %s; tracing disabled", exporter_name)
+        return False
+    provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider.get_tracer("s4hana-mcp-server")
+
+class _NoopSpan:
+    """Stand-in span when tracing is disabled"""
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def update_name(self, name):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+@contextlib.contextmanager
+def trace_span(name: str, attributes: dict = None, *, kind: str = "internal", carrier=None):
+    """Run the enclosed block in a child span of the current one
+
+    `carrier` (e.g. incoming request headers) starts the span from a remote W3C
+    traceparent instead. Exceptions are recorded on the span and re-raised.
+    """
+    tracer = _get_tracer()
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+    from opentelemetry import propagate
+    from opentelemetry.trace import SpanKind
+    context = propagate.extract(carrier) if carrier is not None else None
+    attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+    with tracer.start_as_current_span(name, context=context, kind=getattr(SpanKind, kind.upper()),
+                                      attributes=attributes) as span:
+        yield span
+
+def current_span():
+    """The active span (or a no-op stand-in when tracing is disabled)"""
+    if _get_tracer() is None:
+        return _NOOP_SPAN
+    from opentelemetry import trace
+    return trace.get_current_span()
+
+def inject_trace_headers(headers: dict) -> dict:
+    """Add traceparent/tracestate for the active span to outbound request headers"""
+    if _get_tracer() is not None:
+        from opentelemetry import propagate
+        propagate.inject(headers)
+    return headers
+
+def traced(name: str):
+    """Decorator wrapping a (sync or async) function in a span"""
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with trace_span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- In-process metrics (Prometheus text exposition + optional OpenTelemetry bridge) ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+metrics_registry = []
+_otel_meter = None
+
+def _get_otel_meter():
+    """Return an OpenTelemetry meter when METRICS_OTEL_ENABLED and the API is installed, else None"""
+    global _otel_meter
+    if _otel_meter is None:
+        _otel_meter = False
+        if METRICS_OTEL_ENABLED:
+            try:
+                from opentelemetry import metrics as otel_metrics
+                _otel_meter = otel_metrics.get_meter("s4hana-mcp-server")
+            except ImportError:
+                metrics_logger.warning("[METRICS] METRICS_OTEL_ENABLED is set but opentelemetry-api is not installed")
+    return _otel_meter or None
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value) -> str:
+    return repr(float(value))
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape_label_value(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    """Base for labelled metrics kept in process memory for this worker"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self._otel_instrument = None
+        metrics_registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _otel(self):
+        if self._otel_instrument is None:
+            meter = _get_otel_meter()
+            self._otel_instrument = self._create_otel_instrument(meter) if meter else False
+        return self._otel_instrument or None
+
+    def _create_otel_instrument(self, meter):
+        return None
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key in sorted(self.series):
+            lines.extend(self._render_series(key, self.series[key]))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self.series[key] = self.series.get(key, 0.0) + amount
+        instrument = self._otel()
+        if instrument:
+            instrument.add(amount, dict(zip(self.labelnames, key)))
+
+    def _create_otel_instrument(self, meter):
+        return meter.create_counter(self.name, description=self.documentation)
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames, collect):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+        self._otel()  # observable instruments must be registered up front
+
+    def _create_otel_instrument(self, meter):
+        def observe(options):
+            from opentelemetry.metrics import Observation
+            return [Observation(value, dict(zip(self.labelnames, key))) for key, value in self._read().items()]
+        return meter.create_observable_gauge(self.name, callbacks=[observe], description=self.documentation)
+
+    def _read(self) -> dict:
+        try:
+            return {tuple(str(v) for v in key): float(value) for key, value in self.collect()}
+        except Exception as e:
+            metrics_logger.warning("[METRICS] Failed to collect %s: %s", self.name, e)
+            return {}
+
+    def render(self) -> list:
+        self._otel()
+        self.series = self._read()
+        return super().render()
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["counts"][i] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+        instrument = self._otel()
+        if instrument:
+            instrument.record(value, dict(zip(self.labelnames, key)))
+
+    def _create_otel_instrument(self, meter):
+        return meter.create_histogram(self.name, description=self.documentation)
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series["counts"]):
+            cumulative += count
+            le = 'le="' + _format_value(bound) + '"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        inf = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, inf)} {series['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+def render_metrics() -> str:
+    """All registered metrics in Prometheus text exposition format (0.0.4)"""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+@contextlib.contextmanager
+def observe_duration(histogram: Histogram, **labels):
+    """Time the enclosed block into histogram, labelled outcome=ok|error"""
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.observe(time.monotonic() - started, outcome=outcome, **labels)
+
+HTTP_REQUESTS_TOTAL = Counter("http_requests_total", "HTTP requests served, by route and status", ("route", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("route",))
+HTTP_RESPONSE_BYTES = Histogram("http_response_bytes", "HTTP response body size (after compression)", ("route",), SIZE_BUCKETS)
+MCP_REQUESTS_TOTAL = Counter("mcp_requests_total", "MCP JSON-RPC requests by method", ("method",))
+MCP_METHOD_SECONDS = Histogram("mcp_method_duration_seconds", "MCP JSON-RPC latency by method", ("method",))
+MCP_TOOL_SECONDS = Histogram("mcp_tool_duration_seconds", "MCP tools/call latency by tool and outcome", ("tool", "outcome"))
+SAP_REQUESTS_TOTAL = Counter("sap_requests_total", "SAP OData round trips by entity, method and status", ("service", "entity", "method", "status"))
+SAP_PHASE_SECONDS = Histogram("sap_request_phase_seconds", "SAP OData latency split into connect/ttfb/download/parse", ("service", "entity", "method", "phase"))
+SAP_RESPONSE_BYTES = Histogram("sap_response_bytes", "SAP OData response size on the wire and decoded", ("entity", "form"), SIZE_BUCKETS)
+SAP_FEED_PARSES_TOTAL = Counter("sap_feed_parses_total", "SAP feed parses by where they ran (inline/thread/process)", ("mode",))
+BLOB_OPERATION_SECONDS = Histogram("blob_operation_duration_seconds", "Azure Blob Storage operation latency", ("operation", "outcome"))
+CACHE_LOOKUPS_TOTAL = Counter("cache_lookups_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+ODATA_QUERIES_TOTAL = Counter("odata_queries_total", "Client OData queries by entity and guard outcome (accepted/rewritten/rejected)", ("entity", "outcome"))
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS_TOTAL.inc(cache=cache, result="hit" if hit else "miss")
+
+_request_metric_labels = contextvars.ContextVar("request_metric_labels", default=None)
+
+def annotate_request_metrics(**labels):
+    """Attach labels (e.g. MCP method) to the request being timed by instrumented_route"""
+    current = _request_metric_labels.get()
+    if current is not None:
+        current.update(labels)
+
+def request_caller() -> str:
+    """Tool name (inside tools/call) or route of the request being served"""
+    labels = _request_metric_labels.get() or {}
+    return labels.get("tool") or labels.get("route") or ""
+
+def instrumented_route(route: str):
+    """Record request count, latency and response size for an HTTP function"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(req: func.HttpRequest) -> func.HttpResponse:
+            labels = {"route": route}
+            token = _request_metric_labels.set(labels)
+            started = time.monotonic()
+            status = "500"
+            try:
+                # Continue the caller's (e.g. APIM's) W3C trace when a traceparent header is present
+                with trace_span(f"{req.method} /api/{route}", {"http.route": route, "http.request.method": req.method},
+                                kind="server", carrier=req.headers) as span:
+                    response = await handler(req)
+                    status = str(response.status_code)
+                    body_size = len(response.get_body() or b"")
+                    span.set_attributes({"http.response.status_code": response.status_code,
+                                         "http.response.body.size": body_size})
+                HTTP_RESPONSE_BYTES.observe(body_size, route=route)
+                return response
+            finally:
+                elapsed = time.monotonic() - started
+                _request_metric_labels.reset(token)
+                HTTP_REQUESTS_TOTAL.inc(route=route, status=status)
+                HTTP_REQUEST_SECONDS.observe(elapsed, route=route)
+                if "method" in labels:
+                    MCP_METHOD_SECONDS.observe(elapsed, method=labels["method"])
+        return wrapper
+    return decorator
+
 # --- Azure Blob Storage Helper Functions ---
+def blob_timeout(operation: str) -> int:
+    """Blob SDK timeout (whole seconds) within the remaining request budget"""
+    return max(1, int(deadline_timeout(BLOB_TIMEOUT_SECONDS, operation)))
+
+@contextlib.contextmanager
+def blob_operation(operation: str, blob_name: str = None, container: str = BLOB_CONTAINER_NAME):
+    """Time and trace one Blob Storage call"""
+    with trace_span(f"blob.{operation}", {"blob.container": container, "blob.name": blob_name}, kind="client"), \
+            observe_duration(BLOB_OPERATION_SECONDS, operation=operation):
+        yield
+
+_blob_service_client = None
+_blob_credential = None
+
 def get_blob_service_client():
-    """Get Azure Blob Storage client"""
+    """Get Azure Blob Storage client (built on first use, then shared; the SDK client is thread-safe)"""
+    global _blob_service_client, _blob_credential
+    if _blob_service_client is not None:
+        return _blob_service_client
     try:
+        from azure.storage.blob import BlobServiceClient
         if BLOB_CONNECTION_STRING:
-            return BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
+            _blob_service_client = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
         else:
             # Fallback to default credential (for managed identity)
             from azure.identity import DefaultAzureCredential
-            credential = DefaultAzureCredential()
+            credential = _blob_credential = DefaultAzureCredential()
             storage_account_url = os.getenv("BLOB_STORAGE_ACCOUNT_URL", "https://your-storage-account.blob.core.windows.net")
-            return BlobServiceClient(
+            _blob_service_client = BlobServiceClient(
                 account_url=storage_account_url,
                 credential=credential
             )
+        return _blob_service_client
     except Exception as e:
-        logging.error(f"Failed to create blob service client: {str(e)}")
+        blob_logger.error("Failed to create blob service client: %s", e)
         return None
 
 async def save_approval_request_to_blob(request_id: str, request_data: dict) -> bool:
@@ -108,13 +948,16 @@ async def save_approval_request_to_blob(request_id: str, request_data: dict) ->
         
         # Upload as JSON
         json_data = json.dumps(request_data, indent=2)
-        blob_client.upload_blob(json_data, overwrite=True)
+        with blob_operation("upload", blob_name):
+            blob_client.upload_blob(json_data, overwrite=True, timeout=blob_timeout(f"blob save {request_id}"))
         
-        logging.info(f"[BLOB STORAGE] Saved approval request {request_id} to blob storage")
+        blob_logger.info("[BLOB STORAGE] Saved approval request %s to blob storage", request_id)
         return True
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.error(f"[BLOB STORAGE ERROR] Failed to save {request_id}: {str(e)}")
+        blob_logger.error("[BLOB STORAGE ERROR] Failed to save %s: %s", request_id, e)
         return False
 
 async def get_approval_request_from_blob(request_id: str) -> dict:
@@ -131,14 +974,17 @@ async def get_approval_request_from_blob(request_id: str) -> dict:
         )
         
         # Download blob content
-        blob_data = blob_client.download_blob().readall()
+        with blob_operation("download", blob_name):
+            blob_data = blob_client.download_blob(timeout=blob_timeout(f"blob read {request_id}")).readall()
         request_data = json.loads(blob_data.decode('utf-8'))
         
-        logging.info(f"[BLOB STORAGE] Retrieved approval request {request_id} from blob storage")
+        blob_logger.info("[BLOB STORAGE] Retrieved approval request %s from blob storage", request_id)
         return request_data
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.error(f"[BLOB STORAGE ERROR] Failed to retrieve {request_id}: {str(e)}")
+        blob_logger.error("[BLOB STORAGE ERROR] Failed to retrieve %s: %s", request_id, e)
         return {}
 
 async def list_approval_requests_from_blob() -> list:
@@ -151,25 +997,33 @@ async def list_approval_requests_from_blob() -> list:
         container_client = blob_service_client.get_container_client(BLOB_CONTAINER_NAME)
         
         requests = []
-        for blob in container_client.list_blobs():
+        with blob_operation("list"):
+            # Only approval requests; diagnostics and other blobs share the container
+            blob_items = list(container_client.list_blobs(name_starts_with="SO-REQ-", timeout=blob_timeout("blob list")))
+        for blob in blob_items:
             if blob.name.endswith('.json'):
                 try:
                     blob_client = blob_service_client.get_blob_client(
                         container=BLOB_CONTAINER_NAME, 
                         blob=blob.name
                     )
-                    blob_data = blob_client.download_blob().readall()
+                    with blob_operation("download", blob.name):
+                        blob_data = blob_client.download_blob(timeout=blob_timeout(f"blob read {blob.name}")).readall()
                     request_data = json.loads(blob_data.decode('utf-8'))
                     requests.append(request_data)
+                except DeadlineExceeded:
+                    raise
                 except Exception as blob_error:
-                    logging.warning(f"[BLOB STORAGE] Failed to read blob {blob.name}: {str(blob_error)}")
+                    blob_logger.warning("[BLOB STORAGE] Failed to read blob %s: %s", blob.name, blob_error)
                     continue
         
-        logging.info(f"[BLOB STORAGE] Retrieved {len(requests)} approval requests from blob storage")
+        blob_logger.info("[BLOB STORAGE] Retrieved %s approval requests from blob storage", len(requests))
         return requests
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.error(f"[BLOB STORAGE ERROR] Failed to list approval requests: {str(e)}")
+        blob_logger.error("[BLOB STORAGE ERROR] Failed to list approval requests: %s", e)
         return []
 
 async def update_approval_request_in_blob(request_id: str, updates: dict) -> bool:
@@ -187,12 +1041,67 @@ async def update_approval_request_in_blob(request_id: str, updates: dict) -> boo
         # Save back to blob
         return await save_approval_request_to_blob(request_id, existing_data)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.error(f"[BLOB STORAGE ERROR] Failed to update {request_id}: {str(e)}")
+        blob_logger.error("[BLOB STORAGE ERROR] Failed to update %s: %s", request_id, e)
         return False
 
+async def transition_approval_request_in_blob(request_id: str, from_status: str, updates: dict) -> str:
+    """Apply `updates` only if the stored request is still in `from_status`
+
+    The write is conditional on the ETag read, so two instances (or a double click)
+    cannot both decide the same request. Returns "ok", "conflict" (already decided or
+    changed concurrently), "not_found" or "unavailable" (storage error).
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+    try:
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            return "unavailable"
+
+        blob_name = f"{request_id}.json"
+        blob_client = blob_service_client.get_blob_client(
+            container=BLOB_CONTAINER_NAME,
+            blob=blob_name
+        )
+
+        with blob_operation("download", blob_name):
+            downloader = blob_client.download_blob(timeout=blob_timeout(f"blob read {request_id}"))
+            existing_data = json.loads(downloader.readall().decode('utf-8'))
+        if existing_data.get("status") != from_status:
+            blob_logger.warning("[BLOB STORAGE] %s is %s, not %s", request_id, existing_data.get("status"), from_status)
+            return "conflict"
+
+        existing_data.update(updates)
+        existing_data["last_updated"] = datetime.now(timezone.utc).isoformat()
+        with blob_operation("upload", blob_name):
+            blob_client.upload_blob(
+                json.dumps(existing_data, indent=2),
+                overwrite=True,
+                etag=downloader.properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+                timeout=blob_timeout(f"blob save {request_id}")
+            )
+
+        blob_logger.info("[BLOB STORAGE] %s moved from %s to %s", request_id, from_status, updates.get("status"))
+        return "ok"
+
+    except DeadlineExceeded:
+        raise
+    except ResourceModifiedError:
+        blob_logger.warning("[BLOB STORAGE] %s was changed concurrently", request_id)
+        return "conflict"
+    except ResourceNotFoundError:
+        return "not_found"
+    except Exception as e:
+        blob_logger.error("[BLOB STORAGE ERROR] Failed to update %s: %s", request_id, e)
+        return "unavailable"
+
 # --- MCP Tool Discovery - Combined BP & SO ---
 @app.route(route="tools", methods=["GET", "OPTIONS"])
+@instrumented_route("tools")
 async def tools_discovery(req: func.HttpRequest) -> func.HttpResponse:
     if req.method == "OPTIONS":
         response = func.HttpResponse("")
@@ -230,7 +1139,132 @@ async def tools_discovery(req: func.HttpRequest) -> func.HttpResponse:
                                     },
                                     "query": {
                                         "type": "string",
-                                        "description": "Optional OData query params ($filter, $select, $top, $skip, etc.)"
+                                        "description": f"Optional OData query params ($filter, $select, $orderby, $top, $skip, $expand). "
+                                                       f"$top defaults to {ODATA_DEFAULT_TOP} (max {ODATA_MAX_TOP}); filter with eq or "
+                                                       f"startswith() on key fields rather than substringof()"
+                                    },
+                                    "format": {
+                                        "type": "string",
+                                        "description": "raw: SAP property texts as returned; typed: rows with numbers, booleans, ISO 8601 dates and nulls "
+                                                       "converted per $metadata; columns: the same typed values as one array per property",
+                                        "enum": list(ODATA_VALUE_FORMATS),
+                                        "default": "raw"
+                                    }
+                                },
+                                "required": ["entity"]
+                            }
+                        },
+                        {
+                            "name": "query_many",
+                            "description": "Run several query_s4hana reads (any entities) concurrently in one call; returns each result, row count, timing or error under its key",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "queries": {
+                                        "type": "array",
+                                        "description": f"1 to {QUERY_MANY_MAX_QUERIES} reads, each {{entity, query, key}}; key names the result (default '<index>:<entity>')",
+                                        "items": {
+                                            "type": "object",
+                                            "properties": {
+                                                "key": {"type": "string"},
+                                                "entity": {"type": "string", "enum": list(ALL_ODATA.keys())},
+                                                "query": {"type": "string", "description": "OData query params, as for query_s4hana"}
+                                            },
+                                            "required": ["entity"]
+                                        }
+                                    },
+                                    "max_concurrency": {
+                                        "type": "integer",
+                                        "description": f"Reads in flight at once (max {QUERY_MANY_CONCURRENCY})",
+                                        "default": QUERY_MANY_CONCURRENCY
+                                    }
+                                },
+                                "required": ["queries"]
+                            }
+                        },
+                        {
+                            "name": "customer_360",
+                            "description": "Everything about one customer in a single call: business partner, customer account, addresses and recent sales orders, read in parallel",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "customer": {
+                                        "type": "string",
+                                        "description": "BusinessPartner / SoldToParty number, e.g. 10100001"
+                                    },
+                                    "recent_orders": {
+                                        "type": "integer",
+                                        "description": "Newest sales orders to include (0-100, 0 skips them)",
+                                        "default": CUSTOMER_360_RECENT_ORDERS
+                                    }
+                                },
+                                "required": ["customer"]
+                            }
+                        },
+                        {
+                            "name": "aggregate_s4hana",
+                            "description": "Aggregate S/4HANA entities server-side (e.g. total order value by customer): reads every matching row and returns only count/sum/min/max/avg per group",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "entity": {
+                                        "type": "string",
+                                        "description": "S/4HANA OData entity name",
+                                        "enum": list(ALL_ODATA.keys())
+                                    },
+                                    "measures": {
+                                        "type": "array",
+                                        "description": "count, count(Field), sum(Field), min(Field), max(Field) or avg(Field), e.g. ['count', 'sum(TotalNetAmount)']",
+                                        "items": {"type": "string"},
+                                        "default": ["count"]
+                                    },
+                                    "group_by": {
+                                        "type": "array",
+                                        "description": "Fields to group by, dates optionally bucketed as Field:year|quarter|month|day, e.g. ['SoldToParty', 'CreationDate:month']",
+                                        "items": {"type": "string"}
+                                    },
+                                    "filter": {
+                                        "type": "string",
+                                        "description": "Optional OData $filter expression, e.g. CreationDate ge datetime'2025-01-01T00:00:00'"
+                                    },
+                                    "order_by": {
+                                        "type": "string",
+                                        "description": "Group_by item or measure to sort by, with asc or desc, e.g. 'sum(TotalNetAmount) desc'"
+                                    },
+                                    "top": {
+                                        "type": "integer",
+                                        "description": "Maximum groups returned",
+                                        "default": 100
+                                    }
+                                },
+                                "required": ["entity"]
+                            }
+                        },
+                        {
+                            "name": "export_s4hana",
+                            "description": "Export a whole S/4HANA entity set (optionally filtered) to a NDJSON or Parquet file in blob storage for reporting; returns the blob name, a short-lived read-only download URL and the row count instead of the rows",
+                            "inputSchema": {
+                                "type": "object",
+                                "properties": {
+                                    "entity": {
+                                        "type": "string",
+                                        "description": "S/4HANA OData entity name",
+                                        "enum": list(ALL_ODATA.keys())
+                                    },
+                                    "format": {
+                                        "type": "string",
+                                        "description": "File format: ndjson (one JSON object per line) or parquet",
+                                        "enum": list(EXPORT_FORMATS),
+                                        "default": "ndjson"
+                                    },
+                                    "filter": {
+                                        "type": "string",
+                                        "description": "Optional OData $filter expression"
+                                    },
+                                    "select": {
+                                        "type": "array",
+                                        "description": "Optional properties to export (default: all)",
+                                        "items": {"type": "string"}
                                     }
                                 },
                                 "required": ["entity"]
@@ -288,6 +1322,10 @@ async def tools_discovery(req: func.HttpRequest) -> func.HttpResponse:
             simple_response = {
                 "tools": [
                     {"name": "query_s4hana", "description": "Query S/4HANA entities"},
+                    {"name": "query_many", "description": "Run several S/4HANA queries concurrently"},
+                    {"name": "customer_360", "description": "Partner, account, addresses and recent orders of one customer"},
+                    {"name": "aggregate_s4hana", "description": "Aggregate S/4HANA entities server-side"},
+                    {"name": "export_s4hana", "description": "Export S/4HANA entity sets to blob storage"},
                     {"name": "create_s4hana_entity", "description": "Create S/4HANA entities"}, 
                     {"name": "check_and_create_sales_orders", "description": "PoC workflow"}
                 ]
@@ -316,9 +1354,11 @@ async def tools_discovery(req: func.HttpRequest) -> func.HttpResponse:
     response = func.HttpResponse(json.dumps(openapi_schema), mimetype="application/json")
     return add_cors_headers(response)
 
+
 # --- Remove separate query, create, workflow handlers and consolidate into SSE ---
 # --- MCP Server-Sent Events Endpoint (Main MCP Protocol Handler) ---
 @app.route(route="sse", methods=["POST", "OPTIONS"])
+@instrumented_route("sse")
 async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
     """MCP Server-Sent Events endpoint for MCP protocol"""
     
@@ -329,8 +1369,7 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
     # Handle MCP protocol messages
     if req.method == "POST":
         try:
-            raw_body = req.get_body()
-            logging.info(f"[MCP SSE] Incoming {req.method}: {raw_body}")
+            mcp_logger.debug("[MCP SSE] Incoming %s: %s", req.method, LogPayload(req.get_body()))
             body = req.get_json()
             
             if not body or body.get("jsonrpc") != "2.0":
@@ -343,6 +1382,10 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
             
             method = body.get("method", "")
             msg_id = body.get("id")
+            MCP_REQUESTS_TOTAL.inc(method=method or "unknown")
+            annotate_request_metrics(method=method or "unknown")
+            current_span().update_name(f"mcp {method or 'unknown'}")
+            current_span().set_attributes({"rpc.system": "jsonrpc", "rpc.method": method, "rpc.jsonrpc.request_id": str(msg_id)})
             
             # Handle MCP initialization
             if method == "initialize":
@@ -390,61 +1433,186 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                                         },
                                         "query": {
                                             "type": "string",
-                                            "description": "Optional OData query params ($filter, $select, $top, $skip, etc.)"
+                                            "description": f"Optional OData query params ($filter, $select, $orderby, $top, $skip, $expand). "
+                                                           f"$top defaults to {ODATA_DEFAULT_TOP} (max {ODATA_MAX_TOP}); filter with eq or "
+                                                           f"startswith() on key fields rather than substringof()"
+                                        },
+                                        "format": {
+                                            "type": "string",
+                                            "description": "raw: SAP property texts as returned; typed: rows with numbers, booleans, ISO 8601 dates and nulls "
+                                                           "converted per $metadata; columns: the same typed values as one array per property",
+                                            "enum": list(ODATA_VALUE_FORMATS),
+                                            "default": "raw"
                                         }
                                     },
                                     "required": ["entity"]
                                 }
                             },
                             {
-                                "name": "create_s4hana_entity",
-                                "description": "Create S/4HANA entities (Sales Orders: salesorders, salesorderitems | Business Partners: businesspartneraddresses, businesspartnercontacts)",
+                                "name": "query_many",
+                                "description": "Run several query_s4hana reads (any entities) concurrently in one call; returns each result, row count, timing or error under its key",
                                 "inputSchema": {
                                     "type": "object",
                                     "properties": {
-                                        "entity": {
-                                            "type": "string", 
-                                            "enum": list(ALL_ODATA_CREATE.keys())
+                                        "queries": {
+                                            "type": "array",
+                                            "description": f"1 to {QUERY_MANY_MAX_QUERIES} reads, each {{entity, query, key}}; key names the result (default '<index>:<entity>')",
+                                            "items": {
+                                                "type": "object",
+                                                "properties": {
+                                                    "key": {"type": "string"},
+                                                    "entity": {"type": "string", "enum": list(ALL_ODATA.keys())},
+                                                    "query": {"type": "string", "description": "OData query params, as for query_s4hana"}
+                                                },
+                                                "required": ["entity"]
+                                            }
                                         },
-                                        "payload": {
-                                            "type": "object", 
-                                            "description": "Entity data to create"
+                                        "max_concurrency": {
+                                            "type": "integer",
+                                            "description": f"Reads in flight at once (max {QUERY_MANY_CONCURRENCY})",
+                                            "default": QUERY_MANY_CONCURRENCY
                                         }
                                     },
-                                    "required": ["entity", "payload"]
+                                    "required": ["queries"]
                                 }
                             },
                             {
-                                "name": "check_and_create_sales_orders",
-                                "description": "PoC workflow: Check sales orders and create line items if lacking",
+                                "name": "customer_360",
+                                "description": "Everything about one customer in a single call: business partner, customer account, addresses and recent sales orders, read in parallel",
                                 "inputSchema": {
                                     "type": "object",
                                     "properties": {
-                                        "customer_filter": {
+                                        "customer": {
                                             "type": "string",
-                                            "description": "Optional filter for customer (e.g. 'Customer eq \"10100001\"')"
+                                            "description": "BusinessPartner / SoldToParty number, e.g. 10100001"
                                         },
-                                        "min_orders": {
+                                        "recent_orders": {
                                             "type": "integer",
-                                            "description": "Minimum number of orders expected",
-                                            "default": 1
-                                        },
-                                        "line_items_to_create": {
-                                            "type": "array",
-                                            "description": "Sales order line items to create if lacking",
-                                            "items": {"type": "object"}
+                                            "description": "Newest sales orders to include (0-100, 0 skips them)",
+                                            "default": CUSTOMER_360_RECENT_ORDERS
                                         }
                                     },
-                                    "required": ["line_items_to_create"]
+                                    "required": ["customer"]
                                 }
                             },
                             {
-                                "name": "check_approval_status",
-                                "description": "Check the approval status of a sales order request",
+                                "name": "aggregate_s4hana",
+                                "description": "Aggregate S/4HANA entities server-side (e.g. total order value by customer): reads every matching row and returns only count/sum/min/max/avg per group",
                                 "inputSchema": {
                                     "type": "object",
                                     "properties": {
-                                        "request_id": {
+                                        "entity": {
+                                            "type": "string",
+                                            "description": "S/4HANA OData entity name",
+                                            "enum": list(ALL_ODATA.keys())
+                                        },
+                                        "measures": {
+                                            "type": "array",
+                                            "description": "count, count(Field), sum(Field), min(Field), max(Field) or avg(Field), e.g. ['count', 'sum(TotalNetAmount)']",
+                                            "items": {"type": "string"},
+                                            "default": ["count"]
+                                        },
+                                        "group_by": {
+                                            "type": "array",
+                                            "description": "Fields to group by, dates optionally bucketed as Field:year|quarter|month|day, e.g. ['SoldToParty', 'CreationDate:month']",
+                                            "items": {"type": "string"}
+                                        },
+                                        "filter": {
+                                            "type": "string",
+                                            "description": "Optional OData $filter expression, e.g. CreationDate ge datetime'2025-01-01T00:00:00'"
+                                        },
+                                        "order_by": {
+                                            "type": "string",
+                                            "description": "Group_by item or measure to sort by, with asc or desc, e.g. 'sum(TotalNetAmount) desc'"
+                                        },
+                                        "top": {
+                                            "type": "integer",
+                                            "description": "Maximum groups returned",
+                                            "default": 100
+                                        }
+                                    },
+                                    "required": ["entity"]
+                                }
+                            },
+                            {
+                                "name": "export_s4hana",
+                                "description": "Export a whole S/4HANA entity set (optionally filtered) to a NDJSON or Parquet file in blob storage for reporting; returns the blob name, a short-lived read-only download URL and the row count instead of the rows",
+                                "inputSchema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "entity": {
+                                            "type": "string",
+                                            "description": "S/4HANA OData entity name",
+                                            "enum": list(ALL_ODATA.keys())
+                                        },
+                                        "format": {
+                                            "type": "string",
+                                            "description": "File format: ndjson (one JSON object per line) or parquet",
+                                            "enum": list(EXPORT_FORMATS),
+                                            "default": "ndjson"
+                                        },
+                                        "filter": {
+                                            "type": "string",
+                                            "description": "Optional OData $filter expression"
+                                        },
+                                        "select": {
+                                            "type": "array",
+                                            "description": "Optional properties to export (default: all)",
+                                            "items": {"type": "string"}
+                                        }
+                                    },
+                                    "required": ["entity"]
+                                }
+                            },
+                            {
+                                "name": "create_s4hana_entity",
+                                "description": "Create S/4HANA entities (Sales Orders: salesorders, salesorderitems | Business Partners: businesspartneraddresses, businesspartnercontacts)",
+                                "inputSchema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "entity": {
+                                            "type": "string", 
+                                            "enum": list(ALL_ODATA_CREATE.keys())
+                                        },
+                                        "payload": {
+                                            "type": "object", 
+                                            "description": "Entity data to create"
+                                        }
+                                    },
+                                    "required": ["entity", "payload"]
+                                }
+                            },
+                            {
+                                "name": "check_and_create_sales_orders",
+                                "description": "PoC workflow: Check sales orders and create line items if lacking",
+                                "inputSchema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "customer_filter": {
+                                            "type": "string",
+                                            "description": "Optional filter for customer (e.g. 'Customer eq \"10100001\"')"
+                                        },
+                                        "min_orders": {
+                                            "type": "integer",
+                                            "description": "Minimum number of orders expected",
+                                            "default": 1
+                                        },
+                                        "line_items_to_create": {
+                                            "type": "array",
+                                            "description": "Sales order line items to create if lacking",
+                                            "items": {"type": "object"}
+                                        }
+                                    },
+                                    "required": ["line_items_to_create"]
+                                }
+                            },
+                            {
+                                "name": "check_approval_status",
+                                "description": "Check the approval status of a sales order request",
+                                "inputSchema": {
+                                    "type": "object",
+                                    "properties": {
+                                        "request_id": {
                                             "type": "string",
                                             "description": "The approval request ID to check"
                                         }
@@ -481,6 +1649,9 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                         arguments["query"] = body.get("query")
                     if body.get("payload"):
                         arguments["payload"] = body.get("payload")
+                    for name in ("queries", "max_concurrency", "customer", "recent_orders", "measures", "group_by", "filter", "order_by", "top", "format", "select"):
+                        if body.get(name) is not None:  # keep falsy values such as recent_orders: 0
+                            arguments[name] = body.get(name)
                     if body.get("customer_filter"):
                         arguments["customer_filter"] = body.get("customer_filter")
                     if body.get("min_orders"):
@@ -488,16 +1659,44 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                     if body.get("line_items_to_create"):
                         arguments["line_items_to_create"] = body.get("line_items_to_create")
                 
-                logging.info(f"[MCP SSE] Tool execution - Name: {tool_name}, Arguments: {arguments}")
+                mcp_logger.info("[MCP SSE] Tool execution - Name: %s", tool_name)
+                annotate_request_metrics(tool=tool_name)
+                payload_logger.debug("[MCP SSE] %s arguments: %s", tool_name, LogPayload(arguments))
                 
-                if tool_name == "query_s4hana":
-                    return await handle_query_tool(msg_id, arguments)
-                elif tool_name == "create_s4hana_entity":
-                    return await handle_create_tool(msg_id, arguments)
-                elif tool_name == "check_and_create_sales_orders":
-                    return await handle_workflow_tool(msg_id, arguments)
-                elif tool_name == "check_approval_status":
-                    return await handle_approval_status_tool(msg_id, arguments)
+                tool_handlers = {
+                    "query_s4hana": handle_query_tool,
+                    "query_many": handle_query_many_tool,
+                    "customer_360": handle_customer_360_tool,
+                    "aggregate_s4hana": handle_aggregate_tool,
+                    "export_s4hana": handle_export_tool,
+                    "create_s4hana_entity": handle_create_tool,
+                    "check_and_create_sales_orders": handle_workflow_tool,
+                    "check_approval_status": handle_approval_status_tool
+                }
+                handler = tool_handlers.get(tool_name)
+                if handler:
+                    # Every downstream SAP/blob/webhook call draws on this tool call's budget
+                    started = time.monotonic()
+                    outcome = "error"
+                    with request_deadline(request_budget_seconds(req, params)), \
+                            trace_span(f"mcp.tool {tool_name}", {"mcp.tool": tool_name, "sap.entity": arguments.get("entity")}) as span:
+                        try:
+                            http_response = await run_with_deadline(handler(msg_id, arguments), f"tools/call {tool_name}")
+                            # Handlers answer with jsonrpc_response, which records whether it was an error
+                            outcome = getattr(http_response, "mcp_outcome", "error")
+                        except DeadlineExceeded as e:
+                            outcome = "deadline_exceeded"
+                            response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+                            http_response = jsonrpc_response(response)
+                        finally:
+                            MCP_TOOL_SECONDS.observe(time.monotonic() - started, tool=tool_name, outcome=outcome)
+                            span.set_attribute("mcp.tool.outcome", outcome)
+                    if TRAFFIC_CAPTURE_ENABLED:
+                        traffic_recorder.record(tool=tool_name, arguments=arguments, seconds=time.monotonic() - started,
+                                                response_bytes=len(http_response.get_body()), outcome=outcome)
+                    http_response = compress_response(req, http_response)
+                    http_response.mcp_outcome = outcome
+                    return http_response
                 else:
                     response = {
                         "jsonrpc": "2.0",
@@ -506,7 +1705,7 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                             "code": -32601,
                             "message": f"Unknown tool: {tool_name}",
                             "data": {
-                                "available_tools": ["query_s4hana", "create_s4hana_entity", "check_and_create_sales_orders", "check_approval_status"]
+                                "available_tools": list(tool_handlers.keys())
                             }
                         }
                     }
@@ -529,7 +1728,7 @@ async def mcp_sse_endpoint(req: func.HttpRequest) -> func.HttpResponse:
                 return add_cors_headers(http_response)
                 
         except Exception as e:
-            logging.exception("[Error] MCP SSE endpoint failed")
+            mcp_logger.exception("[Error] MCP SSE endpoint failed")
             response = func.HttpResponse(f"Internal server error: {str(e)}", status_code=500)
             return add_cors_headers(response)
     
@@ -546,6 +1745,7 @@ async def handle_query_tool(msg_id, arguments):
     try:
         entity = arguments.get("entity", "").lower()
         query = arguments.get("query", "")
+        value_format = str(arguments.get("format") or "raw").lower()
         
         if entity not in ALL_ODATA:
             response = {
@@ -556,21 +1756,35 @@ async def handle_query_tool(msg_id, arguments):
                     "message": f"Invalid entity '{entity}'. Allowed: {list(ALL_ODATA.keys())}"
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
+        if value_format not in ODATA_VALUE_FORMATS:
+            response = {"jsonrpc": "2.0", "id": msg_id,
+                        "error": {"code": -32602, "message": f"format must be one of {list(ODATA_VALUE_FORMATS)}"}}
+            return jsonrpc_response(response)
+
+        try:
+            query, notes = prepare_odata_query(entity, query)
+        except ODataQueryError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+            return jsonrpc_response(response)
         
         resp = await fetch_odata_response(entity, query)
         if resp.status_code == 200:
             data = json.loads(resp.get_body().decode())
+            if value_format != "raw":
+                data = typed_odata_rows(data, await sap_metadata.schema_for(entity), value_format)
+            # The columns form is meant to be compact, so it is not pretty-printed
+            content = [{"type": "text", "text": json.dumps(data, indent=None if value_format == "columns" else 2)}]
+            if notes:
+                content.append({"type": "text", "text": f"Query adjusted ({query}): " + "; ".join(notes)})
             response = {
                 "jsonrpc": "2.0",
                 "id": msg_id,
                 "result": {
-                    "content": [{"type": "text", "text": json.dumps(data, indent=2)}]
+                    "content": content
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
         else:
             response = {
                 "jsonrpc": "2.0",
@@ -580,10 +1794,295 @@ async def handle_query_tool(msg_id, arguments):
                     "message": f"S/4HANA query failed: {resp.get_body().decode()}"
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        mcp_logger.exception("[Error] Query tool failed")
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "error": {
+                "code": -32603,
+                "message": f"Internal error: {str(e)}"
+            }
+        }
+        return jsonrpc_response(response)
+
+async def handle_query_many_tool(msg_id, arguments):
+    """Handle query_many tool calls: several query_s4hana reads at once, each with its own result or error"""
+    try:
+        queries = arguments.get("queries")
+        if not isinstance(queries, list) or not queries or len(queries) > QUERY_MANY_MAX_QUERIES:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {
+                    "code": -32602,
+                    "message": f"queries must be a list of 1 to {QUERY_MANY_MAX_QUERIES} {{entity, query, key}} objects"
+                }
+            }
+            return jsonrpc_response(response)
+        keys = [str(item.get("key") or f"{index}:{item.get('entity', '')}") if isinstance(item, dict) else str(index)
+                for index, item in enumerate(queries)]
+        if len(set(keys)) < len(keys):
+            response = {"jsonrpc": "2.0", "id": msg_id,
+                        "error": {"code": -32602, "message": "Each query needs a distinct key"}}
+            return jsonrpc_response(response)
+        try:
+            concurrency = max(1, min(int(arguments.get("max_concurrency") or QUERY_MANY_CONCURRENCY),
+                                     QUERY_MANY_CONCURRENCY))
+        except (TypeError, ValueError):
+            concurrency = QUERY_MANY_CONCURRENCY
+        # Caps this call only; the SAP adaptive concurrency limiter still applies across all calls
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(item) -> dict:
+            if not isinstance(item, dict):
+                return {"status": "error", "error": {"error": "INVALID_QUERY", "message": "Each query must be an object"}}
+            entity = str(item.get("entity", "")).lower()
+            result = {"entity": entity}
+            if entity not in ALL_ODATA:
+                result.update(status="error", error={"error": "INVALID_QUERY", "message": f"Invalid entity '{entity}'"})
+                return result
+            try:
+                query, notes = prepare_odata_query(entity, item.get("query", ""))
+            except ODataQueryError as e:
+                result.update(status="error", error=e.to_dict())
+                return result
+            result["query"] = query
+            if notes:
+                result["notes"] = notes
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    resp = await fetch_odata_response(entity, query)
+                except DeadlineExceeded as e:
+                    result.update(status="error", error=e.to_dict())
+                    return result
+                finally:
+                    result["ms"] = round((time.monotonic() - started) * 1000, 1)
+            if resp.status_code == 200:
+                data = json.loads(resp.get_body())
+                result.update(status="ok", rows=len(data), data=data)
+            else:
+                result.update(status="error", error={"status": resp.status_code,
+                                                     "message": resp.get_body().decode(errors="replace")[:500]})
+            return result
+
+        started = time.monotonic()
+        outcomes = await asyncio.gather(*(run_one(item) for item in queries))
+        results = dict(zip(keys, outcomes))
+        failed = sum(outcome["status"] != "ok" for outcome in outcomes)
+        summary = {"queries": len(queries), "succeeded": len(queries) - failed, "failed": failed,
+                   "concurrency": concurrency, "ms": round((time.monotonic() - started) * 1000, 1), "results": results}
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "content": [{"type": "text", "text": json.dumps(summary, indent=2)}]
+            }
+        }
+        return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        mcp_logger.exception("[Error] Query many tool failed")
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "error": {
+                "code": -32603,
+                "message": f"Internal error: {str(e)}"
+            }
+        }
+        return jsonrpc_response(response)
+
+async def handle_customer_360_tool(msg_id, arguments):
+    """Handle customer_360 tool calls: partner, customer account, addresses and recent orders of one customer"""
+    try:
+        customer = str(arguments.get("customer") or "").strip()
+        try:
+            recent_orders = int(arguments.get("recent_orders", CUSTOMER_360_RECENT_ORDERS))
+        except (TypeError, ValueError):
+            recent_orders = -1
+        if not customer or not 0 <= recent_orders <= 100:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {
+                    "code": -32602,
+                    "message": "customer (BusinessPartner / SoldToParty number) is required and recent_orders must be 0-100"
+                }
+            }
+            return jsonrpc_response(response)
+
+        async def read(name: str) -> tuple:
+            entity, key_field, select, orderby, top = CUSTOMER_360_READS[name]
+            query = f"$filter={key_field} eq {_encode_option_value(odata_string_literal(customer))}&$select={select}"
+            query += f"&$orderby={orderby}" if orderby else ""
+            query, _ = prepare_odata_query(entity, f"{query}&$top={top or recent_orders}")
+            started = time.monotonic()
+            try:
+                # Sales orders are not in sap_read_cache by default; these small projections are, briefly
+                resp = await fetch_odata_response(entity, query, cache_ttl=CUSTOMER_360_ORDER_CACHE_TTL_SECONDS
+                                                  if entity not in BP_ODATA else None)
+            except DeadlineExceeded as e:
+                return name, None, {"ms": round((time.monotonic() - started) * 1000, 1), "error": e.to_dict()}
+            source = {"ms": round((time.monotonic() - started) * 1000, 1)}
+            if resp.status_code != 200:
+                source["error"] = {"status": resp.status_code, "message": resp.get_body().decode(errors="replace")[:300]}
+                return name, None, source
+            # Compact: plain property names, empty values left out
+            rows = [{field: value for field, value in _plain_row(row).items() if value not in (None, "")}
+                    for row in json.loads(resp.get_body())]
+            return name, rows, source
+
+        names = [name for name in CUSTOMER_360_READS if name != "recent_orders" or recent_orders]
+        document = {"customer": customer}
+        sources = {}
+        for name, rows, source in await asyncio.gather(*(read(name) for name in names)):
+            sources[name] = source
+            if rows is not None and CUSTOMER_360_READS[name][4] == 1:
+                document[name] = rows[0] if rows else None
+            elif rows is not None:
+                document[name] = rows
+        document["found"] = bool(document.get("partner") or document.get("account"))
+        document["sources"] = sources
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "content": [{"type": "text", "text": json.dumps(document, indent=2)}]
+            }
+        }
+        return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        mcp_logger.exception("[Error] Customer 360 tool failed")
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "error": {
+                "code": -32603,
+                "message": f"Internal error: {str(e)}"
+            }
+        }
+        return jsonrpc_response(response)
+
+async def handle_aggregate_tool(msg_id, arguments):
+    """Handle aggregate_s4hana tool calls: every matching row is read, only the aggregates are returned"""
+    try:
+        entity = arguments.get("entity", "").lower()
+        if entity not in ALL_ODATA:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {
+                    "code": -32602,
+                    "message": f"Invalid entity '{entity}'. Allowed: {list(ALL_ODATA.keys())}"
+                }
+            }
+            return jsonrpc_response(response)
+
+        group_by = arguments.get("group_by") or []
+        measures = arguments.get("measures") or ["count"]
+        # Copilot Studio sends lists as comma-separated text
+        if isinstance(group_by, str):
+            group_by = [item for item in group_by.split(",") if item.strip()]
+        if isinstance(measures, str):
+            measures = re.findall(r"\w+(?:\([^)]*\))?", measures)
+        top = arguments.get("top")
+        try:
+            top = 100 if top is None else int(top)
+        except (TypeError, ValueError):
+            top = 0
+        if top < 1:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": {
+                "code": -32602, "message": f"top must be a positive integer, got '{arguments.get('top')}'"}}
+            return jsonrpc_response(response)
+        try:
+            result = await aggregate_odata(entity, group_by, measures, arguments.get("filter") or "",
+                                           arguments.get("order_by") or "", top)
+        except ODataQueryError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+            return jsonrpc_response(response)
+        except SapDegradedError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": {"code": 503, "message": str(e)}}
+            return jsonrpc_response(response)
+        except ODataFeedError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id,
+                        "error": {"code": e.status_code, "message": f"S/4HANA query failed: {e}"}}
+            return jsonrpc_response(response)
+
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "content": [{"type": "text", "text": json.dumps(result, indent=2)}]
+            }
+        }
+        return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        mcp_logger.exception("[Error] Aggregate tool failed")
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "error": {
+                "code": -32603,
+                "message": f"Internal error: {str(e)}"
+            }
+        }
+        return jsonrpc_response(response)
+
+async def handle_export_tool(msg_id, arguments):
+    """Handle export_s4hana tool calls: the rows go to a blob, the response carries its URL and counts"""
+    try:
+        entity = arguments.get("entity", "").lower()
+        if entity not in ALL_ODATA:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {
+                    "code": -32602,
+                    "message": f"Invalid entity '{entity}'. Allowed: {list(ALL_ODATA.keys())}"
+                }
+            }
+            return jsonrpc_response(response)
+
+        select = arguments.get("select") or []
+        # Copilot Studio sends lists as comma-separated text
+        if isinstance(select, str):
+            select = select.split(",")
+        try:
+            result = await export_odata(entity, (arguments.get("format") or "ndjson").lower(),
+                                        arguments.get("filter") or "", select)
+        except ODataQueryError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+            return jsonrpc_response(response)
+        except SapDegradedError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": {"code": 503, "message": str(e)}}
+            return jsonrpc_response(response)
+        except ODataFeedError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id,
+                        "error": {"code": e.status_code, "message": f"S/4HANA query failed: {e}"}}
+            return jsonrpc_response(response)
+
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "content": [{"type": "text", "text": json.dumps(result, indent=2)}]
+            }
+        }
+        return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.exception("[Error] Query tool failed")
+        mcp_logger.exception("[Error] Export tool failed")
         response = {
             "jsonrpc": "2.0",
             "id": msg_id,
@@ -592,8 +2091,7 @@ async def handle_query_tool(msg_id, arguments):
                 "message": f"Internal error: {str(e)}"
             }
         }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
+        return jsonrpc_response(response)
 
 async def handle_create_tool(msg_id, arguments):
     """Handle create_s4hana_entity tool calls"""
@@ -610,15 +2108,20 @@ async def handle_create_tool(msg_id, arguments):
                     "message": f"Invalid creatable entity '{entity}'. Allowed: {list(ALL_ODATA_CREATE.keys())}"
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
         
         # CHECK: If creating a sales order, trigger approval workflow instead of direct creation
         if entity == "salesorders":
-            logging.info("[APPROVAL TRIGGER] Sales order creation detected - routing to approval workflow")
+            mcp_logger.info("[APPROVAL TRIGGER] Sales order creation detected - routing to approval workflow")
+            # An order SAP would reject is refused now, not after a manager approved it
+            try:
+                await check_create_payload("salesorders", clean_sap_payload(payload))
+            except PayloadValidationError as e:
+                response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+                return jsonrpc_response(response)
             
             # Generate unique request ID
-            request_id = f"SO-REQ-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+            request_id = new_approval_request_id()
             
             # Store approval request in Azure Blob Storage
             approval_request_data = {
@@ -698,8 +2201,7 @@ async def handle_create_tool(msg_id, arguments):
                     }]
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
         
         # For non-sales order entities, proceed with direct creation (no approval needed)
         resp = await post_odata_entity(entity, payload, bypass_approval=True)
@@ -712,8 +2214,7 @@ async def handle_create_tool(msg_id, arguments):
                     "content": [{"type": "text", "text": json.dumps(result, indent=2)}]
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
         else:
             response = {
                 "jsonrpc": "2.0",
@@ -723,10 +2224,11 @@ async def handle_create_tool(msg_id, arguments):
                     "message": f"S/4HANA create failed: {resp.get_body().decode()}"
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.exception("[Error] Create tool failed")
+        mcp_logger.exception("[Error] Create tool failed")
         response = {
             "jsonrpc": "2.0",
             "id": msg_id,
@@ -735,8 +2237,7 @@ async def handle_create_tool(msg_id, arguments):
                 "message": f"Internal error: {str(e)}"
             }
         }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
+        return jsonrpc_response(response)
 
 async def handle_workflow_tool(msg_id, arguments):
     """Handle check_and_create_sales_orders workflow tool calls"""
@@ -749,6 +2250,11 @@ async def handle_workflow_tool(msg_id, arguments):
         query_params = f"$top=100"
         if customer_filter:
             query_params += f"&$filter={customer_filter}"
+        try:
+            query_params, _ = prepare_odata_query("salesorders", query_params)
+        except ODataQueryError as e:
+            response = {"jsonrpc": "2.0", "id": msg_id, "error": e.to_jsonrpc_error()}
+            return jsonrpc_response(response)
         
         resp = await fetch_odata_response("salesorders", query_params)
         if resp.status_code != 200:
@@ -760,8 +2266,7 @@ async def handle_workflow_tool(msg_id, arguments):
                     "message": f"Failed to query sales orders: {resp.get_body().decode()}"
                 }
             }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
+            return jsonrpc_response(response)
         
         sales_orders = json.loads(resp.get_body().decode())
         orders_count = len(sales_orders)
@@ -776,7 +2281,7 @@ async def handle_workflow_tool(msg_id, arguments):
         
         # Step 2: Check if we need to create orders
         if orders_count < min_orders:
-            logging.info(f"[WORKFLOW] Only {orders_count} orders found, need {min_orders}. Creating line items...")
+            mcp_logger.info("[WORKFLOW] Only %s orders found, need %s. Creating line items...", orders_count, min_orders)
             
             created_items = []
             for item_payload in line_items_to_create:
@@ -807,11 +2312,12 @@ async def handle_workflow_tool(msg_id, arguments):
                 "content": [{"type": "text", "text": json.dumps(workflow_result, indent=2)}]
             }
         }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
+        return jsonrpc_response(response)
         
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        logging.exception("[Error] Workflow tool failed")
+        mcp_logger.exception("[Error] Workflow tool failed")
         response = {
             "jsonrpc": "2.0",
             "id": msg_id,
@@ -820,94 +2326,2020 @@ async def handle_workflow_tool(msg_id, arguments):
                 "message": f"Internal error: {str(e)}"
             }
         }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
+        return jsonrpc_response(response)
+
+async def handle_approval_status_tool(msg_id, arguments):
+    """Handle check_approval_status tool calls"""
+    try:
+        request_id = arguments.get("request_id", "")
+        
+        if not request_id:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "error": {
+                    "code": -32602,
+                    "message": "Missing required parameter: request_id"
+                }
+            }
+            return jsonrpc_response(response)
+        
+        # Check in memory first, then blob storage if not found. Only a rejection is final: a
+        # pending request may have been decided on another instance, and an approval is
+        # reopened there when S/4HANA refuses the create, so those are re-read.
+        approval_data = None
+        cached = approval_requests.get(request_id)
+        record_cache_lookup("approval_requests", bool(cached) and cached.get("status") == "rejected")
+        if cached and cached.get("status") == "rejected":
+            approval_data = cached
+        else:
+            # Try to get from blob storage
+            approval_data = await get_approval_request_from_blob(request_id) or cached
+            if approval_data:
+                # Cache in memory for faster future access
+                approval_requests[request_id] = approval_data
+        
+        if not approval_data:
+            response = {
+                "jsonrpc": "2.0",
+                "id": msg_id,
+                "result": {
+                    "content": [{
+                        "type": "text",
+                        "text": json.dumps({
+                            "status": "not_found",
+                            "message": f"Approval request {request_id} not found in memory or blob storage",
+                            "request_id": request_id
+                        }, indent=2)
+                    }]
+                }
+            }
+            return jsonrpc_response(response)
+        
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "result": {
+                "content": [{
+                    "type": "text",
+                    "text": json.dumps({
+                        "request_id": request_id,
+                        "status": approval_data.get("status", "unknown"),
+                        "created_at": approval_data.get("created_at", ""),
+                        "created_by": approval_data.get("created_by", ""),
+                        "approver": approval_data.get("approver", ""),
+                        "approved_at": approval_data.get("approved_at", ""),
+                        "approver_comments": approval_data.get("approver_comments", ""),
+                        "sales_order_data": approval_data.get("sales_order_data", {}),
+                        "justification": approval_data.get("justification", "")
+                    }, indent=2)
+                }]
+            }
+        }
+        return jsonrpc_response(response)
+        
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        mcp_logger.exception("[Error] Approval status tool failed")
+        response = {
+            "jsonrpc": "2.0",
+            "id": msg_id,
+            "error": {
+                "code": -32603,
+                "message": f"Internal error: {str(e)}"
+            }
+        }
+        return jsonrpc_response(response)
+
+# --- SAP Backend Protection (circuit breaker + adaptive concurrency) ---
+SAP_SERVICE_BP = "API_BUSINESS_PARTNER"
+SAP_SERVICE_SO = "API_SALES_ORDER_SRV"
+
+class SapDegradedError(Exception):
+    """Raised when SAP calls are rejected locally because the backend is unhealthy or saturated"""
+
+    def __init__(self, service: str, reason: str, retry_after: float = 0.0):
+        super().__init__(f"SAP {service} degraded: {reason}")
+        self.service = service
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_response(self) -> func.HttpResponse:
+        """Fast, explicit 503 returned instead of waiting for the gateway timeout"""
+        retry_after = max(1, int(round(self.retry_after)))
+        body = {
+            "error": "SAP_DEGRADED",
+            "message": str(self),
+            "service": self.service,
+            "reason": self.reason,
+            "retry_after_seconds": retry_after
+        }
+        return func.HttpResponse(
+            json.dumps(body),
+            mimetype="application/json",
+            status_code=503,
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class SapCircuitBreaker:
+    """Per-service circuit breaker: closed -> open after consecutive failures -> half-open probe"""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_until = 0.0
+        self.probe_in_flight = False
+
+    def before_call(self):
+        """Raise SapDegradedError when the circuit is open; let a single probe through when half-open"""
+        if self.state == "open":
+            remaining = self.opened_until - time.monotonic()
+            if remaining > 0:
+                raise SapDegradedError(self.service, "circuit open", remaining)
+            self.state = "half_open"
+            self.probe_in_flight = False
+        if self.state == "half_open":
+            if self.probe_in_flight:
+                raise SapDegradedError(self.service, "circuit half-open, probe in flight", 1.0)
+            self.probe_in_flight = True
+
+    def record_success(self):
+        if self.state != "closed":
+            sap_logger.info("[CIRCUIT] %s closed after successful probe", self.service)
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= SAP_BREAKER_FAILURE_THRESHOLD:
+            if self.state != "open":
+                sap_logger.warning("[CIRCUIT] %s opened after %s consecutive failures", self.service, self.consecutive_failures)
+            self.state = "open"
+            self.opened_until = time.monotonic() + SAP_BREAKER_OPEN_SECONDS
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_seconds": round(max(0.0, self.opened_until - time.monotonic()), 1) if self.state == "open" else 0
+        }
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: +1/limit per fast success, halve on slow or failed calls; bounded wait queue"""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.limit = float(SAP_CONCURRENCY_INITIAL)
+        self.in_flight = 0
+        self.waiters = deque()
+        self.last_decrease = 0.0
+        self.last_used = 0.0
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self.in_flight += 1
+            return
+        if len(self.waiters) >= SAP_CONCURRENCY_MAX_QUEUE:
+            raise SapDegradedError(self.service, f"concurrency queue full ({len(self.waiters)} waiting)", 1.0)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), SAP_CONCURRENCY_QUEUE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we gave up - give it back
+                self._release_slot()
+            else:
+                waiter.cancel()
+                with contextlib.suppress(ValueError):
+                    self.waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise SapDegradedError(self.service, "timed out waiting for a concurrency slot", 1.0)
+
+    def release(self, latency: float, ok: bool):
+        now = time.monotonic()
+        self.last_used = now
+        if not ok or latency > SAP_CONCURRENCY_TARGET_LATENCY_SECONDS:
+            # Multiplicative decrease, at most once per target-latency window
+            if now - self.last_decrease > SAP_CONCURRENCY_TARGET_LATENCY_SECONDS:
+                self.limit = max(float(SAP_CONCURRENCY_MIN), self.limit / 2)
+                self.last_decrease = now
+                sap_logger.info("[LIMITER] %s limit decreased to %s (latency %.2fs, ok=%s)", self.service, int(self.limit), latency, ok)
+        else:
+            self.limit = min(float(SAP_CONCURRENCY_MAX), self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {"limit": int(self.limit), "in_flight": self.in_flight, "queued": len(self.waiters)}
+
+sap_circuit_breakers = {name: SapCircuitBreaker(name) for name in (SAP_SERVICE_BP, SAP_SERVICE_SO)}
+sap_concurrency_limiters = {name: AdaptiveConcurrencyLimiter(name) for name in (SAP_SERVICE_BP, SAP_SERVICE_SO)}
+
+def sap_service_for_entity(entity: str) -> str:
+    """Map an MCP entity name to its OData service (breaker/limiter key)"""
+    return SAP_SERVICE_BP if entity in BP_ODATA or entity in BP_ODATA_CREATE else SAP_SERVICE_SO
+
+class SapCallOutcome:
+    """Outcome of a guarded SAP call; the caller records the HTTP status it received"""
+
+    def __init__(self):
+        self.status_code = None
+
+    @property
+    def healthy(self) -> bool:
+        # 4xx (other than 429) are caller errors and say nothing about backend health
+        return self.status_code is not None and self.status_code < 500 and self.status_code != 429
+
+@contextlib.asynccontextmanager
+async def sap_call_guard(service: str):
+    """Admit a SAP call through the service's circuit breaker and concurrency limiter"""
+    breaker = sap_circuit_breakers[service]
+    limiter = sap_concurrency_limiters[service]
+    breaker.before_call()
+    try:
+        await limiter.acquire()
+    except BaseException:
+        breaker.probe_in_flight = False
+        raise
+
+    outcome = SapCallOutcome()
+    started = time.monotonic()
+    local_error = False
+    try:
+        yield outcome
+    except httpx.TransportError:
+        raise
+    except BaseException:
+        # Local failure before SAP answered (parse error, cancellation) - don't count it against SAP
+        local_error = outcome.status_code is None
+        raise
+    finally:
+        latency = time.monotonic() - started
+        healthy = outcome.healthy and latency <= SAP_BREAKER_SLOW_CALL_SECONDS
+        limiter.release(latency, healthy)
+        if healthy:
+            breaker.record_success()
+        elif local_error:
+            breaker.probe_in_flight = False
+        else:
+            breaker.record_failure()
+
+def get_sap_backend_status() -> dict:
+    """Breaker and limiter state per SAP service (for health/diagnostics)"""
+    return {
+        service: {**sap_circuit_breakers[service].snapshot(), **sap_concurrency_limiters[service].snapshot()}
+        for service in sap_circuit_breakers
+    }
+
+_sap_http_client = None
+_sap_http_client_loop = None
+
+def get_sap_http_client() -> httpx.AsyncClient:
+    """Shared pooled httpx client for SAP calls (keep-alive across invocations on this worker)"""
+    global _sap_http_client, _sap_http_client_loop
+    loop = asyncio.get_running_loop()
+    if _sap_http_client is None or _sap_http_client.is_closed or _sap_http_client_loop is not loop:
+        _sap_http_client = httpx.AsyncClient(
+            timeout=15.0,
+            verify=False,
+            limits=httpx.Limits(
+                max_connections=SAP_CONCURRENCY_MAX * 2,
+                max_keepalive_connections=SAP_CONCURRENCY_MAX
+            )
+        )
+        _sap_http_client_loop = loop
+    return _sap_http_client
+
+def _sap_pool_connections():
+    """Pooled SAP connections by state (reads httpcore internals; reports nothing if they change)"""
+    pool = getattr(getattr(_sap_http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for c in connections if c.is_idle())
+    return [(("idle",), idle), (("active",), len(connections) - idle)]
+
+SAP_CONCURRENCY_LIMIT_GAUGE = Gauge(
+    "sap_concurrency_limit", "Current adaptive concurrency limit per SAP service", ("service",),
+    lambda: [((name,), int(limiter.limit)) for name, limiter in sap_concurrency_limiters.items()])
+SAP_IN_FLIGHT_GAUGE = Gauge(
+    "sap_in_flight_requests", "SAP calls currently holding a concurrency slot", ("service",),
+    lambda: [((name,), limiter.in_flight) for name, limiter in sap_concurrency_limiters.items()])
+SAP_QUEUED_GAUGE = Gauge(
+    "sap_queued_requests", "SAP calls waiting for a concurrency slot", ("service",),
+    lambda: [((name,), len(limiter.waiters)) for name, limiter in sap_concurrency_limiters.items()])
+SAP_CIRCUIT_OPEN_GAUGE = Gauge(
+    "sap_circuit_open", "1 while the SAP circuit breaker is open (or half-open)", ("service",),
+    lambda: [((name,), 0 if breaker.state == "closed" else 1) for name, breaker in sap_circuit_breakers.items()])
+SAP_POOL_CONNECTIONS_GAUGE = Gauge(
+    "sap_http_pool_connections", "Pooled keep-alive connections to SAP by state", ("state",),
+    _sap_pool_connections)
+
+# --- SAP Retry Policy (bounded exponential backoff with jitter) ---
+SAP_RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+# Connection-level failures worth retrying; connect errors mean the request never reached SAP
+SAP_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError,
+                        httpx.WriteError, httpx.RemoteProtocolError)
+SAP_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+class SapRetryBudget:
+    """Token bucket: each request deposits SAP_RETRY_BUDGET_RATIO tokens, each retry spends one"""
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def record_request(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+sap_retry_budget = SapRetryBudget(SAP_RETRY_BUDGET_RATIO)
+
+def parse_retry_after(value: str):
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds, or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def sap_retry_delay(attempt: int, retry_after=None) -> float:
+    """Full-jitter exponential backoff; a server-provided Retry-After is the lower bound"""
+    delay = random.uniform(0, min(SAP_RETRY_MAX_DELAY_SECONDS, SAP_RETRY_BASE_DELAY_SECONDS * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+async def sap_request_with_retry(attempt_call, *, operation: str, idempotent: bool) -> httpx.Response:
+    """Run attempt_call() with retries for transient SAP failures
+
+    Retries 429/502/503/504 and connection resets only for idempotent calls; non-idempotent
+    calls are retried only when the request provably never reached SAP (connect failures).
+    Retries stop at SAP_RETRY_MAX_ATTEMPTS, SAP_RETRY_MAX_ELAPSED_SECONDS or when the
+    retry budget is exhausted; the last response is returned / last error raised.
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        sap_retry_budget.record_request()
+        response, error, retry_after = None, None, None
+        try:
+            response = await attempt_call()
+            if response.status_code not in SAP_RETRYABLE_STATUS_CODES or not idempotent:
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            reason = f"HTTP {response.status_code}"
+        except SAP_RETRYABLE_ERRORS as e:
+            if not idempotent and not isinstance(e, SAP_NOT_SENT_ERRORS):
+                raise
+            error = e
+            reason = type(e).__name__
+
+        delay = sap_retry_delay(attempt, retry_after)
+        if attempt >= SAP_RETRY_MAX_ATTEMPTS:
+            stop_reason = "attempts exhausted"
+        elif time.monotonic() - started + delay > SAP_RETRY_MAX_ELAPSED_SECONDS:
+            stop_reason = f"{delay:.1f}s backoff exceeds time budget"
+        elif (deadline_remaining() or float("inf")) <= delay + 1.0:
+            stop_reason = f"{delay:.1f}s backoff would overrun the request deadline"
+        elif not sap_retry_budget.try_spend():
+            stop_reason = "retry budget exhausted"
+        else:
+            sap_logger.warning("[RETRY] %s: %s, attempt %s/%s, retrying in %.2fs", operation, reason, attempt, SAP_RETRY_MAX_ATTEMPTS, delay)
+            await asyncio.sleep(delay)
+            continue
+
+        sap_logger.warning("[RETRY] %s: %s, giving up (%s)", operation, reason, stop_reason)
+        if error is not None:
+            raise error
+        return response
+
+async def send_sap_request(service: str, method: str, url: str, *, entity: str = "", timings: dict = None,
+                           **kwargs) -> httpx.Response:
+    """Single guarded SAP round trip; the body is streamed (and decoded) into response.content
+
+    Records connect / TTFB / download latency per entity from httpcore trace events; when
+    `timings` is given, the last attempt's phases and the attempt count are stored in it.
+    """
+    connect = {"seconds": 0.0, "started": None}
+
+    async def trace(event_name: str, info: dict):
+        if event_name.endswith(("connect_tcp.started", "start_tls.started")):
+            connect["started"] = time.monotonic()
+        elif event_name.endswith(("connect_tcp.complete", "start_tls.complete")) and connect["started"]:
+            connect["seconds"] += time.monotonic() - connect["started"]
+
+    status = "error"
+    span_attributes = {"sap.service": service, "sap.entity": entity, "http.request.method": method}
+    try:
+        with trace_span(f"sap {method} {entity}", span_attributes, kind="client") as span:
+            kwargs["headers"] = inject_trace_headers(dict(kwargs.get("headers") or {}))
+            async with sap_call_guard(service) as outcome:
+                client = get_sap_http_client()
+                started = time.monotonic()
+                async with client.stream(method, url, extensions={"trace": trace}, **kwargs) as r:
+                    headers_at = time.monotonic()
+                    outcome.status_code = r.status_code
+                    status = str(r.status_code)
+                    await r.aread()
+                phases = {
+                    "connect": connect["seconds"],
+                    "ttfb": headers_at - started - connect["seconds"],
+                    "download": time.monotonic() - headers_at
+                }
+                for phase, seconds in phases.items():
+                    SAP_PHASE_SECONDS.observe(seconds, phase=phase, service=service, entity=entity, method=method)
+                if timings is not None:
+                    timings.update(phases, attempts=timings.get("attempts", 0) + 1)
+            span.set_attributes({
+                "http.response.status_code": r.status_code,
+                "sap.response.wire_bytes": r.num_bytes_downloaded,
+                "sap.response.bytes": len(r.content),
+                "sap.connect_ms": round(phases["connect"] * 1000, 1),
+                "sap.ttfb_ms": round(phases["ttfb"] * 1000, 1)
+            })
+        return r
+    except httpx.TimeoutException:
+        remaining = deadline_remaining()
+        if remaining is not None and remaining <= 0.05:
+            # The timeout was trimmed to the request budget - report the deadline, not SAP
+            raise DeadlineExceeded(f"{method} {url.split('?')[0].rsplit('/', 1)[-1]}") from None
+        raise
+    finally:
+        SAP_REQUESTS_TOTAL.inc(service=service, entity=entity, method=method, status=status)
+
+# --- SAP slow-query log (ring buffer + query-shape statistics) ---
+_ODATA_LITERAL = re.compile(
+    r"(?:datetime(?:offset)?|guid|time)'[^']*'|'(?:[^']|'')*'|\b\d+(?:\.\d+)?[mMdDfFlL]?\b|\b(?:true|false|null)\b"
+)
+
+def normalize_odata_query(query: str) -> str:
+    """Query shape: system options sorted, literals in $filter/$search and paging values replaced by '?'"""
+    if not query:
+        return ""
+    parts = []
+    for name, value in sorted(split_odata_query(query)):
+        if name in ("$top", "$skip", "$skiptoken"):
+            value = "?"
+        elif name in ("$filter", "$search") or not name.startswith("$"):
+            value = _ODATA_LITERAL.sub("?", value)
+        parts.append(f"{name}={' '.join(value.split())}")
+    return "&".join(parts)
+
+class SlowQueryLog:
+    """Bounded log of SAP calls over SLOW_QUERY_THRESHOLD_SECONDS plus per-shape call statistics"""
+
+    def __init__(self, capacity: int, max_shapes: int):
+        self.records = deque(maxlen=capacity)
+        self.shapes = {}
+        self.max_shapes = max_shapes
+        self.pending_spill = []
+        self.spill_tasks = set()
+
+    def record(self, *, method: str, entity: str, query: str, total_seconds: float, timings: dict,
+               rows: int = None, response_bytes: int = None, status: int = None):
+        shape = f"{method} {entity}" + (f"?{normalize_odata_query(query)}" if query else "")
+        stats = self.shapes.get(shape)
+        if stats is None:
+            if len(self.shapes) >= self.max_shapes:
+                # Evict the least frequent shape to stay bounded
+                del self.shapes[min(self.shapes, key=lambda k: self.shapes[k]["count"])]
+            stats = self.shapes[shape] = {"count": 0, "slow_count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        stats["count"] += 1
+        stats["total_seconds"] += total_seconds
+        stats["max_seconds"] = max(stats["max_seconds"], total_seconds)
+
+        if total_seconds < SLOW_QUERY_THRESHOLD_SECONDS:
+            return
+        stats["slow_count"] += 1
+        entry = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "shape": shape,
+            "caller": request_caller(),
+            "status": status,
+            "total_seconds": round(total_seconds, 3),
+            "timings": {k: round(v, 3) if isinstance(v, float) else v for k, v in timings.items()},
+            "rows": rows,
+            "response_bytes": response_bytes
+        }
+        self.records.append(entry)
+        sap_logger.warning("[SLOW QUERY] %s took %.2fs (caller %s, rows %s)", shape, total_seconds, entry["caller"], rows)
+        if SLOW_QUERY_BLOB_SPILL:
+            self.pending_spill.append(entry)
+            if len(self.pending_spill) >= SLOW_QUERY_SPILL_BATCH:
+                self._spill()
+
+    def _spill(self):
+        batch, self.pending_spill = self.pending_spill, []
+        try:
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(_spill_slow_queries_to_blob, batch))
+        except RuntimeError:
+            return
+        self.spill_tasks.add(task)
+        task.add_done_callback(self.spill_tasks.discard)
+
+    def report(self, top: int) -> dict:
+        shapes = [
+            {"shape": shape, **stats, "avg_seconds": round(stats["total_seconds"] / stats["count"], 3),
+             "total_seconds": round(stats["total_seconds"], 3), "max_seconds": round(stats["max_seconds"], 3)}
+            for shape, stats in self.shapes.items()
+        ]
+        return {
+            "threshold_seconds": SLOW_QUERY_THRESHOLD_SECONDS,
+            "slowest": sorted(self.records, key=lambda r: r["total_seconds"], reverse=True)[:top],
+            "most_frequent_shapes": sorted(shapes, key=lambda s: s["count"], reverse=True)[:top],
+            "slowest_shapes": sorted(shapes, key=lambda s: s["max_seconds"], reverse=True)[:top],
+            "buffered_records": len(self.records)
+        }
+
+def _spill_slow_queries_to_blob(batch: list):
+    """Append-only spill of slow-query records as one JSON-lines blob per batch"""
+    try:
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            return
+        blob_name = f"{SLOW_QUERY_BLOB_PREFIX}{datetime.now(timezone.utc).strftime('%Y/%m/%d/%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"
+        blob_client = blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=blob_name)
+        with blob_operation("upload", blob_name):
+            blob_client.upload_blob("\n".join(json.dumps(r) for r in batch) + "\n", timeout=BLOB_TIMEOUT_SECONDS)
+    except Exception as e:
+        blob_logger.warning("[SLOW QUERY] Failed to spill %s records to blob storage: %s", len(batch), e)
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_SIZE, SLOW_QUERY_MAX_SHAPES)
+
+# --- Traffic capture (anonymized tools/call workload for replay) ---
+_ODATA_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# Options whose values describe the workload, not the data; everything else is pseudonymized
+_CAPTURE_CLEAR_OPTIONS = ("$top", "$skip", "$select", "$orderby", "$expand", "$format", "$inlinecount", "$count")
+# Argument keys kept verbatim (entity set names)
+_CAPTURE_CLEAR_ARGUMENTS = ("entity",)
+
+def _pseudonym(value: str) -> str:
+    """Stable keyed token, so a value repeated in production is repeated in the capture"""
+    return "h" + hmac.new(TRAFFIC_CAPTURE_SALT, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+def anonymize_odata_query(query: str) -> str:
+    """Keep option names, paging and projection; replace string literals in $filter/$search and custom values"""
+    parts = []
+    for name, value in split_odata_query(query):
+        if name in ("$filter", "$search"):
+            value = _ODATA_STRING_LITERAL.sub(lambda m: f"'{_pseudonym(m.group(0))}'", value)
+        elif name not in _CAPTURE_CLEAR_OPTIONS:
+            value = _pseudonym(value)
+        parts.append(f"{name}={value}")
+    return "&".join(parts)
+
+def anonymize_tool_arguments(value, key: str = ""):
+    """Tool arguments with every string pseudonymized except entity names and the OData query structure"""
+    if isinstance(value, dict):
+        return {k: anonymize_tool_arguments(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize_tool_arguments(v, key) for v in value]
+    if isinstance(value, str):
+        if key == "query":
+            return anonymize_odata_query(value)
+        return value if key in _CAPTURE_CLEAR_ARGUMENTS else _pseudonym(value)
+    return value
+
+class TrafficRecorder:
+    """Buffers sampled tools/call records and flushes them as gzipped JSON lines: when a batch is full,
+    flush_seconds after the first record of a batch, and at interpreter exit (close)"""
+
+    def __init__(self, sample_rate: float, batch_size: int, flush_seconds: float):
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.instance = uuid.uuid4().hex[:8]
+        self.buffer = []
+        self.flush_timer = None
+        self.flush_tasks = set()
+        # Batches handed to a flush task but not yet written; whoever pops one (task or close) writes it
+        self.pending = {}
+        self._batch_ids = 0
+
+    def record(self, *, tool: str, arguments: dict, seconds: float, response_bytes: int, outcome: str):
+        if random.random() >= self.sample_rate:
+            return
+        self.buffer.append({
+            "t": round(time.time(), 3),
+            "instance": self.instance,
+            "tool": tool,
+            "args": anonymize_tool_arguments(arguments),
+            "ms": round(seconds * 1000, 1),
+            "bytes": response_bytes,
+            "outcome": outcome
+        })
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+        elif self.flush_timer is None:
+            try:
+                self.flush_timer = asyncio.get_running_loop().call_later(self.flush_seconds, self.flush)
+            except RuntimeError:
+                pass
+
+    def flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        self._batch_ids += 1
+        batch_id = self._batch_ids
+        self.pending[batch_id] = batch
+        try:
+            task = asyncio.get_running_loop().create_task(asyncio.to_thread(self._write_pending, batch_id))
+        except RuntimeError:
+            self._write_pending(batch_id)
+            return
+        self.flush_tasks.add(task)
+        task.add_done_callback(self.flush_tasks.discard)
+
+    def _write_pending(self, batch_id: int):
+        batch = self.pending.pop(batch_id, None)
+        if batch:
+            _write_traffic_capture(batch)
+
+    def close(self):
+        """Write the buffer and every batch whose flush task has not run yet (no event loop needed)"""
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        batch, self.buffer = self.buffer, []
+        if batch:
+            _write_traffic_capture(batch)
+        for batch_id in list(self.pending):
+            self._write_pending(batch_id)
+
+_traffic_capture_file_lock = threading.Lock()
+
+def _write_traffic_capture(batch: list):
+    """One gzip member per batch: appended to TRAFFIC_CAPTURE_PATH, or a new blob under TRAFFIC_CAPTURE_BLOB_PREFIX"""
+    data = gzip.compress(("\n".join(json.dumps(r, separators=(",", ":")) for r in batch) + "\n").encode())
+    try:
+        if TRAFFIC_CAPTURE_PATH:
+            with _traffic_capture_file_lock, open(TRAFFIC_CAPTURE_PATH, "ab") as f:
+                f.write(data)
+            return
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            return
+        blob_name = f"{TRAFFIC_CAPTURE_BLOB_PREFIX}{datetime.now(timezone.utc).strftime('%Y/%m/%d/%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        blob_client = blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=blob_name)
+        with blob_operation("upload", blob_name):
+            blob_client.upload_blob(data, timeout=BLOB_TIMEOUT_SECONDS)
+    except Exception as e:
+        blob_logger.warning("[TRAFFIC CAPTURE] Failed to write %s records: %s", len(batch), e)
+
+traffic_recorder = TrafficRecorder(TRAFFIC_CAPTURE_SAMPLE_RATE, TRAFFIC_CAPTURE_BATCH, TRAFFIC_CAPTURE_FLUSH_SECONDS)
+# The Python worker has no stop hook; atexit runs when the host recycles or scales in the worker
+atexit.register(traffic_recorder.close)
+
+# --- Dependency health probes (background, cached) ---
+async def _probe_sap_read(entity: str) -> str:
+    """$top=1 read against one entity set of a service"""
+    r = await send_sap_request(
+        sap_service_for_entity(entity), "GET", f"{ALL_ODATA[entity]}?$top=1",
+        entity=entity,
+        auth=(os.getenv("SAP_USER"), os.getenv("SAP_PASS")),
+        headers={"Accept": "application/json"},
+        timeout=HEALTH_PROBE_TIMEOUT_SECONDS
+    )
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}")
+    return f"HTTP {r.status_code}"
+
+async def _probe_sap_csrf() -> str:
+    """CSRF token fetch, the first step of every create"""
+    r = await send_sap_request(
+        SAP_SERVICE_SO, "GET", f"{SAP_SO_SERVICE}/",
+        entity="csrf",
+        auth=(os.getenv("SAP_USER"), os.getenv("SAP_PASS")),
+        headers={"X-CSRF-Token": "Fetch", "Accept": "application/json"},
+        timeout=HEALTH_PROBE_TIMEOUT_SECONDS
+    )
+    if not r.headers.get("X-CSRF-Token"):
+        raise RuntimeError(f"HTTP {r.status_code} without X-CSRF-Token")
+    return f"HTTP {r.status_code}, token issued"
+
+async def _probe_blob_container() -> str:
+    """HEAD on the approval container"""
+    def head():
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            raise RuntimeError("blob service client unavailable")
+        with blob_operation("head"):
+            # No SDK retries: a probe reports the first failure, the next refresh tries again
+            blob_service_client.get_container_client(BLOB_CONTAINER_NAME).get_container_properties(
+                timeout=max(1, int(HEALTH_PROBE_TIMEOUT_SECONDS)), retry_total=0
+            )
+    await asyncio.to_thread(head)
+    return "container reachable"
+
+class HealthProbeCache:
+    """Last results of the dependency probes; refreshed in the background at most every interval"""
+
+    def __init__(self):
+        self.results = {}
+        self.checked_at = 0.0
+        self.refresh_task = None
+
+    def probes(self) -> dict:
+        probes = {"blob_container": _probe_blob_container}
+        if os.getenv("SAP_USER") and os.getenv("SAP_PASS"):
+            probes.update({
+                "sap_business_partner_read": lambda: _probe_sap_read("businesspartners"),
+                "sap_sales_order_read": lambda: _probe_sap_read("salesorders"),
+                "sap_csrf_fetch": _probe_sap_csrf
+            })
+        return probes
+
+    def ensure_fresh(self):
+        """Start a background refresh when results are stale; never waits for it"""
+        if self.refresh_task is not None and not self.refresh_task.done():
+            return
+        if self.results and time.monotonic() - self.checked_at < HEALTH_PROBE_INTERVAL_SECONDS:
+            return
+        self.refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    async def refresh(self):
+        results = await asyncio.gather(*(self._run(name, probe) for name, probe in self.probes().items()))
+        self.results = dict(results)
+        self.checked_at = time.monotonic()
+
+    async def _run(self, name: str, probe):
+        started = time.monotonic()
+        try:
+            detail = await asyncio.wait_for(probe(), HEALTH_PROBE_TIMEOUT_SECONDS)
+            ok = True
+        except Exception as e:
+            detail = f"{type(e).__name__}: {e}"
+            ok = False
+        latency = time.monotonic() - started
+        if not ok:
+            status = "failed"
+            http_logger.warning("[HEALTH] Probe %s failed after %.2fs: %s", name, latency, detail)
+        elif latency > HEALTH_PROBE_LATENCY_SLO_SECONDS:
+            status = "slow"
+        else:
+            status = "ok"
+        return name, {
+            "status": status,
+            "latency_ms": round(latency * 1000, 1),
+            "detail": detail,
+            "checked_at": datetime.now(timezone.utc).isoformat()
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "slo_seconds": HEALTH_PROBE_LATENCY_SLO_SECONDS,
+            "age_seconds": round(time.monotonic() - self.checked_at, 1) if self.results else None,
+            "results": self.results
+        }
+
+health_probes = HealthProbeCache()
+
+# --- SAP read and CSRF token caches (per worker) ---
+class SapReadCache:
+    """TTL + LRU cache of parsed Business Partner reads; hit counts tell the warm-keeper what to refresh"""
+
+    def __init__(self, max_entries: int):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+
+    def get(self, entity: str, query: str):
+        entry = self.entries.get((entity, query))
+        if entry is None or entry["expires"] <= time.monotonic():
+            return None
+        entry["hits"] += 1
+        self.entries.move_to_end((entity, query))
+        return entry["body"]
+
+    def store(self, entity: str, query: str, body: str, ttl: float = SAP_READ_CACHE_TTL_SECONDS):
+        previous = self.entries.pop((entity, query), None)
+        # Halve the hit count on every reload so keys that went cold stop being refreshed
+        self.entries[(entity, query)] = {"body": body, "expires": time.monotonic() + ttl,
+                                         "hits": previous["hits"] // 2 if previous else 0}
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hot_entries(self, limit: int) -> list:
+        """Most-hit Business Partner keys that expire within half a TTL (or already have)"""
+        soon = time.monotonic() + SAP_READ_CACHE_TTL_SECONDS / 2
+        due = [(key, entry["hits"]) for key, entry in self.entries.items()
+               if entry["hits"] and entry["expires"] <= soon and key[0] in BP_ODATA]
+        return [key for key, _ in sorted(due, key=lambda item: item[1], reverse=True)[:limit]]
+
+sap_read_cache = SapReadCache(SAP_READ_CACHE_MAX_ENTRIES)
+
+class SapCsrfTokenCache:
+    """CSRF token and session cookies per SAP service, reused until the TTL passes or SAP rejects them"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, service: str):
+        entry = self.entries.get(service)
+        if entry is None or time.monotonic() - entry[2] >= SAP_CSRF_TOKEN_TTL_SECONDS:
+            return None
+        return entry[0], entry[1]
+
+    def store(self, service: str, token: str, cookies):
+        if SAP_CSRF_TOKEN_TTL_SECONDS > 0:
+            self.entries[service] = (token, cookies, time.monotonic())
+
+    def invalidate(self, service: str):
+        self.entries.pop(service, None)
+
+sap_csrf_tokens = SapCsrfTokenCache()
+
+# --- SAP $metadata schema cache (compiled payload converters and validators per entity set) ---
+SAP_SERVICE_URLS = {SAP_SERVICE_BP: SAP_BP_SERVICE, SAP_SERVICE_SO: SAP_SO_SERVICE}
+_EDM_INT_RANGES = {"Edm.Byte": (0, 255), "Edm.SByte": (-128, 127), "Edm.Int16": (-2 ** 15, 2 ** 15 - 1),
+                   "Edm.Int32": (-2 ** 31, 2 ** 31 - 1), "Edm.Int64": (-2 ** 63, 2 ** 63 - 1)}
+_EDM_GUID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+_EDM_TIME = re.compile(r"^PT(?:\d+H)?(?:\d+M)?(?:\d+(?:\.\d+)?S)?$")
+_EDM_JSON_DATE = re.compile(r"^/Date\(-?\d+(?:[+-]\d{4})?\)/$")
+
+def _edm_converter(edm_type: str):
+    """Function that turns a lenient client value into the OData V2 JSON form of edm_type (or returns it as is)"""
+    if edm_type in ("Edm.DateTime", "Edm.DateTimeOffset"):
+        suffix = "+0000" if edm_type == "Edm.DateTimeOffset" else ""
+
+        def convert(value):
+            if not isinstance(value, str) or _EDM_JSON_DATE.match(value):
+                return value
+            try:
+                moment = parse_odata_timestamp(value)
+            except ValueError:
+                return value
+            return f"/Date({int(moment.timestamp() * 1000)}{suffix})/"
+        return convert
+    if edm_type == "Edm.Decimal":
+        # V2 JSON carries decimals as plain strings: repr() of a float keeps the digits the client wrote, and
+        # format "f" spells out what str() would write with an exponent (1e-07), which SAP rejects
+        return lambda value: (format(decimal.Decimal(repr(value)), "f")
+                              if isinstance(value, (int, float)) and not isinstance(value, bool) else value)
+    if edm_type in ("Edm.Byte", "Edm.SByte", "Edm.Int16", "Edm.Int32"):
+        return lambda value: int(value) if isinstance(value, str) and re.fullmatch(r"-?\d+", value.strip()) else value
+    if edm_type == "Edm.Int64":
+        return lambda value: str(value) if isinstance(value, int) and not isinstance(value, bool) else value
+    if edm_type == "Edm.Boolean":
+        return lambda value: {"true": True, "false": False}.get(value.lower(), value) if isinstance(value, str) else value
+    if edm_type == "Edm.String":
+        return lambda value: str(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+    return lambda value: value
+
+def _edm_checker(edm_type: str, max_length: int = None, precision: int = None, scale: int = None,
+                 nullable: bool = True):
+    """Function that returns an error text for a converted value that SAP would reject, else None"""
+    def check(value):
+        if value is None:
+            return None if nullable else "must not be null"
+        if edm_type == "Edm.String":
+            if not isinstance(value, str):
+                return f"must be a string, got {type(value).__name__}"
+            if max_length and len(value) > max_length:
+                return f"is {len(value)} characters long, max {max_length}"
+        elif edm_type == "Edm.Decimal":
+            number = _aggregate_number(value) if isinstance(value, str) else None
+            if number is None:
+                return f"must be a decimal number as string, got {value!r}"
+            if "e" in value.lower():
+                return f"must be written without an exponent, got {value!r}"
+            sign, digits, exponent = number.as_tuple()
+            decimals = max(0, -exponent)
+            if scale is not None and decimals > scale:
+                return f"has {decimals} decimal places, max {scale}"
+            if precision is not None and len(digits) + max(0, exponent) - decimals > precision - (scale or 0):
+                return f"has too many integer digits for precision {precision}, scale {scale or 0}"
+        elif edm_type in _EDM_INT_RANGES:
+            low, high = _EDM_INT_RANGES[edm_type]
+            number = int(value) if isinstance(value, str) and re.fullmatch(r"-?\d+", value) else value
+            if not isinstance(number, int) or isinstance(number, bool) or not low <= number <= high:
+                return f"must be an integer in {edm_type} range, got {value!r}"
+        elif edm_type == "Edm.Boolean":
+            if not isinstance(value, bool):
+                return f"must be true or false, got {value!r}"
+        elif edm_type in ("Edm.DateTime", "Edm.DateTimeOffset"):
+            if not (isinstance(value, str) and _EDM_JSON_DATE.match(value)):
+                return f"must be a date (YYYY-MM-DD, ISO 8601 or /Date(ms)/), got {value!r}"
+        elif edm_type == "Edm.Guid":
+            if not (isinstance(value, str) and _EDM_GUID.match(value)):
+                return f"must be a GUID, got {value!r}"
+        elif edm_type == "Edm.Time":
+            if not (isinstance(value, str) and _EDM_TIME.match(value)):
+                return f"must be a duration like PT14H30M00S, got {value!r}"
+        return None
+    return check
+
+def _edm_reader(edm_type: str):
+    """Function that turns the Atom text of an edm_type property into a Python value (Decimal, int, float,
+    bool, UTC datetime or str); empty texts of non-string types become None, unparsable texts stay text"""
+    if edm_type == "Edm.Decimal":
+        parse = decimal.Decimal
+    elif edm_type in _EDM_INT_RANGES:
+        parse = int
+    elif edm_type in ("Edm.Double", "Edm.Single"):
+        parse = float
+    elif edm_type == "Edm.Boolean":
+        parse = lambda text: {"true": True, "false": False}.get(text, text)
+    elif edm_type in ("Edm.DateTime", "Edm.DateTimeOffset"):
+        parse = parse_odata_timestamp
+    else:
+        return lambda text: text
+
+    def read(text):
+        if not text:
+            return None
+        try:
+            return parse(text)
+        except (ValueError, ArithmeticError):
+            return text
+    return read
+
+class ODataEntitySchema:
+    """Keys, properties and navigation targets of one entity type, with a compiled (converter, checker)
+    pair per property so a payload is converted and validated without SAP, and a reader per property
+    for typed reads (odata_columns)"""
+
+    def __init__(self, name: str, keys: tuple, properties: dict, navigation: dict):
+        self.name = name
+        self.keys = keys
+        # name -> {"type", "max_length", "precision", "scale", "nullable"}
+        self.properties = properties
+        # name -> (entity type name, many); resolve() replaces the name with its schema
+        self.navigation = navigation
+        self._compiled = {prop: (_edm_converter(spec["type"]),
+                                 _edm_checker(spec["type"], spec["max_length"], spec["precision"], spec["scale"],
+                                              spec["nullable"]))
+                          for prop, spec in properties.items()}
+        self._readers = {prop: _edm_reader(spec["type"]) for prop, spec in properties.items()}
+
+    def resolve(self, types: dict):
+        self.navigation = {nav: (types.get(target, target), many) for nav, (target, many) in self.navigation.items()}
+
+    @staticmethod
+    def _nested(value, many: bool):
+        """Deep-insert rows of a navigation value: a list, {"results": [...]} or a single object"""
+        if isinstance(value, dict) and "results" in value:
+            value = value["results"]
+        if many:
+            return value if isinstance(value, list) else None
+        return [value] if isinstance(value, dict) else None
+
+    def convert(self, payload: dict) -> dict:
+        converted = {}
+        for prop, value in payload.items():
+            if prop in self._compiled:
+                converted[prop] = self._compiled[prop][0](value)
+            elif prop in self.navigation and isinstance(self.navigation[prop][0], ODataEntitySchema):
+                target, many = self.navigation[prop]
+                rows = self._nested(value, many)
+                if rows is None:
+                    converted[prop] = value
+                else:
+                    rows = [target.convert(row) if isinstance(row, dict) else row for row in rows]
+                    converted[prop] = rows if many else rows[0]
+            else:
+                converted[prop] = value
+        return converted
+
+    def validate(self, payload: dict, path: str = "") -> list:
+        """[{"property", "error"}] for everything SAP would reject; empty when the payload is fine"""
+        if not isinstance(payload, dict):
+            return [{"property": path or "(payload)", "error": "must be a JSON object"}]
+        errors = []
+        for prop, value in payload.items():
+            where = f"{path}{prop}"
+            if prop in self._compiled:
+                error = self._compiled[prop][1](value)
+                if error:
+                    errors.append({"property": where, "error": error})
+            elif prop in self.navigation:
+                target, many = self.navigation[prop]
+                rows = self._nested(value, many)
+                if rows is None:
+                    errors.append({"property": where, "error": "must be a list of objects" if many else "must be an object"})
+                elif isinstance(target, ODataEntitySchema):
+                    for index, row in enumerate(rows):
+                        errors += target.validate(row, f"{where}[{index}]." if many else f"{where}.")
+            elif prop != "__metadata":
+                errors.append({"property": where, "error": f"is not a property of {self.name}"})
+        return errors
+
+def parse_edmx(body: bytes) -> dict:
+    """{entity set name: ODataEntitySchema} from an OData V2 $metadata document"""
+    import xml.etree.ElementTree as ElementTree
+    local = lambda element: element.tag.rpartition("}")[2]
+    root = ElementTree.fromstring(body)
+    types, ends, entity_sets = {}, {}, {}
+    for schema in (element for element in root.iter() if local(element) == "Schema"):
+        namespace = schema.get("Namespace", "")
+        for element in schema:
+            if local(element) == "Association":
+                for end in element:
+                    if local(end) == "End":
+                        ends[(f"{namespace}.{element.get('Name')}", end.get("Role"))] = (
+                            end.get("Type", "").rpartition(".")[2], end.get("Multiplicity") == "*")
+        for entity_type in (element for element in schema if local(element) == "EntityType"):
+            keys, properties, navigation = (), {}, {}
+            for child in entity_type:
+                kind = local(child)
+                if kind == "Key":
+                    keys = tuple(ref.get("Name") for ref in child)
+                elif kind == "Property":
+                    number = lambda name: int(child.get(name)) if (child.get(name) or "").isdigit() else None
+                    properties[child.get("Name")] = {
+                        "type": child.get("Type"), "max_length": number("MaxLength"), "precision": number("Precision"),
+                        "scale": number("Scale"), "nullable": child.get("Nullable", "true") != "false"}
+                elif kind == "NavigationProperty":
+                    navigation[child.get("Name")] = (child.get("Relationship"), child.get("ToRole"))
+            types[entity_type.get("Name")] = (keys, properties, navigation)
+        for container in (element for element in schema if local(element) == "EntityContainer"):
+            for entity_set in container:
+                if local(entity_set) == "EntitySet":
+                    entity_sets[entity_set.get("Name")] = entity_set.get("EntityType", "").rpartition(".")[2]
+    compiled = {}
+    for name, (keys, properties, navigation) in types.items():
+        targets = {nav: ends.get((relationship, role), ("", True)) for nav, (relationship, role) in navigation.items()}
+        compiled[name] = ODataEntitySchema(name, keys, properties, targets)
+    for schema in compiled.values():
+        schema.resolve(compiled)
+    return {set_name: compiled[type_name] for set_name, type_name in entity_sets.items() if type_name in compiled}
+
+class SapMetadataCache:
+    """Parsed $metadata per SAP service, fetched once per worker and revalidated with If-None-Match after
+    SAP_METADATA_TTL_SECONDS. Lookups never fail: without metadata they return None and SAP validates."""
+
+    def __init__(self):
+        self.services = {}
+        self._locks = {}
+
+    @staticmethod
+    def _entity_set(entity: str) -> str:
+        return (ALL_ODATA_CREATE.get(entity) or ALL_ODATA.get(entity) or "").rpartition("/")[2]
+
+    def cached(self, entity: str):
+        """Schema from what is already loaded (no SAP call), or None"""
+        entry = self.services.get(sap_service_for_entity(entity))
+        return entry["schemas"].get(self._entity_set(entity)) if entry else None
+
+    async def schema_for(self, entity: str):
+        """Schema of an entity set, loading or revalidating its service's $metadata first when due"""
+        service = sap_service_for_entity(entity)
+        entry = self.services.get(service)
+        fresh = entry is not None and entry["expires"] > time.monotonic()
+        record_cache_lookup("sap_metadata", fresh)
+        if not fresh:
+            async with self._locks.setdefault(service, asyncio.Lock()):
+                entry = self.services.get(service)
+                if entry is None or entry["expires"] <= time.monotonic():
+                    await self._refresh(service, entry)
+        return self.cached(entity)
+
+    async def _refresh(self, service: str, entry: dict):
+        url = f"{SAP_SERVICE_URLS[service]}/$metadata"
+        headers = {"Accept": "application/xml", "Accept-Encoding": SAP_ACCEPT_ENCODING}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        try:
+            r = await sap_request_with_retry(
+                lambda: send_sap_request(service, "GET", url, entity="$metadata",
+                                         auth=(os.getenv("SAP_USER"), os.getenv("SAP_PASS")), headers=headers,
+                                         timeout=deadline_timeout(30.0, f"GET {service} $metadata")),
+                operation=f"GET {service} $metadata",
+                idempotent=True
+            )
+            if r.status_code == 304 and entry:
+                entry["expires"] = time.monotonic() + SAP_METADATA_TTL_SECONDS
+                return
+            if r.status_code != 200:
+                raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+            schemas = await asyncio.to_thread(parse_edmx, r.content)
+            self.services[service] = {"schemas": schemas, "etag": r.headers.get("ETag"),
+                                      "expires": time.monotonic() + SAP_METADATA_TTL_SECONDS}
+            sap_logger.info("[METADATA] %s: %s entity sets loaded", service, len(schemas))
+        except (DeadlineExceeded, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            # Keep serving the previous schemas; try again in a minute rather than on every create
+            sap_logger.warning("[METADATA] %s $metadata unavailable, payloads are not validated locally: %s", service, e)
+            self.services[service] = {**(entry or {"schemas": {}, "etag": None}),
+                                      "expires": time.monotonic() + min(60.0, SAP_METADATA_TTL_SECONDS)}
+
+sap_metadata = SapMetadataCache()
+
+class PayloadValidationError(ValueError):
+    """Raised for create payloads that SAP would reject, found locally against the service's $metadata"""
+
+    def __init__(self, entity: str, errors: list):
+        super().__init__(f"{len(errors)} invalid propert{'y' if len(errors) == 1 else 'ies'} for {entity}: "
+                         + "; ".join(f"{e['property']} {e['error']}" for e in errors[:5]))
+        self.entity = entity
+        self.errors = errors
+
+    def to_dict(self) -> dict:
+        return {"error": "PAYLOAD_INVALID", "message": str(self), "entity": self.entity, "errors": self.errors}
+
+    def to_response(self) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(self.to_dict()), mimetype="application/json", status_code=400)
+
+    def to_jsonrpc_error(self) -> dict:
+        return {"code": -32602, "message": str(self), "data": self.to_dict()}
+
+async def check_create_payload(entity: str, payload: dict) -> dict:
+    """Payload converted to the service's JSON forms (dates, decimals, ...) and validated against $metadata;
+    raises PayloadValidationError. Returned unchanged when validation is off or no metadata is available."""
+    if not SAP_PAYLOAD_VALIDATION:
+        return payload
+    schema = await sap_metadata.schema_for(entity)
+    if schema is None:
+        return payload
+    payload = schema.convert(payload)
+    errors = schema.validate(payload)
+    if errors:
+        raise PayloadValidationError(entity, errors)
+    return payload
+
+def _odata_text(value):
+    """Atom property text as xmltodict parsed it: None for m:null, "" for an empty element"""
+    if isinstance(value, dict):
+        return None if value.get("@m:null") == "true" else value.get("#text", "")
+    return "" if value is None else value
+
+def odata_columns(rows: list, schema=None) -> tuple:
+    """(names, Edm types, columns) of Atom m:properties rows: one list per property, converted in a single
+    pass by the schema's precompiled reader. Properties the schema lacks (or all, without one) stay text."""
+    keys = dict.fromkeys(key for row in rows for key in row if not key.startswith("@"))
+    names, types, columns = [], [], []
+    for key in keys:
+        name = key.partition(":")[2] or key
+        texts = [_odata_text(row.get(key)) for row in rows]
+        reader = schema._readers.get(name) if schema is not None else None
+        names.append(name)
+        types.append(schema.properties[name]["type"] if reader else None)
+        columns.append([reader(text) for text in texts] if reader else texts)
+    return names, types, columns
+
+def _decimal_json(value):
+    """JSON number of a Decimal, or its exact text beyond the 15 digits a double holds"""
+    if not isinstance(value, decimal.Decimal) or len(value.as_tuple().digits) > 15:
+        return _aggregate_json(value)
+    return int(value) if value == value.to_integral_value() else float(value)
+
+def _timestamp_json(value):
+    return value.isoformat().replace("+00:00", "Z") if isinstance(value, datetime) else value
+
+_TYPED_JSON = {"Edm.Decimal": _decimal_json, "Edm.DateTime": _timestamp_json, "Edm.DateTimeOffset": _timestamp_json}
+ODATA_VALUE_FORMATS = ("raw", "typed", "columns")
+
+def typed_odata_rows(rows: list, schema, value_format: str):
+    """Rows of a read in query_s4hana's typed form ([{Property: value}]) or columns form
+    ({"rows", "types", "columns": {Property: [values]}}), JSON-ready"""
+    names, types, columns = odata_columns(rows, schema)
+    columns = [[_TYPED_JSON[edm_type](value) for value in column] if edm_type in _TYPED_JSON else column
+               for edm_type, column in zip(types, columns)]
+    if value_format == "columns":
+        return {"rows": len(rows), "types": dict(zip(names, types)), "columns": dict(zip(names, columns))}
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+# --- Business Partner replica (SQLite read model, BP_REPLICA_ENABLED) ---
+# Indexed columns per entity set: the fields $filter and $orderby may use on the replica (and its DELTA_SYNC_KEYS)
+BP_REPLICA_INDEXES = {
+    "businesspartners": ("BusinessPartner", "Customer", "Supplier", "BusinessPartnerCategory",
+                         "BusinessPartnerGrouping", "BusinessPartnerFullName", "BusinessPartnerName", "SearchTerm1"),
+    "businesspartneraddresses": ("BusinessPartner", "AddressID", "Country", "CityName", "PostalCode", "Region"),
+    "businesspartnercontacts": ("RelationshipNumber", "BusinessPartnerCompany", "BusinessPartnerPerson", "ValidityEndDate"),
+    "customers": ("Customer", "CustomerName", "CustomerAccountGroup", "CustomerClassification"),
+    "suppliers": ("Supplier", "SupplierName", "SupplierAccountGroup")
+}
+_REPLICA_COMPARISON = re.compile(r"^(\w+) (eq|ne) '((?:[^']|'')*)'$")
+_REPLICA_STARTSWITH = re.compile(r"^startswith\((\w+),\s*'((?:[^']|'')*)'\)(?: eq true)?$")
+_REPLICA_ORDER = re.compile(r"^(\w+)(?: (asc|desc))?$")
+
+def _replica_value(value):
+    """Column value of an Atom property: its text, or None for m:null"""
+    if isinstance(value, dict):
+        return value.get("#text")
+    return value
+
+def _split_odata_and(expression: str) -> list:
+    """Split a $filter on top-level ' and ' (outside string literals)"""
+    clauses, current, quoted = [], [], False
+    i = 0
+    while i < len(expression):
+        if expression[i] == "'":
+            quoted = not quoted
+        elif not quoted and expression.startswith(" and ", i):
+            clauses.append("".join(current).strip())
+            current = []
+            i += 5
+            continue
+        current.append(expression[i])
+        i += 1
+    clauses.append("".join(current).strip())
+    return clauses
+
+class BpReplica:
+    """SQLite copy of the BP_ODATA entity sets that answers simple reads; anything else goes to SAP
+
+    Supported: $filter as 'and' of `Field eq|ne 'text'` and `startswith(Field,'text')` on
+    indexed fields, $orderby on indexed fields, $select, $top and $skip. Rows are stored as
+    the JSON fetch_odata_response returns, so answers are byte-identical to a live read.
+    Stale entity sets are caught up with DeltaSync where SAP tells what changed, and
+    reloaded otherwise.
+    """
+
+    def __init__(self, path: str, max_age_seconds: float):
+        self.path = path
+        self.max_age = max_age_seconds
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.entities = {}
+        self.opened = False
+        self.refresh_task = None
+        self.next_attempt = 0.0
+        self.last_sync = None
+        self.last_error = None
+
+    def _open(self):
+        import sqlite3
+        if self.db is not None:
+            self.db.close()
+        self.db, self.entities = None, {}
+        if os.path.exists(self.path):
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            for entity, loaded_at, row_count, properties in self.db.execute(
+                    "SELECT entity, loaded_at, row_count, properties FROM replica_meta"):
+                self.entities[entity] = {"loaded_at": loaded_at, "rows": row_count,
+                                         "properties": set(json.loads(properties))}
+        self.opened = True
+
+    def loaded(self, entity: str):
+        """The entity set's replica_meta entry if it is fresh, else None. One snapshot taken under db_lock:
+        _install swaps self.entities on a worker thread, so callers must not look it up again"""
+        with self.db_lock:
+            if not self.opened:
+                self._open()
+            loaded = self.entities.get(entity)
+        return loaded if loaded is not None and time.time() - loaded["loaded_at"] < self.max_age else None
+
+    def answer(self, entity: str, query: str):
+        """JSON body for the read, or None when the replica is stale or cannot express the query"""
+        loaded = self.loaded(entity)
+        if loaded is None:
+            self.ensure_fresh()
+            return None
+        plan = self._plan(entity, query, loaded)
+        if plan is None:
+            return None
+        sql, params, select, unbounded = plan
+        with self.db_lock:
+            rows = [row[0] for row in self.db.execute(sql, params)]
+        if unbounded and len(rows) > BP_REPLICA_PAGE_SIZE:
+            # Without $top SAP answers with its first server page; leave large results to it
+            return None
+        if not select:
+            return "[" + ", ".join(rows) + "]"
+        keys = [f"d:{name}" for name in select]
+        return json.dumps([{k: v for k, v in json.loads(row).items() if k in keys} for row in rows])
+
+    def _plan(self, entity: str, query: str, loaded: dict):
+        """(sql, params, select, unbounded) for the query, or None if it uses anything the replica can't answer;
+        loaded is the entity set's replica_meta entry (see loaded())"""
+        columns = BP_REPLICA_INDEXES[entity]
+        options = split_odata_query(query)
+        names = [name for name, _ in options]
+        if len(set(names)) != len(names) or not set(names) <= {"$filter", "$orderby", "$select", "$top", "$skip"}:
+            return None
+        options = dict(options)
+        where, params = [], []
+        if options.get("$filter"):
+            for clause in _split_odata_and(options["$filter"].strip()):
+                comparison = _REPLICA_COMPARISON.match(clause)
+                prefix = _REPLICA_STARTSWITH.match(clause)
+                if comparison and comparison.group(1) in columns:
+                    field, operator, value = comparison.groups()
+                    value = value.replace("''", "'")
+                    where.append(f'"{field}" = ?' if operator == "eq" else f'("{field}" IS NULL OR "{field}" != ?)')
+                    params.append(value)
+                elif prefix and prefix.group(1) in columns:
+                    field, value = prefix.group(1), prefix.group(2).replace("''", "'")
+                    where.append(f'"{field}" >= ? AND "{field}" < ?')
+                    params += [value, value + chr(0x10FFFF)]
+                else:
+                    return None
+        order = []
+        for item in filter(None, (part.strip() for part in options.get("$orderby", "").split(","))):
+            match = _REPLICA_ORDER.match(item)
+            if not match or match.group(1) not in columns:
+                return None
+            order.append(f'"{match.group(1)}" {(match.group(2) or "asc").upper()}')
+        select = [name.strip() for name in options.get("$select", "").split(",") if name.strip()]
+        if not set(select) <= loaded["properties"]:
+            return None
+        try:
+            top = int(options["$top"]) if "$top" in options else BP_REPLICA_PAGE_SIZE + 1
+            skip = int(options.get("$skip") or 0)
+        except ValueError:
+            return None
+        sql = f'SELECT data FROM "{entity}"'
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # Default order is load order, i.e. the key order SAP returned
+        sql += " ORDER BY " + ", ".join(order + ["rowid"]) + " LIMIT ? OFFSET ?"
+        return sql, params + [top, skip], select, "$top" not in options
+
+    def ensure_fresh(self):
+        """Start a background reload when any entity set is stale; never waits for it"""
+        if self.refresh_task is not None and not self.refresh_task.done():
+            return
+        if time.monotonic() < self.next_attempt:
+            return
+        # Also spaces out retries after a failed load
+        self.next_attempt = time.monotonic() + min(self.max_age, 300)
+        self.refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    async def refresh(self):
+        target = f"{self.path}.{uuid.uuid4().hex[:8]}.tmp"
+        started = time.monotonic()
+        # Own budget: the task inherits the deadline of the request that started it
+        with request_deadline(BP_REPLICA_LOAD_TIMEOUT_SECONDS):
+            try:
+                shared_age = await asyncio.to_thread(self._shared_age) if BP_REPLICA_BLOB_NAME else None
+                local_age = time.time() - os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                # Start from the newest copy; only its stale entity sets are then synced from SAP
+                source = "SAP"
+                if shared_age is not None and (local_age is None or shared_age < local_age):
+                    source = "blob"
+                    await asyncio.to_thread(self._download, target)
+                elif local_age is not None:
+                    source = "local copy"
+                    await asyncio.to_thread(self._copy_local, target)
+                self.last_sync = await self._sync_from_sap(target)
+                if self.last_sync and BP_REPLICA_BLOB_NAME:
+                    await asyncio.to_thread(self._upload, target)
+                await asyncio.to_thread(self._install, target)
+                self.last_error = None
+                sap_logger.info("[BP REPLICA] Refreshed from %s in %.1fs, synced from SAP: %s; rows: %s", source,
+                                time.monotonic() - started, self.last_sync or "none",
+                                {entity: meta["rows"] for entity, meta in self.entities.items()})
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                sap_logger.warning("[BP REPLICA] Refresh failed, reads keep going to SAP: %s", self.last_error)
+            finally:
+                with contextlib.suppress(OSError):
+                    os.remove(target)
+
+    async def _sync_from_sap(self, target: str) -> dict:
+        """Bring each stale entity set in `target` up to date; returns {entity: "delta" | "full" | "reload"}"""
+        import sqlite3
+        # Autocommit mode with explicit transactions, so a failed entity set rolls back DDL too
+        db = sqlite3.connect(target, check_same_thread=False, isolation_level=None)
+        try:
+            db.execute("CREATE TABLE IF NOT EXISTS replica_meta (entity TEXT PRIMARY KEY, loaded_at REAL, row_count INTEGER, "
+                       "properties TEXT, sync_state TEXT)")
+            with contextlib.suppress(sqlite3.OperationalError):
+                # Replicas written before delta sync
+                db.execute("ALTER TABLE replica_meta ADD COLUMN sync_state TEXT")
+            loaded = dict(db.execute("SELECT entity, loaded_at FROM replica_meta"))
+            synced = {}
+            for entity in BP_REPLICA_INDEXES:
+                if time.time() - (loaded.get(entity) or 0) < self.max_age:
+                    continue
+                loaded_at = time.time()
+                table = _ReplicaTable(db, entity)
+                sync = DeltaSync(f"bp_replica/{entity}", entity, store=table, page_size=BP_REPLICA_PAGE_SIZE)
+                db.execute("BEGIN")
+                try:
+                    if sync.supported:
+                        synced[entity] = (await sync.run(table))["mode"]
+                    else:
+                        await table.reset()
+                        async for rows in iter_odata_pages(entity, BP_REPLICA_PAGE_SIZE):
+                            await table.upsert(rows)
+                        synced[entity] = "reload"
+                    db.execute("INSERT INTO replica_meta (entity, loaded_at, row_count, properties) VALUES (?, ?, ?, ?) "
+                               "ON CONFLICT (entity) DO UPDATE SET loaded_at = excluded.loaded_at, "
+                               "row_count = excluded.row_count, properties = excluded.properties",
+                               (entity, loaded_at, table.row_count(), json.dumps(table.properties)))
+                    db.execute("COMMIT")
+                except BaseException as e:
+                    db.execute("ROLLBACK")
+                    if not isinstance(e, Exception) or isinstance(e, DeadlineExceeded):
+                        raise
+                    sap_logger.warning("[BP REPLICA] %s not synced (the previous copy, if any, stays stale): %s", entity, e)
+            return synced
+        finally:
+            db.close()
+
+    def _shared_age(self):
+        """Seconds since the shared copy was uploaded, or None when there is none"""
+        from azure.core.exceptions import ResourceNotFoundError
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            return None
+        blob_client = blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=BP_REPLICA_BLOB_NAME)
+        try:
+            properties = blob_client.get_blob_properties(timeout=BLOB_TIMEOUT_SECONDS)
+        except ResourceNotFoundError:
+            return None
+        return time.time() - properties.last_modified.timestamp()
+
+    def _download(self, target: str):
+        blob_client = get_blob_service_client().get_blob_client(container=BLOB_CONTAINER_NAME, blob=BP_REPLICA_BLOB_NAME)
+        with blob_operation("download", BP_REPLICA_BLOB_NAME), open(target, "wb") as f:
+            blob_client.download_blob(timeout=BLOB_TIMEOUT_SECONDS).readinto(f)
+
+    def _copy_local(self, target: str):
+        import sqlite3
+        # Own connection: installs replace the file, they never modify it in place
+        source, copy = sqlite3.connect(self.path), sqlite3.connect(target)
+        try:
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+
+    def _upload(self, source: str):
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            return
+        try:
+            blob_client = blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=BP_REPLICA_BLOB_NAME)
+            with blob_operation("upload", BP_REPLICA_BLOB_NAME), open(source, "rb") as f:
+                blob_client.upload_blob(f, overwrite=True, timeout=BLOB_TIMEOUT_SECONDS)
+        except Exception as e:
+            blob_logger.warning("[BP REPLICA] Failed to share the replica through blob storage: %s", e)
+
+    def _install(self, source: str):
+        with self.db_lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+            os.replace(source, self.path)
+            self._open()
+
+    def snapshot(self) -> dict:
+        return {
+            "entities": {entity: {"rows": meta["rows"], "age_seconds": round(time.time() - meta["loaded_at"], 1)}
+                         for entity, meta in self.entities.items()},
+            "max_age_seconds": self.max_age,
+            "refreshing": self.refresh_task is not None and not self.refresh_task.done(),
+            "last_sync": self.last_sync,
+            "last_error": self.last_error
+        }
+
+class _ReplicaTable:
+    """One entity set of a replica being built: DeltaSync sink for its rows and store for its sync state"""
+
+    def __init__(self, db, entity: str):
+        self.db = db
+        self.entity = entity
+        self.columns = BP_REPLICA_INDEXES[entity]
+        self.key_fields = DELTA_SYNC_KEYS[entity]
+        meta = db.execute("SELECT properties FROM replica_meta WHERE entity = ?", (entity,)).fetchone()
+        self.properties = json.loads(meta[0]) if meta and meta[0] else []
+        self._key_columns = ", ".join(f'"{k}"' for k in self.key_fields)
+        self._match_key = " AND ".join(f'"{k}" IS ?' for k in self.key_fields)
+
+    def load(self, name: str) -> dict:
+        row = self.db.execute("SELECT sync_state FROM replica_meta WHERE entity = ?", (self.entity,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def save(self, name: str, state: dict):
+        self.db.execute("INSERT INTO replica_meta (entity, sync_state) VALUES (?, ?) "
+                        "ON CONFLICT (entity) DO UPDATE SET sync_state = excluded.sync_state",
+                        (self.entity, json.dumps(state)))
+
+    def row_count(self) -> int:
+        return self.db.execute(f'SELECT COUNT(*) FROM "{self.entity}"').fetchone()[0]
+
+    def _reset(self):
+        column_defs = ", ".join(f'"{c}" TEXT' for c in self.columns)
+        self.db.execute(f'DROP TABLE IF EXISTS "{self.entity}"')
+        self.db.execute(f'CREATE TABLE "{self.entity}" (data TEXT NOT NULL, {column_defs})')
+        for column in self.columns:
+            self.db.execute(f'CREATE INDEX "{self.entity}_{column}" ON "{self.entity}" ("{column}")')
+        self.properties = []
+
+    def _upsert(self, rows: list):
+        column_list = ", ".join(f'"{c}"' for c in self.columns)
+        self.db.executemany(f'DELETE FROM "{self.entity}" WHERE {self._match_key}',
+                            [tuple(_replica_value(row.get(f"d:{k}")) for k in self.key_fields) for row in rows])
+        self.db.executemany(f'INSERT INTO "{self.entity}" (data, {column_list}) VALUES ({", ".join("?" * (len(self.columns) + 1))})',
+                            [(json.dumps(row), *(_replica_value(row.get(f"d:{c}")) for c in self.columns)) for row in rows])
+        self.properties = self.properties or [key.split(":", 1)[-1] for key in rows[0]]
+        if self.row_count() > BP_REPLICA_MAX_ROWS:
+            raise RuntimeError(f"more than BP_REPLICA_MAX_ROWS={BP_REPLICA_MAX_ROWS} rows")
+
+    def _delete(self, keys: set):
+        self.db.executemany(f'DELETE FROM "{self.entity}" WHERE {self._match_key}', list(keys))
+
+    def _keys(self) -> set:
+        return set(self.db.execute(f'SELECT {self._key_columns} FROM "{self.entity}"'))
+
+    async def reset(self):
+        await asyncio.to_thread(self._reset)
+
+    async def upsert(self, rows: list):
+        await asyncio.to_thread(self._upsert, rows)
+
+    async def delete(self, keys: set):
+        await asyncio.to_thread(self._delete, keys)
+
+    async def keys(self) -> set:
+        return await asyncio.to_thread(self._keys)
+
+def _default_replica_path() -> str:
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), "bp_replica.sqlite3")
+
+bp_replica = BpReplica(BP_REPLICA_PATH or _default_replica_path(), BP_REPLICA_MAX_AGE_SECONDS) if BP_REPLICA_ENABLED else None
+
+# --- OData query guard (parser, canonical form, $top limits and cost budget) ---
+class ODataQueryError(ValueError):
+    """Raised for client queries that cannot be parsed or would cost SAP more than ODATA_COST_BUDGET"""
+
+    def __init__(self, message: str, code: str = "INVALID_QUERY", **details):
+        super().__init__(message)
+        self.code = code
+        self.details = details
+
+    def to_dict(self) -> dict:
+        return {"error": self.code, "message": str(self), **self.details}
+
+    def to_response(self) -> func.HttpResponse:
+        return func.HttpResponse(json.dumps(self.to_dict()), mimetype="application/json", status_code=400)
+
+    def to_jsonrpc_error(self) -> dict:
+        return {"code": -32602, "message": str(self), "data": self.to_dict()}
+
+_ODATA_TOKEN = re.compile(r"""\s*(?:
+    (?P<literal>(?:datetime|datetimeoffset|guid|time|binary|X)'(?:[^']|'')*'|'(?:[^']|'')*'
+               |-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?[mMdDfFlL]?(?![\w.]))
+   |(?P<name>[A-Za-z_]\w*(?:/[A-Za-z_]\w*)*)
+   |(?P<punct>[(),])
+)""", re.X)
+# Canonical function names with their allowed argument counts
+_ODATA_FUNCTIONS = {
+    "substringof": (2,), "startswith": (2,), "endswith": (2,), "indexof": (2,), "length": (1,), "replace": (3,),
+    "substring": (2, 3), "tolower": (1,), "toupper": (1,), "trim": (1,), "concat": (2,), "year": (1,),
+    "month": (1,), "day": (1,), "hour": (1,), "minute": (1,), "second": (1,), "round": (1,), "floor": (1,),
+    "ceiling": (1,), "isof": (1, 2), "cast": (1, 2)
+}
+# Binding strength, loosest first: or, and, equality, relational, additive, multiplicative, not
+_ODATA_PRECEDENCE = {"or": 1, "and": 2, "eq": 3, "ne": 3, "gt": 4, "ge": 4, "lt": 4, "le": 4,
+                     "add": 5, "sub": 5, "mul": 6, "div": 6, "mod": 6, "not": 7}
+_ODATA_PATH = re.compile(r"^[A-Za-z_]\w*(?:/[A-Za-z_]\w*)*$")
+_ODATA_OPTION_ORDER = ("$filter", "$expand", "$select", "$orderby", "$skip", "$top", "$skiptoken", "$inlinecount")
+_ODATA_SYSTEM_OPTIONS = _ODATA_OPTION_ORDER + ("$format",)
+# Fields besides keys and replica indexes that SAP can narrow a read by
+_ODATA_SELECTIVE_FIELDS = {
+    "salesorders": ("SoldToParty", "PurchaseOrderByCustomer", "SalesOrderType", "SalesOrganization"),
+    "salesorderitems": ("Material",),
+    "salesorderheaderpartners": ("Customer", "Supplier"),
+}
+
+class _ODataFilterParser:
+    """Recursive-descent parser for OData V2 $filter expressions
+
+    Nodes are tuples: ("literal", text), ("field", path), ("call", name, [args]),
+    ("not", operand), ("and"|"or", [operands]) and (operator, left, right) for the
+    comparison and arithmetic operators.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = []
+        position = 0
+        while text[position:].strip():
+            match = _ODATA_TOKEN.match(text, position)
+            if not match:
+                raise ODataQueryError(f"Unexpected input in $filter at position {position}: {text[position:position + 20]!r}")
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            position = match.end()
+        self.position = 0
+
+    def parse(self):
+        node = self._binary(1)
+        if self.position < len(self.tokens):
+            raise ODataQueryError(f"Unexpected '{self.tokens[self.position][1]}' in $filter")
+        return node
+
+    def _word(self):
+        if self.position < len(self.tokens) and self.tokens[self.position][0] == "name":
+            return self.tokens[self.position][1].lower()
+        return None
+
+    def _take(self):
+        if self.position >= len(self.tokens):
+            raise ODataQueryError("Unexpected end of $filter")
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def _expect(self, punct: str):
+        if self._take() != ("punct", punct):
+            raise ODataQueryError(f"Expected '{punct}' in $filter")
+
+    def _binary(self, level: int):
+        if level == _ODATA_PRECEDENCE["not"]:
+            return self._unary()
+        node = self._binary(level + 1)
+        while self._word() in _ODATA_PRECEDENCE and _ODATA_PRECEDENCE[self._word()] == level:
+            operator = self._take()[1].lower()
+            right = self._binary(level + 1)
+            if operator in ("and", "or"):
+                # Flattened, so a and (b and c) and (a and b) and c render the same
+                node = (operator, (node[1] if node[0] == operator else [node]) + (right[1] if right[0] == operator else [right]))
+            else:
+                node = (operator, node, right)
+        return node
+
+    def _unary(self):
+        if self._word() == "not":
+            self._take()
+            return ("not", self._unary())
+        kind, text = self._take()
+        if kind == "punct" and text == "(":
+            node = self._binary(1)
+            self._expect(")")
+            return node
+        if kind == "literal":
+            return ("literal", text)
+        if kind == "name":
+            lower = text.lower()
+            if lower in ("true", "false", "null"):
+                return ("literal", lower)
+            if self.position < len(self.tokens) and self.tokens[self.position] == ("punct", "("):
+                if lower not in _ODATA_FUNCTIONS:
+                    raise ODataQueryError(f"Unknown $filter function '{text}'")
+                self._take()
+                args = []
+                if self.position < len(self.tokens) and self.tokens[self.position] == ("punct", ")"):
+                    self._take()
+                else:
+                    args.append(self._binary(1))
+                    while self._take() == ("punct", ","):
+                        args.append(self._binary(1))
+                    self.position -= 1
+                    self._expect(")")
+                if len(args) not in _ODATA_FUNCTIONS[lower]:
+                    raise ODataQueryError(f"{lower}() takes {' or '.join(map(str, _ODATA_FUNCTIONS[lower]))} arguments")
+                return ("call", lower, args)
+            if lower in _ODATA_PRECEDENCE:
+                raise ODataQueryError(f"Unexpected '{text}' in $filter")
+            return ("field", text)
+        raise ODataQueryError(f"Unexpected '{text}' in $filter")
+
+def parse_odata_filter(text: str):
+    """Syntax tree of a $filter expression (see _ODataFilterParser); raises ODataQueryError"""
+    return _ODataFilterParser(text).parse()
+
+def render_odata_filter(node, parent: int = 0) -> str:
+    """Canonical text of a $filter tree: lower-case operators, single spaces, only the parentheses
+    precedence needs, and the operands of and/or sorted and de-duplicated"""
+    kind = node[0]
+    if kind in ("literal", "field"):
+        return node[1]
+    if kind == "call":
+        return f"{node[1]}({','.join(render_odata_filter(arg) for arg in node[2])})"
+    precedence = _ODATA_PRECEDENCE[kind]
+    if kind in ("and", "or"):
+        text = f" {kind} ".join(sorted({render_odata_filter(item, precedence) for item in node[1]}))
+    elif kind == "not":
+        text = f"not {render_odata_filter(node[1], precedence)}"
+    else:
+        text = f"{render_odata_filter(node[1], precedence)} {kind} {render_odata_filter(node[2], precedence + 1)}"
+    return f"({text})" if precedence < parent else text
+
+def _odata_paths(value: str, option: str, allow_star: bool = False) -> list:
+    paths = [item.strip() for item in value.split(",") if item.strip()]
+    for path in paths:
+        if not (_ODATA_PATH.match(path) or (allow_star and (path == "*" or _ODATA_PATH.match(path.removesuffix("/*"))))):
+            raise ODataQueryError(f"Invalid {option} item '{path}'")
+    return paths
+
+def _odata_count(value: str, option: str) -> int:
+    if not value.strip().isdigit():
+        raise ODataQueryError(f"{option} must be a non-negative integer, got '{value}'")
+    return int(value)
+
+def odata_string_literal(value) -> str:
+    """Quoted OData string literal for a user-supplied value"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def split_odata_query(query: str) -> list:
+    """[(name, value)] of a query string, split on & and the first =, percent-decoded. Unlike parse_qsl
+    (form decoding) a literal + stays +, as in datetimeoffset'2024-01-01T00:00:00+01:00'."""
+    pairs = []
+    for part in (query or "").lstrip("?").split("&"):
+        if part:
+            name, _, value = part.partition("=")
+            pairs.append((urllib.parse.unquote(name), urllib.parse.unquote(value)))
+    return pairs
+
+def _encode_option_value(value: str) -> str:
+    """Escape only what would end or corrupt the option in a URL; spaces stay readable (httpx encodes them)"""
+    return value.replace("%", "%25").replace("&", "%26").replace("#", "%23").replace("+", "%2B")
+
+def estimate_odata_cost(entity: str, filter_tree, orderby: list, skip: int, top: int, expand: list) -> tuple:
+    """(rows SAP is expected to touch, rows touched per returned row, reason) for a parsed query
+
+    A coarse model, tuned to tell fine queries from gateway-blocking ones rather than to
+    predict latency: a filter with `eq` or startswith() on a key or indexed field
+    (DELTA_SYNC_KEYS, BP_REPLICA_INDEXES, _ODATA_SELECTIVE_FIELDS) narrows the read and
+    costs nothing extra. Otherwise string functions such as substringof() scan the whole
+    entity set (ODATA_SCAN_ROWS); other filters and sorting by an unindexed field cost a
+    tenth of that, and $skip rows are read and thrown away. Every returned row costs
+    ODATA_EXPAND_FANOUT times more per $expand level.
+    """
+    selective = set(DELTA_SYNC_KEYS.get(entity, ())) | set(BP_REPLICA_INDEXES.get(entity, ())) | \
+        set(_ODATA_SELECTIVE_FIELDS.get(entity, ()))
+    conjuncts = [] if filter_tree is None else filter_tree[1] if filter_tree[0] == "and" else [filter_tree]
+
+    def narrows(node) -> bool:
+        if node[0] == "or":
+            return all(narrows(item) for item in node[1])
+        if node[0] == "eq":
+            left, right = (node[2], node[1]) if node[1][0] == "literal" else (node[1], node[2])
+            if left[0] == "field" and right[0] == "literal" and right[1] != "null":
+                return left[1] in selective
+            if left[0] != "call" or right != ("literal", "true"):
+                return False
+            # startswith(Field,'text') eq true
+            node = left
+        return node[0] == "call" and node[1] == "startswith" and node[2][0][0] == "field" and \
+            node[2][0][1] in selective and node[2][1][0] == "literal"
+
+    def functions(node) -> set:
+        if node[0] == "call":
+            return {node[1]}.union(*(functions(arg) for arg in node[2]))
+        if node[0] in ("and", "or"):
+            return set().union(*(functions(item) for item in node[1]))
+        if node[0] in ("literal", "field"):
+            return set()
+        return set().union(*(functions(item) for item in node[1:]))
+
+    per_row = ODATA_EXPAND_FANOUT ** len(expand)
+    fanout = f", {len(expand)} $expand level(s)" if expand else ""
+    if any(narrows(node) for node in conjuncts):
+        return top * per_row, per_row, "narrowed by an indexed field" + fanout
+    scan, reason = 0.0, "no filter"
+    if filter_tree is not None:
+        scanning = functions(filter_tree) - {"startswith"}
+        if scanning:
+            scan, reason = ODATA_SCAN_ROWS, f"{', '.join(sorted(scanning))}() cannot use an index"
+        else:
+            scan, reason = ODATA_SCAN_ROWS / 10, "filter on unindexed fields"
+    if any(field.split(" ")[0] not in selective for field in orderby) and scan < ODATA_SCAN_ROWS / 10:
+        scan, reason = ODATA_SCAN_ROWS / 10, "$orderby on an unindexed field"
+    if skip > scan:
+        reason = f"$skip={skip}"
+    return scan + skip + top * per_row, per_row, reason + fanout
+
+def prepare_odata_query(entity: str, query: str) -> tuple:
+    """Canonical, bounded form of a client query for `entity`: (query, notes on what was changed)
+
+    Every option is parsed and written back in one canonical order and spelling, which also
+    makes equal queries share cache entries. $top defaults to ODATA_DEFAULT_TOP and is capped
+    at ODATA_MAX_TOP (per entity set: ODATA_TOP_LIMITS). A query estimated over ODATA_COST_BUDGET
+    gets a lower $top when that is enough, and is rejected otherwise. Raises ODataQueryError.
+    """
+    default_top, max_top = ODATA_TOP_LIMITS.get(entity, (ODATA_DEFAULT_TOP, ODATA_MAX_TOP))
+    options, notes = {}, []
+    for name, value in split_odata_query(query):
+        name = name.strip()
+        if name in options:
+            raise ODataQueryError(f"{name} is given more than once")
+        if name.startswith("$") and name not in _ODATA_SYSTEM_OPTIONS:
+            raise ODataQueryError(f"Unsupported query option {name}; use {', '.join(_ODATA_OPTION_ORDER)}")
+        options[name] = value.strip()
+    if options.pop("$format", None) is not None:
+        notes.append("$format dropped: results are always returned as JSON")
 
-async def handle_approval_status_tool(msg_id, arguments):
-    """Handle check_approval_status tool calls"""
-    try:
-        request_id = arguments.get("request_id", "")
-        
-        if not request_id:
-            response = {
-                "jsonrpc": "2.0",
-                "id": msg_id,
-                "error": {
-                    "code": -32602,
-                    "message": "Missing required parameter: request_id"
-                }
-            }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
-        
-        # Check in memory first, then blob storage if not found
-        approval_data = None
-        if request_id in approval_requests:
-            approval_data = approval_requests[request_id]
+    filter_tree = parse_odata_filter(options["$filter"]) if options.get("$filter") else None
+    expand = sorted(set(_odata_paths(options.get("$expand", ""), "$expand")))
+    select = sorted(set(_odata_paths(options.get("$select", ""), "$select", allow_star=True)))
+    orderby = []
+    for item in filter(None, (part.strip() for part in options.get("$orderby", "").split(","))):
+        path, _, direction = item.partition(" ")
+        direction = direction.strip().lower()
+        if not _ODATA_PATH.match(path) or direction not in ("", "asc", "desc"):
+            raise ODataQueryError(f"Invalid $orderby item '{item}'")
+        orderby.append(f"{path} desc" if direction == "desc" else path)
+    skip = _odata_count(options["$skip"], "$skip") if options.get("$skip") else 0
+    if options.get("$inlinecount", "allpages") not in ("allpages", "none"):
+        raise ODataQueryError("$inlinecount must be allpages or none")
+    if options.get("$top"):
+        top = _odata_count(options["$top"], "$top")
+        if top > max_top:
+            notes.append(f"$top lowered from {top} to the maximum {max_top} for {entity}")
+            top = max_top
+    else:
+        top = default_top
+        notes.append(f"$top={top} added (default for {entity})")
+
+    cost, per_row, reason = estimate_odata_cost(entity, filter_tree, orderby, skip, top, expand)
+    outcome = "rewritten" if notes else "accepted"
+    if cost > ODATA_COST_BUDGET:
+        fitting_top = int((ODATA_COST_BUDGET - (cost - top * per_row)) // per_row)
+        if not ODATA_COST_ENFORCE:
+            sap_logger.warning("[QUERY GUARD] %s query over budget (%.0f > %.0f, %s), not enforced: %s",
+                               entity, cost, ODATA_COST_BUDGET, reason, LogPayload(query))
+        elif fitting_top >= 1:
+            notes.append(f"$top lowered from {top} to {fitting_top} to stay within the query cost budget ({reason})")
+            top, outcome = fitting_top, "rewritten"
         else:
-            # Try to get from blob storage
-            approval_data = await get_approval_request_from_blob(request_id)
-            if approval_data:
-                # Cache in memory for faster future access
-                approval_requests[request_id] = approval_data
-        
-        if not approval_data:
-            response = {
-                "jsonrpc": "2.0",
-                "id": msg_id,
-                "result": {
-                    "content": [{
-                        "type": "text",
-                        "text": json.dumps({
-                            "status": "not_found",
-                            "message": f"Approval request {request_id} not found in memory or blob storage",
-                            "request_id": request_id
-                        }, indent=2)
-                    }]
-                }
-            }
-            http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-            return add_cors_headers(http_response)
-        
-        response = {
-            "jsonrpc": "2.0",
-            "id": msg_id,
-            "result": {
-                "content": [{
-                    "type": "text",
-                    "text": json.dumps({
-                        "request_id": request_id,
-                        "status": approval_data.get("status", "unknown"),
-                        "created_at": approval_data.get("created_at", ""),
-                        "created_by": approval_data.get("created_by", ""),
-                        "approver": approval_data.get("approver", ""),
-                        "approved_at": approval_data.get("approved_at", ""),
-                        "approver_comments": approval_data.get("approver_comments", ""),
-                        "sales_order_data": approval_data.get("sales_order_data", {}),
-                        "justification": approval_data.get("justification", "")
-                    }, indent=2)
-                }]
-            }
-        }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
-        
-    except Exception as e:
-        logging.exception("[Error] Approval status tool failed")
-        response = {
-            "jsonrpc": "2.0",
-            "id": msg_id,
-            "error": {
-                "code": -32603,
-                "message": f"Internal error: {str(e)}"
-            }
-        }
-        http_response = func.HttpResponse(json.dumps(response), mimetype="application/json")
-        return add_cors_headers(http_response)
+            ODATA_QUERIES_TOTAL.inc(entity=entity, outcome="rejected")
+            raise ODataQueryError(
+                f"Query too expensive for {entity}: estimated {cost:.0f} rows touched, budget {ODATA_COST_BUDGET:.0f} "
+                f"({reason}). Filter with eq or startswith() on a key or indexed field, avoid substringof() and "
+                f"large $skip, or $expand less.",
+                code="QUERY_TOO_EXPENSIVE", estimated_cost=round(cost), budget=ODATA_COST_BUDGET, reason=reason)
+
+    values = {"$filter": render_odata_filter(filter_tree) if filter_tree is not None else None,
+              "$expand": ",".join(expand) or None, "$select": ",".join(select) or None,
+              "$orderby": ",".join(orderby) or None, "$skip": str(skip) if skip else None, "$top": str(top),
+              "$skiptoken": options.get("$skiptoken") or None, "$inlinecount": options.get("$inlinecount") or None}
+    parts = [f"{name}={_encode_option_value(values[name])}" for name in _ODATA_OPTION_ORDER if values[name] is not None]
+    # Custom options (e.g. sap-client, search) pass through in name order
+    parts += [f"{name}={_encode_option_value(value)}" for name, value in sorted(options.items()) if not name.startswith("$")]
+    ODATA_QUERIES_TOTAL.inc(entity=entity, outcome=outcome)
+    if notes:
+        sap_logger.info("[QUERY GUARD] %s: %s", entity, "; ".join(notes))
+    return "&".join(parts), notes
 
 # --- SAP OData Helper Functions ---
-async def fetch_odata_response(entity: str, query: str = "") -> func.HttpResponse:
-    """Fetch data from S/4HANA OData endpoints"""
+def _odata_feed(body: bytes) -> dict:
+    import xmltodict
+    return xmltodict.parse(body).get("feed") or {}
+
+def _feed_rows(feed: dict) -> list:
+    entries = feed.get("entry", [])
+    if isinstance(entries, dict):
+        entries = [entries]
+    return [entry.get("content", {}).get("m:properties", {}) for entry in entries]
+
+def _feed_link(feed: dict, rel: str):
+    """Absolute href of the feed's <link rel=...>, resolved against xml:base, or None"""
+    links = feed.get("link", [])
+    if isinstance(links, dict):
+        links = [links]
+    href = next((link.get("@href") for link in links if link.get("@rel") == rel), None)
+    return urllib.parse.urljoin(feed.get("@xml:base", ""), href) if href else None
+
+def parse_odata_feed(body: bytes) -> tuple:
+    """Rows (m:properties of each entry) of an Atom feed and its server-driven next link, or None"""
+    feed = _odata_feed(body)
+    return _feed_rows(feed), _feed_link(feed, "next")
+
+def _feed_json(body: bytes) -> tuple:
+    """(row count, JSON array of the rows) of an Atom feed; text crosses a process boundary cheaper than dicts"""
+    rows, _ = parse_odata_feed(body)
+    return len(rows), json.dumps(rows)
+
+class FeedParsePool:
+    """Runs feed parsers for large SAP responses in a thread or process pool so a big feed does not stall
+    other calls on the event loop. Feeds under SAP_PARSE_OFFLOAD_BYTES are parsed inline, where the handoff
+    would cost more than it saves. At most SAP_PARSE_QUEUE_DEPTH parses wait or run in the pool."""
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self.waiting = 0
+
+    def _pool(self):
+        if self._executor is None:
+            import concurrent.futures
+            if SAP_PARSE_EXECUTOR == "process":
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=SAP_PARSE_WORKERS)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=SAP_PARSE_WORKERS,
+                                                                       thread_name_prefix="sap-parse")
+        return self._executor
+
+    async def run(self, parser, body: bytes):
+        """parser(body), inline or in the pool depending on the size of body"""
+        if SAP_PARSE_WORKERS <= 0 or len(body) < SAP_PARSE_OFFLOAD_BYTES:
+            SAP_FEED_PARSES_TOTAL.inc(mode="inline")
+            return parser(body)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(1, SAP_PARSE_QUEUE_DEPTH))
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            SAP_FEED_PARSES_TOTAL.inc(mode=SAP_PARSE_EXECUTOR)
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), parser, body)
+        except Exception as e:
+            import concurrent.futures.process
+            if not isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                raise
+            # A worker died (e.g. out of memory): start a fresh pool next time, parse this feed here
+            sap_logger.warning("[PARSE POOL] Worker pool broken, parsing inline: %s", e)
+            self._executor = None
+            return parser(body)
+        finally:
+            self._slots.release()
+
+feed_parse_pool = FeedParsePool()
+SAP_PARSE_WAITING_GAUGE = Gauge("sap_parse_waiting", "Large SAP feeds waiting for a parse pool slot", (),
+                                lambda: [((), feed_parse_pool.waiting)])
+
+class ODataFeedError(RuntimeError):
+    """Non-200 answer to a feed page read; status_code lets callers tell expired delta links from outages"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+async def get_odata_feed(entity: str, url: str, headers: dict = None) -> dict:
+    """GET one feed page of an entity set (guarded and retried) and return the parsed <feed>"""
+    service = sap_service_for_entity(entity)
+    auth = (os.getenv("SAP_USER"), os.getenv("SAP_PASS"))
+    r = await sap_request_with_retry(
+        lambda: send_sap_request(
+            service, "GET", url, entity=entity, auth=auth,
+            headers={"Accept": "application/xml", "Accept-Encoding": SAP_ACCEPT_ENCODING, **(headers or {})},
+            timeout=deadline_timeout(60.0, f"GET {entity} page")
+        ),
+        operation=f"GET {entity} page",
+        idempotent=True
+    )
+    if r.status_code != 200:
+        raise ODataFeedError(r.status_code, f"HTTP {r.status_code} reading {entity}: {r.text[:200]}")
+    return await feed_parse_pool.run(_odata_feed, r.content)
+
+async def iter_odata_pages(entity: str, page_size: int = 1000, query: str = ""):
+    """Yield an entity set's rows page by page: $top/$skip windows, following server-driven next links in each"""
+    base_url = ALL_ODATA[entity]
+    skip = 0
+    while True:
+        url = f"{base_url}?{query + '&' if query else ''}$top={page_size}&$skip={skip}"
+        window_rows = 0
+        while url:
+            feed = await get_odata_feed(entity, url)
+            rows, url = _feed_rows(feed), _feed_link(feed, "next")
+            window_rows += len(rows)
+            if rows:
+                yield rows
+        if window_rows < page_size:
+            return
+        skip += page_size
+
+async def fetch_odata_response(entity: str, query: str = "", use_cache: bool = True,
+                               cache_ttl: float = None) -> func.HttpResponse:
+    """Fetch data from S/4HANA OData endpoints (Business Partner reads go through bp_replica and sap_read_cache;
+    cache_ttl caches other reads, or overrides SAP_READ_CACHE_TTL_SECONDS for them)"""
+    if bp_replica is not None and entity in BP_REPLICA_INDEXES and use_cache:
+        try:
+            replica_body = bp_replica.answer(entity, query)
+        except Exception as e:
+            # The replica is only a shortcut: any failure (sqlite, a refresh swapping files) falls through to SAP
+            sap_logger.warning("[BP REPLICA] %s read failed, asking SAP: %s", entity, e)
+            replica_body = None
+        record_cache_lookup("bp_replica", replica_body is not None)
+        if replica_body is not None:
+            return func.HttpResponse(replica_body, mimetype="application/json")
+
+    cache_ttl = cache_ttl if cache_ttl is not None else SAP_READ_CACHE_TTL_SECONDS if entity in BP_ODATA else 0
+    cacheable = cache_ttl > 0
+    if cacheable and use_cache:
+        cached = sap_read_cache.get(entity, query)
+        record_cache_lookup("sap_reads", cached is not None)
+        if cached is not None:
+            return func.HttpResponse(cached, mimetype="application/json")
+
     url = ALL_ODATA.get(entity)
     if query:
         url = f"{url}?{query}"
@@ -917,41 +4349,103 @@ async def fetch_odata_response(entity: str, query: str = "") -> func.HttpRespons
     if not user or not pwd:
         return func.HttpResponse("Missing SAP_USER or SAP_PASS environment variables", status_code=500)
     
+    started = time.monotonic()
+    timings = {}
     try:
-        async with httpx.AsyncClient(timeout=15.0, verify=False) as client:
-            r = await client.get(url, auth=(user, pwd), headers={"Accept": "application/xml"})
-        
+        # Stream the (gzip/deflate) feed so it is decoded chunk by chunk as it arrives
+        with trace_span("sap.read", {"sap.entity": entity, "sap.query": query or None}):
+            r = await sap_request_with_retry(
+                lambda: send_sap_request(
+                    sap_service_for_entity(entity),
+                    "GET",
+                    url,
+                    entity=entity,
+                    timings=timings,
+                    auth=(user, pwd),
+                    headers={"Accept": "application/xml", "Accept-Encoding": SAP_ACCEPT_ENCODING},
+                    timeout=deadline_timeout(15.0, f"GET {entity}")
+                ),
+                operation=f"GET {entity}",
+                idempotent=True
+            )
+
         if r.status_code != 200:
-            logging.error(f"[S/4HANA ERROR {r.status_code}] {r.text}")
+            sap_logger.error("[S/4HANA ERROR %s] %s", r.status_code, LogPayload(r.text))
+            slow_query_log.record(method="GET", entity=entity, query=query, total_seconds=time.monotonic() - started,
+                                  timings=timings, status=r.status_code)
             return func.HttpResponse(r.text, status_code=r.status_code)
-        
+
+        body = r.content
+        sap_logger.info("[S/4HANA] %s: %s bytes on the wire (%s), %s decoded", entity, r.num_bytes_downloaded,
+                        r.headers.get("Content-Encoding", "identity"), len(body))
+        SAP_RESPONSE_BYTES.observe(r.num_bytes_downloaded, entity=entity, form="wire")
+        SAP_RESPONSE_BYTES.observe(len(body), entity=entity, form="decoded")
+
         # Parse XML response to JSON
-        parsed = xmltodict.parse(r.text)
-        entries = parsed.get("feed", {}).get("entry", [])
-        if isinstance(entries, dict):
-            entries = [entries]
-        
-        results = []
-        for entry in entries:
-            properties = entry.get("content", {}).get("m:properties", {})
-            results.append(properties)
+        parse_started = time.monotonic()
+        with trace_span("sap.parse", {"sap.entity": entity, "sap.response.bytes": len(body)}) as span:
+            row_count, response_body = await feed_parse_pool.run(_feed_json, body)
+            span.set_attribute("sap.row_count", row_count)
+        timings["parse"] = time.monotonic() - parse_started
+        SAP_PHASE_SECONDS.observe(timings["parse"], service=sap_service_for_entity(entity),
+                                  entity=entity, method="GET", phase="parse")
+        slow_query_log.record(method="GET", entity=entity, query=query, total_seconds=time.monotonic() - started,
+                              timings=timings, rows=row_count, response_bytes=len(body), status=r.status_code)
         
-        return func.HttpResponse(json.dumps(results), mimetype="application/json")
+        if cacheable:
+            sap_read_cache.store(entity, query, response_body, cache_ttl)
+        return func.HttpResponse(response_body, mimetype="application/json")
         
+    except DeadlineExceeded:
+        raise
+    except SapDegradedError as e:
+        sap_logger.warning("[SAP DEGRADED] %s: %s", entity, e)
+        return e.to_response()
     except httpx.RequestError as e:
-        logging.exception("[RequestError] S/4HANA OData unreachable")
+        sap_logger.exception("[RequestError] S/4HANA OData unreachable")
         return func.HttpResponse(f"S/4HANA connection error: {e}", status_code=500)
     except Exception as e:
-        logging.exception("[Exception] S/4HANA OData parse error")
+        sap_logger.exception("[Exception] S/4HANA OData parse error")
         return func.HttpResponse(f"S/4HANA processing error: {e}", status_code=500)
 
-async def post_odata_entity(entity: str, payload: dict, bypass_approval: bool = False) -> func.HttpResponse:
+async def fetch_sap_csrf_token(service: str, entity: str, url: str, auth: tuple) -> tuple:
+    """Fetch a CSRF token and session cookies for a service and cache them; ("", None) if SAP issued none"""
+    sap_logger.info("[CREATE] Fetching CSRF token for %s...", entity)
+    with trace_span("sap.csrf_fetch", {"sap.entity": entity}):
+        # GET with X-CSRF-Token: Fetch is idempotent - safe to retry
+        csrf_response = await sap_request_with_retry(
+            lambda: send_sap_request(
+                service,
+                "GET",
+                url,
+                entity=entity,
+                auth=auth,
+                headers={
+                    "X-CSRF-Token": "Fetch",
+                    "Accept": "application/json"
+                },
+                timeout=deadline_timeout(60.0, f"CSRF {entity}")  # Up to 60 seconds for S/4HANA operations
+            ),
+            operation=f"CSRF {entity}",
+            idempotent=True
+        )
+    
+    csrf_token = csrf_response.headers.get("X-CSRF-Token", "")
+    if not csrf_token or csrf_token.lower() == "required":
+        return "", None
+    sap_logger.info("[CSRF] Got token for %s", entity)
+    sap_csrf_tokens.store(service, csrf_token, csrf_response.cookies)
+    return csrf_token, csrf_response.cookies
+
+async def post_odata_entity(entity: str, payload: dict, bypass_approval: bool = False, idempotency_key: str = "") -> func.HttpResponse:
     """Create entity in S/4HANA via OData POST with CSRF token
     
     Args:
         entity: The entity type to create
         payload: The data payload 
         bypass_approval: ONLY set to True by the approval handler after approval is granted
+        idempotency_key: Stable key for this create (e.g. approval request ID); with
+            SAP_REPEATABILITY_ENABLED it is sent as Repeatability-Request-ID and the POST is retried
     """
     url = ALL_ODATA_CREATE.get(entity)
     if not url:
@@ -959,8 +4453,8 @@ async def post_odata_entity(entity: str, payload: dict, bypass_approval: bool =
     
     # 🔒 SECURITY ENFORCEMENT: Block direct sales order creation unless approved
     if entity.lower() == "salesorders" and not bypass_approval:
-        logging.warning(f"[SECURITY BLOCK] Attempted direct sales order creation without approval - BLOCKED")
-        logging.warning(f"[SECURITY BLOCK] Payload: {json.dumps(payload)}")
+        sap_logger.warning("[SECURITY BLOCK] Attempted direct sales order creation without approval - BLOCKED")
+        sap_logger.warning("[SECURITY BLOCK] Payload: %s", LogPayload(payload))
         
         # Return security error
         security_error = {
@@ -989,67 +4483,717 @@ async def post_odata_entity(entity: str, payload: dict, bypass_approval: bool =
         return func.HttpResponse("Missing SAP_USER or SAP_PASS environment variables", status_code=500)
     
     try:
-        # Increase timeout to 60 seconds for S/4HANA operations
-        async with httpx.AsyncClient(timeout=60.0, verify=False) as client:
-            # Step 1: Get CSRF token with HEAD/GET request
-            logging.info(f"[CREATE] Fetching CSRF token for {entity}...")
-            csrf_response = await client.get(
-                url,
-                auth=(user, pwd),
-                headers={
-                    "X-CSRF-Token": "Fetch",
-                    "Accept": "application/json"
-                }
-            )
-            
-            # Extract CSRF token from response headers
-            csrf_token = csrf_response.headers.get("X-CSRF-Token", "")
-            cookies = csrf_response.cookies
-            
-            if not csrf_token:
-                return func.HttpResponse("Failed to fetch CSRF token from S/4HANA", status_code=500)
-            
-            logging.info(f"[CSRF] Got token: {csrf_token[:20]}... for {entity}")
-            
-            # Step 2: Create entity with CSRF token
-            logging.info(f"[CREATE] Posting to {entity} with payload: {json.dumps(payload)}")
-            r = await client.post(
-                url,
-                auth=(user, pwd),
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                    "X-CSRF-Token": csrf_token,
-                    "X-Requested-With": "XMLHttpRequest"
-                },
-                cookies=cookies,  # Include session cookies
-                json=payload
+        payload = await check_create_payload(entity, payload)
+    except PayloadValidationError as e:
+        sap_logger.warning("[CREATE] %s payload rejected before sending: %s", entity, e)
+        return e.to_response()
+    
+    service = sap_service_for_entity(entity)
+    try:
+        # Step 1: CSRF token and session cookies, reused per service while SAP accepts them
+        cached_csrf = sap_csrf_tokens.get(service)
+        record_cache_lookup("sap_csrf", cached_csrf is not None)
+        if cached_csrf:
+            csrf_token, cookies = cached_csrf
+        else:
+            csrf_token, cookies = await fetch_sap_csrf_token(service, entity, url, (user, pwd))
+        
+        if not csrf_token:
+            return func.HttpResponse("Failed to fetch CSRF token from S/4HANA", status_code=500)
+        
+        post_headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "X-Requested-With": "XMLHttpRequest"
+        }
+        # Writes are only retried when SAP can de-duplicate them
+        idempotent_post = SAP_REPEATABILITY_ENABLED and bool(idempotency_key)
+        if idempotent_post:
+            post_headers["Repeatability-Request-ID"] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{entity}/{idempotency_key}"))
+            post_headers["Repeatability-First-Sent"] = format_datetime(datetime.now(timezone.utc), usegmt=True)
+        
+        # Step 2: Create entity with CSRF token
+        post_started = time.monotonic()
+        post_timings = {}
+        sap_logger.info("[CREATE] Posting to %s", entity)
+        payload_logger.debug("[CREATE] %s payload: %s", entity, LogPayload(payload))
+        def post():
+            return sap_request_with_retry(
+                lambda: send_sap_request(
+                    service,
+                    "POST",
+                    url,
+                    entity=entity,
+                    timings=post_timings,
+                    auth=(user, pwd),
+                    headers={**post_headers, "X-CSRF-Token": csrf_token},
+                    cookies=cookies,  # Include session cookies
+                    json=payload,
+                    timeout=deadline_timeout(60.0, f"POST {entity}")
+                ),
+                operation=f"POST {entity}",
+                idempotent=idempotent_post
             )
-            
-            logging.info(f"[CREATE] S/4HANA responded with status: {r.status_code}")
+
+        with trace_span("sap.post", {"sap.entity": entity, "sap.idempotent": idempotent_post}) as span:
+            r = await post()
+            if r.status_code == 403 and r.headers.get("X-CSRF-Token", "").lower() == "required":
+                # SAP ended the session behind the reused token; nothing was created, so post once more
+                sap_csrf_tokens.invalidate(service)
+                if cached_csrf:
+                    sap_logger.info("[CSRF] Cached token for %s rejected, fetching a new one", service)
+                    csrf_token, cookies = await fetch_sap_csrf_token(service, entity, url, (user, pwd))
+                    if csrf_token:
+                        r = await post()
+            span.set_attribute("http.response.status_code", r.status_code)
+        slow_query_log.record(method="POST", entity=entity, query="", total_seconds=time.monotonic() - post_started,
+                              timings=post_timings, response_bytes=len(r.content), status=r.status_code)
+        
+        sap_logger.info("[CREATE] S/4HANA responded with status: %s", r.status_code)
         
         if r.status_code not in (200, 201):
-            logging.error(f"[S/4HANA CREATE ERROR {r.status_code}] {r.text}")
+            sap_logger.error("[S/4HANA CREATE ERROR %s] %s", r.status_code, LogPayload(r.text))
             return func.HttpResponse(r.text, status_code=r.status_code)
         
-        logging.info(f"[CREATE] Successfully created {entity}")
+        sap_logger.info("[CREATE] Successfully created %s", entity)
+        if entity in BP_ODATA_CREATE or entity in SO_ODATA_CREATE:
+            sap_read_cache.clear()
         return func.HttpResponse(r.text, mimetype="application/json", status_code=r.status_code)
         
+    except DeadlineExceeded:
+        raise
+    except SapDegradedError as e:
+        sap_logger.warning("[SAP DEGRADED] %s creation rejected: %s", entity, e)
+        return e.to_response()
     except httpx.ReadTimeout as e:
-        logging.error(f"[TIMEOUT] S/4HANA took >60s to respond for {entity} creation")
+        sap_logger.error("[TIMEOUT] S/4HANA took >60s to respond for %s creation", entity)
         return func.HttpResponse(f"S/4HANA timeout: The system took too long to process the {entity} creation request. This may indicate the entity type is not supported for creation in this S/4HANA system.", status_code=408)
     except httpx.RequestError as e:
-        logging.exception("[RequestError] S/4HANA OData unreachable")
+        sap_logger.exception("[RequestError] S/4HANA OData unreachable")
         return func.HttpResponse(f"S/4HANA connection error: {e}", status_code=500)
     except Exception as e:
-        logging.exception("[Exception] S/4HANA OData POST error")
+        sap_logger.exception("[Exception] S/4HANA OData POST error")
         return func.HttpResponse(f"S/4HANA creation error: {e}", status_code=500)
 
+# --- Delta sync (incremental reads by change timestamp or SAP delta link) ---
+# Key properties per entity set: synced rows are upserted and deleted by these
+DELTA_SYNC_KEYS = {
+    "businesspartners": ("BusinessPartner",),
+    "businesspartneraddresses": ("BusinessPartner", "AddressID"),
+    "businesspartnercontacts": ("RelationshipNumber", "BusinessPartnerCompany", "BusinessPartnerPerson", "ValidityEndDate"),
+    "customers": ("Customer",),
+    "suppliers": ("Supplier",),
+    "salesorders": ("SalesOrder",),
+    "salesorderitems": ("SalesOrder", "SalesOrderItem"),
+    "salesorderheaderpartners": ("SalesOrder", "PartnerFunction"),
+    "salesorderitempartners": ("SalesOrder", "SalesOrderItem", "PartnerFunction"),
+    "salesorderschedulelines": ("SalesOrder", "SalesOrderItem", "ScheduleLine"),
+    "salesordertexts": ("SalesOrder", "Language", "LongTextID"),
+    "salesorderitemtexts": ("SalesOrder", "SalesOrderItem", "Language", "LongTextID")
+}
+# Change timestamp per entity set: (property, "date" for day-precision Edm.DateTime or "datetimeoffset")
+DELTA_SYNC_CHANGE_FIELDS = {
+    "businesspartners": ("LastChangeDate", "date"),
+    "salesorders": ("LastChangeDateTime", "datetimeoffset")
+}
+_ODATA_KEY_PREDICATE = re.compile(r"\(([^()]*)\)$")
+_ODATA_TYPED_LITERAL = re.compile(r"^\w*'(.*)'$", re.S)
+
+def parse_odata_timestamp(value):
+    """UTC datetime of an Edm.DateTime/Edm.DateTimeOffset value (Atom text or JSON /Date(ms)/), or None"""
+    if not value:
+        return None
+    text = value.strip()
+    if text.startswith("/Date("):
+        return datetime.fromtimestamp(int(re.match(r"/Date\((-?\d+)", text).group(1)) / 1000, timezone.utc)
+    # SAP sends 0-7 fractional digits; fromisoformat wants exactly 3 or 6 before Python 3.11
+    text = re.sub(r"\.(\d+)", lambda m: "." + (m.group(1) + "00000")[:6], text.replace("Z", "+00:00"))
+    moment = datetime.fromisoformat(text)
+    return moment.astimezone(timezone.utc) if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def _odata_ref_key(ref: str, keys: tuple):
+    """Key tuple of an entry URI such as A_X('1') or A_X(SalesOrder='1',SalesOrderItem='10'), or None"""
+    match = _ODATA_KEY_PREDICATE.search(urllib.parse.unquote(ref or ""))
+    if not match:
+        return None
+    values = {}
+    for part in match.group(1).split(","):
+        name, _, literal = part.partition("=") if "=" in part else ("", "", part)
+        typed = _ODATA_TYPED_LITERAL.match(literal.strip())
+        values[name.strip() or keys[0]] = typed.group(1).replace("''", "'") if typed else literal.strip()
+    if not set(keys) <= set(values):
+        return None
+    return tuple(values[k] for k in keys)
+
+class BlobWatermarkStore:
+    """DeltaSync state as one JSON blob per sync name under DELTA_SYNC_BLOB_PREFIX (one writer per name)"""
+
+    def _blob_client(self, name: str):
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            raise RuntimeError("Blob storage is not configured for delta sync watermarks")
+        blob_name = f"{DELTA_SYNC_BLOB_PREFIX}{name}.json"
+        return blob_name, blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=blob_name)
+
+    def load(self, name: str) -> dict:
+        from azure.core.exceptions import ResourceNotFoundError
+        blob_name, blob_client = self._blob_client(name)
+        try:
+            with blob_operation("download", blob_name):
+                return json.loads(blob_client.download_blob(timeout=blob_timeout(f"load watermark {name}")).readall())
+        except ResourceNotFoundError:
+            return {}
+
+    def save(self, name: str, state: dict):
+        blob_name, blob_client = self._blob_client(name)
+        with blob_operation("upload", blob_name):
+            blob_client.upload_blob(json.dumps(state, indent=2), overwrite=True,
+                                    timeout=blob_timeout(f"save watermark {name}"))
+
+class DeltaSync:
+    """Incremental reader for one entity set that feeds a sink and keeps its watermark in a store
+
+    Entity sets in DELTA_SYNC_TOKEN_ENTITIES follow the SAP delta link of their previous read
+    (changed entries plus deleted-entry tombstones). The others re-read rows whose change
+    timestamp (DELTA_SYNC_CHANGE_FIELDS) is at or after the watermark minus
+    DELTA_SYNC_OVERLAP_SECONDS. The watermark is the newest timestamp SAP returned, so clock
+    skew between the Function and the gateway does not matter, and rows read twice are simply
+    upserted twice. Deletes leave no timestamp: every DELTA_SYNC_RECONCILE_SECONDS a key-only
+    scan finds sink keys SAP no longer has, and a direct read confirms them before they are
+    deleted. Without a watermark, or when SAP rejects the delta link, the sink is reset and
+    fully loaded.
+
+    A sink has async reset(), upsert(rows), delete(keys) and keys(); rows are m:properties
+    dicts as parse_odata_feed returns them, keys are tuples in DELTA_SYNC_KEYS order. A store
+    has load(name) -> dict and save(name, state), called in a worker thread; state is saved
+    only after the sink took every change, so a failed run is repeated from the old watermark.
+    """
+
+    def __init__(self, name: str, entity: str, store=None, page_size: int = DELTA_SYNC_PAGE_SIZE):
+        self.name = name
+        self.entity = entity
+        self.store = store or BlobWatermarkStore()
+        self.page_size = page_size
+        self.keys = DELTA_SYNC_KEYS.get(entity)
+        self.change_field = DELTA_SYNC_CHANGE_FIELDS.get(entity)
+        self.track_changes = entity in DELTA_SYNC_TOKEN_ENTITIES
+
+    @property
+    def supported(self) -> bool:
+        return self.keys is not None and (self.track_changes or self.change_field is not None)
+
+    def key_of(self, row: dict) -> tuple:
+        return tuple(_replica_value(row.get(f"d:{k}")) for k in self.keys)
+
+    async def run(self, sink) -> dict:
+        """Apply the changes since the stored watermark to the sink; returns counts and the mode used"""
+        if not self.supported:
+            raise ValueError(f"{self.entity} has neither a change timestamp nor a delta link to sync by")
+        state = await asyncio.to_thread(self.store.load, self.name) or {}
+        stats = {"mode": None, "upserts": 0, "deletes": 0}
+        if self.track_changes:
+            state = await self._follow_delta_link(sink, state, stats)
+        else:
+            state = await self._read_changes(sink, state, stats)
+        state["synced_at"] = time.time()
+        await asyncio.to_thread(self.store.save, self.name, state)
+        sap_logger.info("[DELTA SYNC] %s: %s", self.name, stats)
+        return stats
+
+    async def _read_changes(self, sink, state: dict, stats: dict) -> dict:
+        field, kind = self.change_field
+        watermark = parse_odata_timestamp(state.get("watermark"))
+        started_at = time.time()
+        if watermark is None:
+            stats["mode"] = "full"
+            await sink.reset()
+            query = ""
+        else:
+            stats["mode"] = "delta"
+            since = watermark - timedelta(seconds=DELTA_SYNC_OVERLAP_SECONDS)
+            if kind == "date":
+                # Day precision: the watermark's whole day is read again
+                literal = f"datetime'{since:%Y-%m-%d}T00:00:00'"
+            else:
+                literal = f"datetimeoffset'{since:%Y-%m-%dT%H:%M:%S}Z'"
+            # Newest first: a row changing mid-read moves to the front, so $skip windows repeat a row
+            # instead of skipping one; the moved row is newer than the watermark and read next time
+            query = f"$filter={field} ge {literal}&$orderby={field} desc"
+        newest = watermark
+        async for rows in iter_odata_pages(self.entity, self.page_size, query):
+            await sink.upsert(rows)
+            stats["upserts"] += len(rows)
+            for row in rows:
+                changed = parse_odata_timestamp(_replica_value(row.get(f"d:{field}")))
+                if changed is not None and (newest is None or changed > newest):
+                    newest = changed
+        if newest is not None:
+            state["watermark"] = newest.isoformat()
+        if watermark is None:
+            state["reconciled_at"] = started_at
+        elif started_at - state.get("reconciled_at", 0) >= DELTA_SYNC_RECONCILE_SECONDS:
+            stats["deletes"] = await self._reconcile(sink)
+            state["reconciled_at"] = started_at
+        return state
+
+    async def _reconcile(self, sink) -> int:
+        """Delete sink rows whose keys SAP no longer has"""
+        present = set()
+        key_list = ",".join(self.keys)
+        async for rows in iter_odata_pages(self.entity, self.page_size, f"$select={key_list}&$orderby={key_list}"):
+            present.update(self.key_of(row) for row in rows)
+        missing = sorted((await sink.keys()) - present, key=lambda key: tuple(value or "" for value in key))
+        deleted = set()
+        # A row deleted during the scan shifts later $skip windows; ask for each missing key directly
+        for start in range(0, len(missing), 20):
+            chunk = missing[start:start + 20]
+            clauses = [" and ".join(f"{k} eq '{(value or '').replace(chr(39), chr(39) * 2)}'" for k, value in zip(self.keys, key))
+                       for key in chunk]
+            query = f"$filter={' or '.join(f'({clause})' for clause in clauses)}&$select={key_list}"
+            found = set()
+            async for rows in iter_odata_pages(self.entity, len(chunk) + 1, query):
+                found.update(self.key_of(row) for row in rows)
+            deleted.update(key for key in chunk if key not in found)
+        if deleted:
+            await sink.delete(deleted)
+        return len(deleted)
+
+    async def _follow_delta_link(self, sink, state: dict, stats: dict) -> dict:
+        url, headers = state.get("delta_link"), None
+        if url:
+            stats["mode"] = "delta"
+        else:
+            stats["mode"] = "full"
+            await sink.reset()
+            url, headers = ALL_ODATA[self.entity], {"Prefer": "odata.track-changes"}
+        first_page, delta_link = True, None
+        while url:
+            try:
+                feed = await get_odata_feed(self.entity, url, headers)
+            except ODataFeedError as e:
+                if first_page and stats["mode"] == "delta" and e.status_code in (400, 404, 410):
+                    sap_logger.warning("[DELTA SYNC] %s: delta link rejected (HTTP %s), reloading", self.name, e.status_code)
+                    return await self._follow_delta_link(sink, {}, stats)
+                raise
+            first_page = False
+            rows = _feed_rows(feed)
+            if rows:
+                await sink.upsert(rows)
+                stats["upserts"] += len(rows)
+            tombstones = feed.get("at:deleted-entry", [])
+            if isinstance(tombstones, dict):
+                tombstones = [tombstones]
+            deleted = {key for key in (_odata_ref_key(t.get("@ref"), self.keys) for t in tombstones) if key}
+            if deleted:
+                await sink.delete(deleted)
+                stats["deletes"] += len(deleted)
+            delta_link = _feed_link(feed, "delta") or delta_link
+            url = _feed_link(feed, "next")
+        if not delta_link:
+            raise RuntimeError(f"{self.entity} returned no delta link; remove it from DELTA_SYNC_TOKEN_ENTITIES")
+        state["delta_link"] = delta_link
+        return state
+
+# --- Streaming aggregation (aggregate_s4hana: count/sum/min/max/avg with group-by) ---
+_AGGREGATE_MEASURE = re.compile(r"^(count|sum|min|max|avg)(?:\(\s*([A-Za-z_]\w*)?\s*\))?$")
+_AGGREGATE_GROUP = re.compile(r"^([A-Za-z_]\w*)(?::(year|quarter|month|day))?$")
+
+def _aggregate_number(value):
+    """Exact Decimal of an Edm.Decimal/Double/Int* value (SAP sends them as text), or None if not numeric"""
+    try:
+        number = decimal.Decimal(value)
+    except (decimal.InvalidOperation, TypeError, ValueError):
+        return None
+    return number if number.is_finite() else None
+
+def _aggregate_json(value):
+    """Decimals as plain strings (no exponent, no float rounding); everything else unchanged"""
+    return format(value, "f") if isinstance(value, decimal.Decimal) else value
+
+class StreamingAggregate:
+    """Group-by over rows fed page by page: memory grows with the number of groups, never with rows
+
+    group_by items are "Field" or "Field:year|quarter|month|day" (date fields are bucketed in UTC);
+    measures are "count", "count(Field)" (non-null values) and "sum|min|max|avg(Field)". Sums and
+    averages use decimal.Decimal, so Edm.Decimal amounts add up exactly; min and max compare numbers
+    numerically and anything else (dates, codes) as text.
+    """
+
+    def __init__(self, group_by: list, measures: list, max_groups: int = AGGREGATE_MAX_GROUPS):
+        self.group_by = []
+        for item in group_by:
+            match = _AGGREGATE_GROUP.match(str(item).strip())
+            if not match:
+                raise ODataQueryError(f"Invalid group_by item '{item}'; use Field or Field:year|quarter|month|day")
+            self.group_by.append((match.group(0), match.group(1), match.group(2)))
+        self.measures = []
+        for item in measures or ["count"]:
+            match = _AGGREGATE_MEASURE.match(str(item).strip().replace(" ", ""))
+            if not match or (match.group(1) != "count" and not match.group(2)):
+                raise ODataQueryError(f"Invalid measure '{item}'; use count, count(Field) or sum|min|max|avg(Field)")
+            op, field = match.groups()
+            self.measures.append((f"{op}({field})" if field else op, op, field))
+        if len({label for label, _, _ in self.group_by + self.measures}) < len(self.group_by) + len(self.measures):
+            raise ODataQueryError("group_by and measures must not repeat an item")
+        self.max_groups = max_groups
+        self.groups = {}
+        self.rows = 0
+
+    @property
+    def fields(self) -> list:
+        """Properties the aggregate reads, for $select"""
+        return sorted({field for _, field, _ in self.group_by} | {field for _, _, field in self.measures if field})
+
+    def _group_value(self, row: dict, field: str, bucket: str):
+        value = _replica_value(row.get(f"d:{field}"))
+        if value is None or not bucket:
+            return value
+        try:
+            moment = parse_odata_timestamp(value)
+        except ValueError:
+            raise ODataQueryError(f"group_by {field}:{bucket} needs a date field, got '{value}'") from None
+        if bucket == "year":
+            return f"{moment:%Y}"
+        if bucket == "quarter":
+            return f"{moment:%Y}-Q{(moment.month - 1) // 3 + 1}"
+        return f"{moment:%Y-%m}" if bucket == "month" else f"{moment:%Y-%m-%d}"
+
+    def add(self, rows: list):
+        for row in rows:
+            self.rows += 1
+            key = tuple(self._group_value(row, field, bucket) for _, field, bucket in self.group_by)
+            state = self.groups.get(key)
+            if state is None:
+                if len(self.groups) >= self.max_groups:
+                    raise ODataQueryError(f"More than {self.max_groups} groups; group by fewer or coarser fields "
+                                          f"or narrow the filter", code="TOO_MANY_GROUPS", max_groups=self.max_groups)
+                # Per measure: [non-null count, Decimal sum, min, max]
+                state = self.groups[key] = [[0, decimal.Decimal(0), None, None] for _ in self.measures]
+            for (_, op, field), acc in zip(self.measures, state):
+                if not field:
+                    acc[0] += 1
+                    continue
+                text = _replica_value(row.get(f"d:{field}"))
+                if text is None:
+                    continue
+                acc[0] += 1
+                number = _aggregate_number(text)
+                if op in ("sum", "avg"):
+                    if number is None:
+                        raise ODataQueryError(f"{op}({field}) needs a numeric field, got '{text}'", code="NOT_NUMERIC")
+                    acc[1] += number
+                elif op in ("min", "max"):
+                    value = number if number is not None else text
+                    current = acc[2 if op == "min" else 3]
+                    if current is not None and type(current) is not type(value):
+                        value, current = str(value), str(current)
+                    if current is None or (value < current if op == "min" else value > current):
+                        acc[2 if op == "min" else 3] = value
+
+    def _measure(self, op: str, acc: list):
+        count, total, low, high = acc
+        if op == "count":
+            return count
+        if op == "sum":
+            return total
+        if op == "avg":
+            return (total / count).quantize(decimal.Decimal("0.000001")).normalize() if count else None
+        return low if op == "min" else high
+
+    def results(self, order_by: str = "", top: int = 100) -> list:
+        """Groups as dicts of group_by and measure labels, sorted by order_by ("label [asc|desc]", default
+        the group_by labels), at most top of them"""
+        rows = []
+        for key, state in self.groups.items():
+            row = {label: value for (label, _, _), value in zip(self.group_by, key)}
+            row.update({label: self._measure(op, acc) for (label, op, _), acc in zip(self.measures, state)})
+            rows.append(row)
+        labels = [label for label, _, _ in self.group_by + self.measures]
+        sort_label, _, direction = (order_by or "").strip().rpartition(" ")
+        if direction.lower() not in ("asc", "desc"):
+            sort_label, direction = (order_by or "").strip(), ""
+        sort_label = sort_label.replace(" ", "")
+        if sort_label and sort_label not in labels:
+            raise ODataQueryError(f"order_by must name a group_by item or measure: {labels}")
+        sort_labels = [sort_label] if sort_label else [label for label, _, _ in self.group_by]
+        # Missing values sort first ascending and last descending
+        rows.sort(key=lambda row: [(row[label] is not None, row[label] if row[label] is not None else "")
+                                   for label in sort_labels],
+                  reverse=direction.lower() == "desc")
+        return [{label: _aggregate_json(value) for label, value in row.items()} for row in rows[:top]]
+
+async def aggregate_odata(entity: str, group_by: list, measures: list, filter_text: str = "",
+                          order_by: str = "", top: int = 100) -> dict:
+    """Stream every page of an entity set, restricted by filter_text and $select of the fields used,
+    through a StreamingAggregate and return only the aggregates; raises ODataQueryError, ODataFeedError
+    or SapDegradedError"""
+    aggregate = StreamingAggregate(group_by, measures)
+    canonical = render_odata_filter(parse_odata_filter(filter_text)) if filter_text.strip() else ""
+    # count alone still needs one property per row; the first key field is the smallest choice
+    fields = aggregate.fields or [DELTA_SYNC_KEYS[entity][0]]
+    query = "&".join(filter(None, [f"$filter={_encode_option_value(canonical)}" if canonical else "",
+                                   f"$select={','.join(fields)}"]))
+    async for rows in iter_odata_pages(entity, AGGREGATE_PAGE_SIZE, query):
+        aggregate.add(rows)
+        if aggregate.rows > AGGREGATE_MAX_ROWS:
+            raise ODataQueryError(f"More than {AGGREGATE_MAX_ROWS} rows match; narrow the filter",
+                                  code="TOO_MANY_ROWS", max_rows=AGGREGATE_MAX_ROWS)
+    return {
+        "entity": entity,
+        "filter": canonical or None,
+        "group_by": [label for label, _, _ in aggregate.group_by],
+        "measures": [label for label, _, _ in aggregate.measures],
+        "rows_scanned": aggregate.rows,
+        "groups": len(aggregate.groups),
+        "results": aggregate.results(order_by, top)
+    }
+
+# --- Bulk export (export_s4hana: NDJSON or Parquet streamed to a block blob in staged blocks) ---
+EXPORT_FORMATS = {"ndjson": ("ndjson", "application/x-ndjson"), "parquet": ("parquet", "application/vnd.apache.parquet")}
+_pyarrow_module = None
+
+def _get_pyarrow():
+    """Return the optional pyarrow module (Parquet exports), or None when it is not installed"""
+    global _pyarrow_module
+    if _pyarrow_module is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            _pyarrow_module = pyarrow
+        except ImportError:
+            _pyarrow_module = False
+    return _pyarrow_module or None
+
+def _plain_row(row: dict) -> dict:
+    """Atom m:properties as {Property: text or None}"""
+    return {name.partition(":")[2] or name: _replica_value(value) for name, value in row.items()
+            if not name.startswith("@")}
+
+class StagedBlobWriter:
+    """Write-only file object that uploads a block blob as it goes: write() buffers, drain() stages every
+    full EXPORT_BLOCK_BYTES block, commit() stages the rest and commits the block list. Nothing is visible
+    until commit(); the blocks of an abandoned upload are discarded by the service after a week."""
+
+    def __init__(self, blob_name: str, content_type: str, block_bytes: int = EXPORT_BLOCK_BYTES):
+        blob_service_client = get_blob_service_client()
+        if not blob_service_client:
+            raise RuntimeError("Blob storage is not configured for exports")
+        self.blob_name = blob_name
+        self.blob_client = blob_service_client.get_blob_client(container=EXPORT_CONTAINER_NAME, blob=blob_name)
+        self.content_type = content_type
+        self.block_bytes = block_bytes
+        self.block_ids = []
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+
+    # File protocol used by json writers and pyarrow (synchronous, memory only)
+    def write(self, data) -> int:
+        self._buffer += data
+        self.bytes_written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def _stage(self, data: bytes):
+        block_id = f"{len(self.block_ids):08d}"
+        with blob_operation("stage_block", self.blob_name, EXPORT_CONTAINER_NAME):
+            self.blob_client.stage_block(block_id, data, length=len(data), timeout=blob_timeout(f"stage {self.blob_name}"))
+        self.block_ids.append(block_id)
+
+    async def drain(self):
+        while len(self._buffer) >= self.block_bytes:
+            block = bytes(self._buffer[:self.block_bytes])
+            del self._buffer[:self.block_bytes]
+            await asyncio.to_thread(self._stage, block)
+
+    async def commit(self):
+        """Stage what is buffered and commit the blocks"""
+        from azure.storage.blob import BlobBlock, ContentSettings
+        if self._buffer:
+            block = bytes(self._buffer)
+            self._buffer.clear()
+            await asyncio.to_thread(self._stage, block)
+
+        def commit_blocks():
+            with blob_operation("commit_block_list", self.blob_name, EXPORT_CONTAINER_NAME):
+                self.blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self.block_ids],
+                                                   content_settings=ContentSettings(content_type=self.content_type),
+                                                   timeout=blob_timeout(f"commit {self.blob_name}"))
+
+        await asyncio.to_thread(commit_blocks)
+
+    def read_url(self, ttl: int = EXPORT_URL_TTL_SECONDS):
+        """(URL with a read-only SAS for this blob only, expiry), or (None, None) when ttl is 0 or the credential
+        cannot sign. Connection strings sign with the account key; managed identities with a user delegation
+        key, which needs the Storage Blob Delegator role (Storage Blob Data Contributor includes it)."""
+        if ttl <= 0:
+            return None, None
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+        now = datetime.now(timezone.utc)
+        start, expiry = now - timedelta(minutes=5), now + timedelta(seconds=ttl)  # start allows for clock skew
+        try:
+            account_key = getattr(self.blob_client.credential, "account_key", None)
+            if account_key:
+                signing_key = {"account_key": account_key}
+            else:
+                with blob_operation("get_user_delegation_key", container=EXPORT_CONTAINER_NAME):
+                    signing_key = {"user_delegation_key": get_blob_service_client().get_user_delegation_key(
+                        start, expiry, timeout=blob_timeout("user delegation key"))}
+            sas = generate_blob_sas(self.blob_client.account_name, EXPORT_CONTAINER_NAME, self.blob_name,
+                                    permission=BlobSasPermissions(read=True), start=start, expiry=expiry, **signing_key)
+        except Exception as e:
+            blob_logger.warning("[EXPORT] No read URL for %s, returning the blob name only: %s", self.blob_name, e)
+            return None, None
+        return f"{self.blob_client.url}?{sas}", expiry.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+async def export_odata(entity: str, export_format: str = "ndjson", filter_text: str = "", select: list = None) -> dict:
+    """Page through an entity set and write each page straight into staged blocks of a new blob in
+    EXPORT_CONTAINER_NAME under EXPORT_BLOB_PREFIX; at most one SAP page and one block are held in memory.
+    Parquet writes one row group per page with string columns (values as SAP sends them). Raises
+    ODataQueryError, ODataFeedError or SapDegradedError; a failed export leaves no blob."""
+    if export_format not in EXPORT_FORMATS:
+        raise ODataQueryError(f"format must be one of {list(EXPORT_FORMATS)}, got '{export_format}'")
+    pyarrow = _get_pyarrow() if export_format == "parquet" else None
+    if export_format == "parquet" and pyarrow is None:
+        raise ODataQueryError("Parquet exports need pyarrow, which is not installed; use format ndjson",
+                              code="FORMAT_UNAVAILABLE")
+    canonical = render_odata_filter(parse_odata_filter(filter_text)) if filter_text.strip() else ""
+    fields = sorted(set(_odata_paths(",".join(select or []), "select")))
+    query = "&".join(filter(None, [f"$filter={_encode_option_value(canonical)}" if canonical else "",
+                                   f"$select={','.join(fields)}" if fields else ""]))
+
+    extension, content_type = EXPORT_FORMATS[export_format]
+    blob_name = f"{EXPORT_BLOB_PREFIX}{entity}/{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}.{extension}"
+    writer = StagedBlobWriter(blob_name, content_type)
+    started = time.monotonic()
+    rows = pages = 0
+    parquet_writer = schema = None
+    async for page in iter_odata_pages(entity, EXPORT_PAGE_SIZE, query):
+        page = [_plain_row(row) for row in page]
+        if rows + len(page) > EXPORT_MAX_ROWS:
+            raise ODataQueryError(f"More than {EXPORT_MAX_ROWS} rows match; narrow the filter or export in parts",
+                                  code="TOO_MANY_ROWS", max_rows=EXPORT_MAX_ROWS)
+        if export_format == "ndjson":
+            writer.write("".join(json.dumps(row) + "\n" for row in page).encode())
+        else:
+            if parquet_writer is None:
+                # Columns of the first page; an entity set's properties do not change between pages
+                columns = fields or list(dict.fromkeys(name for row in page for name in row))
+                schema = pyarrow.schema([(name, pyarrow.string()) for name in columns])
+                parquet_writer = pyarrow.parquet.ParquetWriter(writer, schema, compression="snappy")
+            parquet_writer.write_table(pyarrow.Table.from_pydict(
+                {name: [row.get(name) for row in page] for name in schema.names}, schema=schema))
+        rows += len(page)
+        pages += 1
+        await writer.drain()
+    if export_format == "parquet":
+        if parquet_writer is None:
+            columns = fields or list(DELTA_SYNC_KEYS[entity])
+            parquet_writer = pyarrow.parquet.ParquetWriter(
+                writer, pyarrow.schema([(name, pyarrow.string()) for name in columns]), compression="snappy")
+        parquet_writer.close()
+    await writer.commit()
+    url, url_expires = await asyncio.to_thread(writer.read_url)
+    blob_logger.info("[EXPORT] %s: %s rows in %s pages, %s bytes to %s", entity, rows, pages, writer.bytes_written, blob_name)
+    return {
+        "entity": entity,
+        "format": export_format,
+        "filter": canonical or None,
+        "rows": rows,
+        "pages": pages,
+        "bytes": writer.bytes_written,
+        "blocks": len(writer.block_ids),
+        "container": EXPORT_CONTAINER_NAME,
+        "blob_name": blob_name,
+        "url": url,
+        "url_expires": url_expires,
+        "seconds": round(time.monotonic() - started, 3)
+    }
+
+# --- Warm-keeping timer (WARMUP_ENABLED) ---
+# One creatable entity per service: its CSRF fetch is the same request a create starts with
+WARMUP_CSRF_TARGETS = {
+    SAP_SERVICE_BP: ("businesspartneraddresses", BP_ODATA_CREATE["businesspartneraddresses"]),
+    SAP_SERVICE_SO: ("salesorders", SO_ODATA_CREATE["salesorders"])
+}
+
+async def _warmup_step(coro) -> str:
+    started = time.monotonic()
+    try:
+        await run_with_deadline(coro, "warm-up")
+    except DeadlineExceeded:
+        return "skipped: budget exhausted"
+    except Exception as e:
+        return f"error: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+    return f"ok in {(time.monotonic() - started) * 1000:.0f} ms"
+
+async def run_warmup() -> dict:
+    """One warm-keeping pass within WARMUP_BUDGET_SECONDS and WARMUP_MAX_SAP_CALLS; returns the outcome per step"""
+    report = {}
+    sap_calls = 0
+    auth = (os.getenv("SAP_USER"), os.getenv("SAP_PASS"))
+    with request_deadline(WARMUP_BUDGET_SECONDS):
+        # Pooled connection (TLS) and CSRF token per idle, healthy service
+        for service, (entity, url) in WARMUP_CSRF_TARGETS.items():
+            breaker = sap_circuit_breakers[service]
+            limiter = sap_concurrency_limiters[service]
+            step = f"sap_csrf_{service}"
+            if breaker.state != "closed":
+                report[step] = f"skipped: circuit {breaker.state}"
+            elif limiter.in_flight or time.monotonic() - limiter.last_used < WARMUP_SKIP_IF_USED_SECONDS:
+                report[step] = "skipped: in use"
+            elif sap_calls >= WARMUP_MAX_SAP_CALLS:
+                report[step] = "skipped: call budget"
+            else:
+                sap_calls += 1
+                report[step] = await _warmup_step(fetch_sap_csrf_token(service, entity, url, auth))
+
+        # Storage token (managed identity) and blob connection
+        if _blob_credential is not None:
+            report["storage_token"] = await _warmup_step(
+                asyncio.to_thread(_blob_credential.get_token, "https://storage.azure.com/.default"))
+        report["blob_connection"] = await _warmup_step(_probe_blob_container())
+
+        # Re-read the most requested Business Partner queries before they expire
+        refreshed = failed = 0
+        for entity, query in sap_read_cache.hot_entries(WARMUP_MAX_SAP_CALLS - sap_calls):
+            if sap_circuit_breakers[sap_service_for_entity(entity)].state != "closed" or (deadline_remaining() or 0) <= 0:
+                break
+            sap_calls += 1
+            try:
+                resp = await fetch_odata_response(entity, query, use_cache=False)
+            except DeadlineExceeded:
+                break
+            if resp.status_code == 200:
+                refreshed += 1
+            else:
+                failed += 1
+        report["hot_reads"] = f"{refreshed} refreshed, {failed} failed"
+    report["sap_calls"] = sap_calls
+    return report
+
+if WARMUP_ENABLED:
+    @app.timer_trigger(schedule=WARMUP_SCHEDULE, arg_name="timer", run_on_startup=False, use_monitor=False)
+    async def warm_keeper(timer: func.TimerRequest) -> None:
+        """Keep this worker's SAP connections, tokens and hot reads warm between agent calls"""
+        started = time.monotonic()
+        report = await run_warmup()
+        sap_logger.info("[WARMUP] Done in %.2fs: %s", time.monotonic() - started, report)
+
 # --- MCP PROTOCOL ENDPOINTS ONLY ---
 # This is a pure MCP server implementation for both GitHub Copilot and Copilot Studio
 
 # --- HEALTH CHECK ENDPOINT ---
 @app.route(route="health", methods=["GET"])
+@instrumented_route("health")
 async def health_check(req: func.HttpRequest) -> func.HttpResponse:
     """Health check endpoint for monitoring"""
     try:
@@ -1074,7 +5218,21 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
         else:
             health_status["sap_config"] = "missing_credentials"
             health_status["status"] = "degraded"
-        
+
+        # Circuit breaker / concurrency limiter state per SAP service
+        health_status["sap_backend"] = get_sap_backend_status()
+        if any(s["state"] == "open" for s in health_status["sap_backend"].values()):
+            health_status["status"] = "degraded"
+
+        # Cached SAP/blob probe results; a stale cache is refreshed in the background
+        health_probes.ensure_fresh()
+        health_status["dependencies"] = health_probes.snapshot()
+        if any(p["status"] != "ok" for p in health_status["dependencies"]["results"].values()):
+            health_status["status"] = "degraded"
+        if bp_replica is not None:
+            # Informational: a stale replica only means reads go to SAP
+            health_status["bp_replica"] = bp_replica.snapshot()
+
         status_code = 200 if health_status["status"] == "healthy" else 503
         response = func.HttpResponse(json.dumps(health_status), 
                                    mimetype="application/json", 
@@ -1082,7 +5240,7 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
         return add_cors_headers(response)
         
     except Exception as e:
-        logging.exception("[Error] Health check failed")
+        http_logger.exception("[Error] Health check failed")
         error_response = {
             "status": "unhealthy",
             "error": str(e),
@@ -1093,8 +5251,31 @@ async def health_check(req: func.HttpRequest) -> func.HttpResponse:
                                    status_code=503)
         return add_cors_headers(response)
 
+# --- METRICS ENDPOINT ---
+@app.route(route="metrics", methods=["GET"])
+async def metrics_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """Prometheus text exposition of this worker's in-process metrics"""
+    return compress_response(req, func.HttpResponse(
+        render_metrics(),
+        mimetype="text/plain",
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    ))
+
+# --- DIAGNOSTICS ENDPOINTS ---
+@app.route(route="diagnostics/slow-queries", methods=["GET"], auth_level=func.AuthLevel.ADMIN)
+@instrumented_route("diagnostics/slow-queries")
+async def slow_queries_report(req: func.HttpRequest) -> func.HttpResponse:
+    """Top-N slowest SAP calls and most frequent / slowest query shapes on this worker (master key required)"""
+    try:
+        top = min(max(int(req.params.get("top", "10")), 1), 100)
+    except ValueError:
+        top = 10
+    response = func.HttpResponse(json.dumps(slow_query_log.report(top), indent=2), mimetype="application/json")
+    return compress_response(req, response)
+
 # --- COPILOT STUDIO SPECIFIC ENDPOINTS ---
 @app.route(route="query-sales-orders", methods=["POST", "OPTIONS"])
+@instrumented_route("query-sales-orders")
 async def query_sales_orders_copilot(req: func.HttpRequest) -> func.HttpResponse:
     """Copilot Studio compatible endpoint for querying sales orders"""
     
@@ -1109,15 +5290,17 @@ async def query_sales_orders_copilot(req: func.HttpRequest) -> func.HttpResponse
         order_by = body.get("orderBy", "TotalNetAmount desc")
         
         # Build OData query
-        query_params = f"$top={top}&$orderby={order_by}"
+        options = {"$top": top, "$orderby": order_by}
         if customer:
-            query_params += f"&$filter=SoldToParty eq '{customer}'"
+            options["$filter"] = f"SoldToParty eq {odata_string_literal(customer)}"
+        query_params, _ = prepare_odata_query("salesorders", urllib.parse.urlencode(options, quote_via=urllib.parse.quote))
         
-        # Use existing fetch function
-        resp = await fetch_odata_response("salesorders", query_params)
+        # Use existing fetch function, bounded by the request deadline
+        with request_deadline(request_budget_seconds(req)):
+            resp = await run_with_deadline(fetch_odata_response("salesorders", query_params), "query salesorders")
         
         if resp.status_code == 200:
-            return add_cors_headers(resp)
+            return add_cors_headers(compress_response(req, resp))
         else:
             error_response = func.HttpResponse(
                 json.dumps({"error": f"Failed to query sales orders: {resp.get_body().decode()}"}),
@@ -1126,8 +5309,10 @@ async def query_sales_orders_copilot(req: func.HttpRequest) -> func.HttpResponse
             )
             return add_cors_headers(error_response)
             
+    except (DeadlineExceeded, ODataQueryError) as e:
+        return add_cors_headers(e.to_response())
     except Exception as e:
-        logging.exception("[Error] Query sales orders failed")
+        http_logger.exception("[Error] Query sales orders failed")
         error_response = func.HttpResponse(
             json.dumps({"error": f"Internal error: {str(e)}"}),
             mimetype="application/json",
@@ -1136,6 +5321,7 @@ async def query_sales_orders_copilot(req: func.HttpRequest) -> func.HttpResponse
         return add_cors_headers(error_response)
 
 @app.route(route="query-business-partners", methods=["POST", "OPTIONS"])
+@instrumented_route("query-business-partners")
 async def query_business_partners_copilot(req: func.HttpRequest) -> func.HttpResponse:
     """Copilot Studio compatible endpoint for querying business partners"""
     
@@ -1149,15 +5335,17 @@ async def query_business_partners_copilot(req: func.HttpRequest) -> func.HttpRes
         top = body.get("top", 10)
         
         # Build OData query
-        query_params = f"$top={top}"
+        options = {"$top": top}
         if filter_expr:
-            query_params += f"&$filter={filter_expr}"
+            options["$filter"] = filter_expr
+        query_params, _ = prepare_odata_query("businesspartners", urllib.parse.urlencode(options, quote_via=urllib.parse.quote))
         
-        # Use existing fetch function
-        resp = await fetch_odata_response("businesspartners", query_params)
+        # Use existing fetch function, bounded by the request deadline
+        with request_deadline(request_budget_seconds(req)):
+            resp = await run_with_deadline(fetch_odata_response("businesspartners", query_params), "query businesspartners")
         
         if resp.status_code == 200:
-            return add_cors_headers(resp)
+            return add_cors_headers(compress_response(req, resp))
         else:
             error_response = func.HttpResponse(
                 json.dumps({"error": f"Failed to query business partners: {resp.get_body().decode()}"}),
@@ -1166,8 +5354,10 @@ async def query_business_partners_copilot(req: func.HttpRequest) -> func.HttpRes
             )
             return add_cors_headers(error_response)
             
+    except (DeadlineExceeded, ODataQueryError) as e:
+        return add_cors_headers(e.to_response())
     except Exception as e:
-        logging.exception("[Error] Query business partners failed")
+        http_logger.exception("[Error] Query business partners failed")
         error_response = func.HttpResponse(
             json.dumps({"error": f"Internal error: {str(e)}"}),
             mimetype="application/json",
@@ -1176,6 +5366,7 @@ async def query_business_partners_copilot(req: func.HttpRequest) -> func.HttpRes
         return add_cors_headers(error_response)
 
 @app.route(route="create-sales-order", methods=["POST", "OPTIONS"])
+@instrumented_route("create-sales-order")
 async def create_sales_order_copilot(req: func.HttpRequest) -> func.HttpResponse:
     """Copilot Studio compatible endpoint for creating sales orders - ENFORCES APPROVAL WORKFLOW"""
     
@@ -1207,10 +5398,10 @@ async def create_sales_order_copilot(req: func.HttpRequest) -> func.HttpResponse
         }
         
         # 🔒 SECURITY: ALWAYS go through approval workflow for sales orders
-        logging.info("[SECURITY ENFORCEMENT] Copilot Studio sales order creation - routing through approval workflow")
+        http_logger.info("[SECURITY ENFORCEMENT] Copilot Studio sales order creation - routing through approval workflow")
         
         # Generate unique request ID
-        request_id = f"SO-REQ-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+        request_id = new_approval_request_id()
         
         # Store approval request in Azure Blob Storage
         approval_request_data = {
@@ -1291,7 +5482,7 @@ async def create_sales_order_copilot(req: func.HttpRequest) -> func.HttpResponse
         return add_cors_headers(response)
             
     except Exception as e:
-        logging.exception("[Error] Create sales order failed")
+        http_logger.exception("[Error] Create sales order failed")
         error_response = func.HttpResponse(
             json.dumps({"error": f"Internal error: {str(e)}"}),
             mimetype="application/json",
@@ -1306,53 +5497,127 @@ async def create_sales_order_copilot(req: func.HttpRequest) -> func.HttpResponse
 # In-memory storage for approval requests (use Azure Storage or Database in production)
 approval_requests = {}
 
-def clean_sap_payload(payload: dict) -> dict:
-    """Remove custom fields that are not recognized by SAP S/4HANA OData APIs and format data properly"""
+def new_approval_request_id() -> str:
+    """Unique approval request ID; the timestamp prefix keeps blobs listed in creation order"""
+    return f"SO-REQ-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8].upper()}"
+
+def approval_conflict_response(req: func.HttpRequest, request_id: str, status: str) -> func.HttpResponse:
+    """409 for a decision on a request that is no longer pending"""
+    if req.method == "GET":
+        html_response = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Sales Order Request Already Processed</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 40px; }}
+                .error {{ color: #d73502; }}
+                .container {{ max-width: 600px; margin: 0 auto; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <h2>⚠️ Already Processed</h2>
+                <p class="error">Request ID '{request_id}' has already been {status}.</p>
+                <p>No further action was taken. You can close this window.</p>
+            </div>
+        </body>
+        </html>
+        """
+        return add_cors_headers(func.HttpResponse(html_response, mimetype="text/html", status_code=409))
+    return add_cors_headers(func.HttpResponse(
+        json.dumps({"error": "ALREADY_PROCESSED", "request_id": request_id, "status": status}),
+        mimetype="application/json",
+        status_code=409
+    ))
+
+async def decide_approval_request(req: func.HttpRequest, request_id: str, approval_data: dict, decision: dict):
+    """Move a pending request to `decision["status"]` in memory and blob storage
+
+    Returns a 409 response if it was already decided here or on another instance, else None.
+    """
+    if approval_data.get("status") != "pending":
+        return approval_conflict_response(req, request_id, approval_data.get("status"))
+
+    # Claim in memory before the first await so this worker cannot decide twice
+    approval_data.update(decision)
+    approval_requests[request_id] = approval_data
+
+    # The ETag-checked write stops another instance from deciding the same request
+    outcome = await transition_approval_request_in_blob(request_id, "pending", decision)
+    if outcome != "conflict":
+        return None
+    stored = await get_approval_request_from_blob(request_id)
+    if stored:
+        approval_requests[request_id] = stored
+    return approval_conflict_response(req, request_id, stored.get("status", "processed") if stored else "processed")
+
+async def reopen_approval_request(request_id: str, approval_data: dict, error: str):
+    """Return an approved request to pending after S/4HANA refused the create, so it can be approved again"""
+    reopened = {"status": "pending", "approved_at": None, "approver_comments": None, "last_error": error[:500]}
+    approval_data.update(reopened)
+    await transition_approval_request_in_blob(request_id, "approved", reopened)
+
+# clean_sap_payload fallback while no $metadata is loaded: A_SalesOrder header fields and its date fields
+SALES_ORDER_FIELDS = frozenset({
+    'SalesOrder', 'SalesOrderType', 'SalesOrganization', 'DistributionChannel', 
+    'OrganizationDivision', 'SalesGroup', 'SalesOffice', 'SalesDistrict',
+    'SoldToParty', 'CreationDate', 'CreatedByUser', 'LastChangeDate',
+    'SenderBusinessSystemName', 'ExternalDocumentID', 'LastChangeDateTime',
+    'ExternalDocLastChangeDateTime', 'PurchaseOrderByCustomer', 
+    'PurchaseOrderByShipToParty', 'CustomerPurchaseOrderType',
+    'CustomerPurchaseOrderDate', 'SalesOrderDate', 'TotalNetAmount',
+    'OverallDeliveryStatus', 'TotalBlockStatus', 'OverallOrdReltdBillgStatus',
+    'OverallSDDocReferenceStatus', 'TransactionCurrency', 'SDDocumentReason',
+    'PricingDate', 'PriceDetnExchangeRate', 'BillingPlan', 'RequestedDeliveryDate',
+    'ShippingCondition', 'CompleteDeliveryIsDefined', 'ShippingType',
+    'HeaderBillingBlockReason', 'DeliveryBlockReason', 'DeliveryDateTypeRule',
+    'IncotermsClassification', 'IncotermsTransferLocation', 'IncotermsLocation1',
+    'IncotermsLocation2', 'IncotermsVersion', 'CustomerPriceGroup',
+    'PriceListType', 'CustomerPaymentTerms', 'PaymentMethod', 'FixedValueDate',
+    'AssignmentReference', 'ReferenceSDDocument', 'ReferenceSDDocumentCategory',
+    'AccountingDocExternalReference', 'CustomerAccountAssignmentGroup',
+    'AccountingExchangeRate', 'CorrespncExternalReference',
+    'POCorrespncExternalReference', 'CustomerConditionGroup1', 'CustomerConditionGroup2',
+    'CustomerConditionGroup3', 'CustomerConditionGroup4', 'CustomerConditionGroup5',
+    'CustomerGroup', 'AdditionalCustomerGroup1', 'AdditionalCustomerGroup2',
+    'AdditionalCustomerGroup3', 'AdditionalCustomerGroup4', 'AdditionalCustomerGroup5',
+    'SlsDocIsRlvtForProofOfDeliv', 'CustomerTaxClassification1', 'CustomerTaxClassification2',
+    'CustomerTaxClassification3', 'CustomerTaxClassification4', 'CustomerTaxClassification5',
+    'CustomerTaxClassification6', 'CustomerTaxClassification7', 'CustomerTaxClassification8',
+    'CustomerTaxClassification9', 'TaxDepartureCountry', 'VATRegistrationCountry',
+    'SalesOrderApprovalReason', 'SalesDocApprovalStatus', 'OverallSDProcessStatus',
+    'TotalCreditCheckStatus', 'OverallTotalDeliveryStatus', 'OverallSDDocumentRejectionSts',
+    'BillingDocumentDate', 'ContractAccount', 'AdditionalValueDays',
+    'CustomerPurchaseOrderSuplmnt', 'ServicesRenderedDate'
+    })
+SALES_ORDER_DATE_FIELDS = frozenset({
+    'RequestedDeliveryDate', 'SalesOrderDate', 'CustomerPurchaseOrderDate', 
+    'PricingDate', 'CreationDate', 'LastChangeDate', 'BillingDocumentDate',
+    'FixedValueDate', 'ServicesRenderedDate'
+    })
+
+def clean_sap_payload(payload: dict, entity: str = "salesorders") -> dict:
+    """Remove custom fields that are not recognized by SAP S/4HANA OData APIs and format data properly
+
+    With the entity's $metadata loaded (sap_metadata), its properties and deep-insert navigation
+    properties are kept and converted; otherwise the built-in A_SalesOrder field list applies.
+    """
     from datetime import datetime
     
-    # List of known valid SAP S/4HANA Sales Order fields
-    valid_sap_fields = {
-        'SalesOrder', 'SalesOrderType', 'SalesOrganization', 'DistributionChannel', 
-        'OrganizationDivision', 'SalesGroup', 'SalesOffice', 'SalesDistrict',
-        'SoldToParty', 'CreationDate', 'CreatedByUser', 'LastChangeDate',
-        'SenderBusinessSystemName', 'ExternalDocumentID', 'LastChangeDateTime',
-        'ExternalDocLastChangeDateTime', 'PurchaseOrderByCustomer', 
-        'PurchaseOrderByShipToParty', 'CustomerPurchaseOrderType',
-        'CustomerPurchaseOrderDate', 'SalesOrderDate', 'TotalNetAmount',
-        'OverallDeliveryStatus', 'TotalBlockStatus', 'OverallOrdReltdBillgStatus',
-        'OverallSDDocReferenceStatus', 'TransactionCurrency', 'SDDocumentReason',
-        'PricingDate', 'PriceDetnExchangeRate', 'BillingPlan', 'RequestedDeliveryDate',
-        'ShippingCondition', 'CompleteDeliveryIsDefined', 'ShippingType',
-        'HeaderBillingBlockReason', 'DeliveryBlockReason', 'DeliveryDateTypeRule',
-        'IncotermsClassification', 'IncotermsTransferLocation', 'IncotermsLocation1',
-        'IncotermsLocation2', 'IncotermsVersion', 'CustomerPriceGroup',
-        'PriceListType', 'CustomerPaymentTerms', 'PaymentMethod', 'FixedValueDate',
-        'AssignmentReference', 'ReferenceSDDocument', 'ReferenceSDDocumentCategory',
-        'AccountingDocExternalReference', 'CustomerAccountAssignmentGroup',
-        'AccountingExchangeRate', 'CorrespncExternalReference',
-        'POCorrespncExternalReference', 'CustomerConditionGroup1', 'CustomerConditionGroup2',
-        'CustomerConditionGroup3', 'CustomerConditionGroup4', 'CustomerConditionGroup5',
-        'CustomerGroup', 'AdditionalCustomerGroup1', 'AdditionalCustomerGroup2',
-        'AdditionalCustomerGroup3', 'AdditionalCustomerGroup4', 'AdditionalCustomerGroup5',
-        'SlsDocIsRlvtForProofOfDeliv', 'CustomerTaxClassification1', 'CustomerTaxClassification2',
-        'CustomerTaxClassification3', 'CustomerTaxClassification4', 'CustomerTaxClassification5',
-        'CustomerTaxClassification6', 'CustomerTaxClassification7', 'CustomerTaxClassification8',
-        'CustomerTaxClassification9', 'TaxDepartureCountry', 'VATRegistrationCountry',
-        'SalesOrderApprovalReason', 'SalesDocApprovalStatus', 'OverallSDProcessStatus',
-        'TotalCreditCheckStatus', 'OverallTotalDeliveryStatus', 'OverallSDDocumentRejectionSts',
-        'BillingDocumentDate', 'ContractAccount', 'AdditionalValueDays',
-        'CustomerPurchaseOrderSuplmnt', 'ServicesRenderedDate'
-    }
-    
-    # Date fields that need special formatting for S/4HANA OData
-    date_fields = {
-        'RequestedDeliveryDate', 'SalesOrderDate', 'CustomerPurchaseOrderDate', 
-        'PricingDate', 'CreationDate', 'LastChangeDate', 'BillingDocumentDate',
-        'FixedValueDate', 'ServicesRenderedDate'
-    }
+    schema = sap_metadata.cached(entity)
+    if schema is not None:
+        allowed = schema.properties.keys() | schema.navigation.keys()
+        removed_fields = [key for key in payload if key not in allowed]
+        if removed_fields:
+            payload_logger.info("[PAYLOAD CLEANUP] Removed %s custom fields: %s", len(removed_fields), removed_fields)
+        return schema.convert({key: value for key, value in payload.items() if key in allowed})
+    valid_sap_fields = SALES_ORDER_FIELDS
+    date_fields = SALES_ORDER_DATE_FIELDS
     
     # Create clean payload with only valid SAP fields and proper formatting
     clean_payload = {}
+    removed_fields = []
     for key, value in payload.items():
         if key in valid_sap_fields:
             # Special handling for date fields
@@ -1367,43 +5632,43 @@ def clean_sap_payload(payload: dict) -> dict:
                                 # Convert to S/4HANA OData date format: /Date(timestamp)/
                                 timestamp_ms = int(parsed_date.timestamp() * 1000)
                                 clean_payload[key] = f"/Date({timestamp_ms})/"
-                                logging.info(f"[DATE FORMAT] Converted {key}: {value} -> /Date({timestamp_ms})/")
                                 break
                             except ValueError:
                                 continue
                         else:
                             # If no format matched, try to keep original value
                             clean_payload[key] = value
-                            logging.warning(f"[DATE FORMAT] Could not parse date {key}: {value}, keeping original")
+                            payload_logger.warning("[DATE FORMAT] Could not parse date %s: %s, keeping original", key, value)
                     else:
                         clean_payload[key] = value
                 except Exception as e:
-                    logging.warning(f"[DATE FORMAT ERROR] Failed to format {key}: {value}, error: {e}")
+                    payload_logger.warning("[DATE FORMAT ERROR] Failed to format %s: %s, error: %s", key, value, e)
                     clean_payload[key] = value
             else:
                 clean_payload[key] = value
         else:
-            logging.info(f"[PAYLOAD CLEANUP] Removing custom field: {key} = {value}")
+            removed_fields.append(key)
     
+    if removed_fields:
+        payload_logger.info("[PAYLOAD CLEANUP] Removed %s custom fields: %s", len(removed_fields), removed_fields)
     return clean_payload
 
+@traced("notify.email")
 def send_notification(to_email: str, subject: str, message: str) -> bool:
     """Send email notification (mock implementation for testing)"""
     try:
-        logging.info(f"📧 EMAIL NOTIFICATION SENT")
-        logging.info(f"To: {to_email}")
-        logging.info(f"Subject: {subject}")
-        logging.info(f"Message: {message}")
-        logging.info(f"🔔 POPUP NOTIFICATION: {subject}")
+        notify_logger.info("📧 EMAIL NOTIFICATION SENT - Subject: %s", subject)
+        payload_logger.debug("[EMAIL] To: %s, Message: %s", LogPayload(to_email), LogPayload(message))
         
         # TODO: Integrate with actual email service (SendGrid, Outlook, etc.)
         # For testing, we'll just log the notification
         
         return True
     except Exception as e:
-        logging.error(f"Failed to send notification: {str(e)}")
+        notify_logger.error("Failed to send notification: %s", e)
         return False
 
+@traced("notify.teams")
 def send_teams_notification(webhook_url: str, request_data: dict) -> bool:
     """Send Teams notification using Power Automate webhook"""
     try:
@@ -1428,32 +5693,33 @@ def send_teams_notification(webhook_url: str, request_data: dict) -> bool:
             }
             
             # Send to Teams
+            import requests
             response = requests.post(
                 webhook_url,
                 json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=10
+                headers=inject_trace_headers({"Content-Type": "application/json"}),
+                timeout=deadline_timeout(TEAMS_WEBHOOK_TIMEOUT_SECONDS, "teams webhook")
             )
             
             if response.status_code == 202:  # Power Automate returns 202 Accepted
-                logging.info(f"� REAL TEAMS NOTIFICATION SENT to SalesOrderAgent channel")
-                logging.info(f"Response: {response.text}")
+                notify_logger.info("� REAL TEAMS NOTIFICATION SENT to SalesOrderAgent channel")
+                payload_logger.debug("[TEAMS] Response: %s", LogPayload(response.text))
                 return True
             else:
-                logging.error(f"Teams webhook failed: {response.status_code} - {response.text}")
+                notify_logger.error("Teams webhook failed: %s - %s", response.status_code, LogPayload(response.text))
                 return False
         else:
             # Fallback to mock for testing
-            logging.info(f"📱 TEAMS NOTIFICATION SENT (Mock)")
-            logging.info(f"Request Data: {request_data}")
-            logging.info(f"🔔 POPUP NOTIFICATION: Sales Order Approval Request")
+            notify_logger.info("📱 TEAMS NOTIFICATION SENT (Mock)")
+            payload_logger.debug("[TEAMS] Request Data: %s", LogPayload(request_data))
             return True
             
     except Exception as e:
-        logging.error(f"Failed to send Teams notification: {str(e)}")
+        notify_logger.error("Failed to send Teams notification: %s", e)
         return False
 
 @app.route(route="create-so-request", methods=["POST", "OPTIONS"])
+@instrumented_route("create-so-request")
 async def create_so_request(req: func.HttpRequest) -> func.HttpResponse:
     """Create a sales order request that requires approval"""
     
@@ -1463,9 +5729,13 @@ async def create_so_request(req: func.HttpRequest) -> func.HttpResponse:
     
     try:
         body = req.get_json() or {}
+        try:
+            await check_create_payload("salesorders", clean_sap_payload(body.get("sales_order_data", {})))
+        except PayloadValidationError as e:
+            return add_cors_headers(e.to_response())
         
         # Generate unique request ID
-        request_id = f"SO-REQ-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+        request_id = new_approval_request_id()
         
         # Store approval request in Azure Blob Storage
         approval_request_data = {
@@ -1534,7 +5804,7 @@ async def create_so_request(req: func.HttpRequest) -> func.HttpResponse:
         return add_cors_headers(response)
         
     except Exception as e:
-        logging.exception("[Error] Create SO request failed")
+        approval_logger.exception("[Error] Create SO request failed")
         error_response = func.HttpResponse(
             json.dumps({"error": f"Internal error: {str(e)}"}),
             mimetype="application/json",
@@ -1543,6 +5813,7 @@ async def create_so_request(req: func.HttpRequest) -> func.HttpResponse:
         return add_cors_headers(error_response)
 
 @app.route(route="approve-request", methods=["GET", "POST", "OPTIONS"])
+@instrumented_route("approve-request")
 async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
     """Approve a sales order request and create the actual sales order"""
     
@@ -1551,14 +5822,14 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
         return add_cors_headers(response)
     
     try:
-        logging.info(f"[APPROVE] Starting approval process - Method: {req.method}")
+        approval_logger.info("[APPROVE] Starting approval process - Method: %s", req.method)
         
         # Handle both GET (Teams button) and POST (API) requests
         if req.method == "GET":
             # Teams button click - extract request_id from query parameters
             request_id = req.params.get("request_id", "")
             approver_comments = "Approved via Teams notification button"
-            logging.info(f"[APPROVE] GET request - request_id: {request_id}")
+            approval_logger.info("[APPROVE] GET request - request_id: %s", request_id)
             
             if not request_id:
                 # Return user-friendly HTML page for missing request ID
@@ -1594,30 +5865,31 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
         approval_data = None
         if request_id:
             # Try in-memory cache first
-            logging.info(f"[APPROVE] Checking approval request {request_id}")
+            approval_logger.info("[APPROVE] Checking approval request %s", request_id)
             
             # Initialize approval_requests if not exists (Azure Functions may reset memory)
             global approval_requests
             try:
+                record_cache_lookup("approval_requests", request_id in approval_requests)
                 if request_id in approval_requests:
                     approval_data = approval_requests[request_id]
-                    logging.info(f"[APPROVE] Found request {request_id} in memory cache")
+                    approval_logger.info("[APPROVE] Found request %s in memory cache", request_id)
                 else:
                     # Try to get from blob storage
-                    logging.info(f"[APPROVE] Request {request_id} not in memory, checking blob storage")
+                    approval_logger.info("[APPROVE] Request %s not in memory, checking blob storage", request_id)
                     try:
                         approval_data = await get_approval_request_from_blob(request_id)
                         if approval_data:
                             # Cache in memory for faster future access
                             approval_requests[request_id] = approval_data
-                            logging.info(f"[APPROVE] Found request {request_id} in blob storage")
+                            approval_logger.info("[APPROVE] Found request %s in blob storage", request_id)
                         else:
-                            logging.warning(f"[APPROVE] Request {request_id} not found in blob storage")
+                            approval_logger.warning("[APPROVE] Request %s not found in blob storage", request_id)
                     except Exception as blob_error:
-                        logging.error(f"[APPROVE] Blob storage error for {request_id}: {str(blob_error)}")
+                        approval_logger.error("[APPROVE] Blob storage error for %s: %s", request_id, blob_error)
                         approval_data = None
             except Exception as e:
-                logging.error(f"[APPROVE] Error accessing approval requests: {str(e)}")
+                approval_logger.error("[APPROVE] Error accessing approval requests: %s", e)
                 approval_data = None
         
         if not request_id or not approval_data:
@@ -1653,20 +5925,14 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
                 )
                 return add_cors_headers(error_response)
         
-        # Update approval status in memory and blob storage
-        approval_data["status"] = "approved"
-        approval_data["approved_at"] = datetime.now(timezone.utc).isoformat()
-        approval_data["approver_comments"] = approver_comments
-        
-        # Update in memory
-        approval_requests[request_id] = approval_data
-        
-        # Update in blob storage for persistence
-        await update_approval_request_in_blob(request_id, {
+        # Update approval status in memory and blob storage; only a pending request can be approved
+        conflict = await decide_approval_request(req, request_id, approval_data, {
             "status": "approved",
             "approved_at": datetime.now(timezone.utc).isoformat(),
             "approver_comments": approver_comments
         })
+        if conflict:
+            return conflict
         
         # Create the actual sales order
         sales_order_data = approval_data["sales_order_data"]
@@ -1676,10 +5942,10 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
         
         try:
             # 🔓 APPROVED: Use bypass flag to allow creation after approval
-            logging.info(f"[APPROVAL GRANTED] Creating approved sales order for request {request_id}")
-            logging.info(f"[CLEANED PAYLOAD] Original: {json.dumps(sales_order_data)}")
-            logging.info(f"[CLEANED PAYLOAD] Cleaned: {json.dumps(clean_sales_order_data)}")
-            resp = await post_odata_entity("salesorders", clean_sales_order_data, bypass_approval=True)
+            approval_logger.info("[APPROVAL GRANTED] Creating approved sales order for request %s", request_id)
+            payload_logger.debug("[CLEANED PAYLOAD] Original: %s", LogPayload(sales_order_data))
+            payload_logger.debug("[CLEANED PAYLOAD] Cleaned: %s", LogPayload(clean_sales_order_data))
+            resp = await post_odata_entity("salesorders", clean_sales_order_data, bypass_approval=True, idempotency_key=request_id)
             
             if resp.status_code in (200, 201):
                 # Parse the created sales order response
@@ -1752,7 +6018,11 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
             else:
                 # S/4HANA creation failed
                 error_msg = f"S/4HANA creation failed: {resp.get_body().decode()}"
-                logging.error(f"[APPROVAL ERROR] {error_msg}")
+                approval_logger.error("[APPROVAL ERROR] %s", error_msg)
+                # Shed load (503) and client errors mean nothing was created; timeouts and
+                # 5xx are ambiguous and stay approved for reconciliation
+                if resp.status_code == 503 or (400 <= resp.status_code < 500 and resp.status_code != 408):
+                    await reopen_approval_request(request_id, approval_data, error_msg)
                 
                 if req.method == "GET":
                     html_response = f"""
@@ -1788,7 +6058,7 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
                     return add_cors_headers(error_response)
                     
         except Exception as so_error:
-            logging.exception(f"[Error] Sales order creation failed for {request_id}")
+            approval_logger.exception("[Error] Sales order creation failed for %s", request_id)
             error_msg = f"Sales order creation error: {str(so_error)}"
             
             if req.method == "GET":
@@ -1825,7 +6095,7 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
                 return add_cors_headers(error_response)
         
     except Exception as e:
-        logging.exception("[Error] Approve request failed")
+        approval_logger.exception("[Error] Approve request failed")
         
         if req.method == "GET":
             html_response = f"""
@@ -1860,6 +6130,7 @@ async def approve_request(req: func.HttpRequest) -> func.HttpResponse:
             return add_cors_headers(error_response)
 
 @app.route(route="reject-request", methods=["GET", "POST", "OPTIONS"])
+@instrumented_route("reject-request")
 async def reject_request(req: func.HttpRequest) -> func.HttpResponse:
     """Reject a sales order request"""
     
@@ -1878,7 +6149,15 @@ async def reject_request(req: func.HttpRequest) -> func.HttpResponse:
             request_id = body.get("request_id", "")
             rejection_reason = body.get("reason", "Rejected via API")
         
-        if not request_id or request_id not in approval_requests:
+        # Check memory first, then blob storage (the request may have been created on another instance)
+        approval_data = None
+        if request_id:
+            record_cache_lookup("approval_requests", request_id in approval_requests)
+            approval_data = approval_requests.get(request_id) or await get_approval_request_from_blob(request_id)
+            if approval_data:
+                approval_requests[request_id] = approval_data
+        
+        if not approval_data:
             if req.method == "GET":
                 # Return user-friendly HTML page for Teams button click
                 html_response = f"""
@@ -1911,10 +6190,14 @@ async def reject_request(req: func.HttpRequest) -> func.HttpResponse:
                 )
                 return add_cors_headers(error_response)
         
-        # Update approval status to rejected
-        approval_requests[request_id]["status"] = "rejected"
-        approval_requests[request_id]["rejected_at"] = datetime.now(timezone.utc).isoformat()
-        approval_requests[request_id]["rejection_reason"] = rejection_reason
+        # Update approval status to rejected in memory and blob storage; only a pending request can be rejected
+        conflict = await decide_approval_request(req, request_id, approval_data, {
+            "status": "rejected",
+            "rejected_at": datetime.now(timezone.utc).isoformat(),
+            "rejection_reason": rejection_reason
+        })
+        if conflict:
+            return conflict
         
         # Send rejection notification
         subject = f"❌ Sales Order Rejected - {request_id}"
@@ -1978,7 +6261,7 @@ async def reject_request(req: func.HttpRequest) -> func.HttpResponse:
             return add_cors_headers(response)
             
     except Exception as e:
-        logging.exception("[Error] Reject request failed")
+        approval_logger.exception("[Error] Reject request failed")
         
         if req.method == "GET":
             html_response = f"""
@@ -2013,6 +6296,7 @@ async def reject_request(req: func.HttpRequest) -> func.HttpResponse:
             return add_cors_headers(error_response)
 
 @app.route(route="list-approval-requests", methods=["GET"])
+@instrumented_route("list-approval-requests")
 async def list_approval_requests(req: func.HttpRequest) -> func.HttpResponse:
     """List all approval requests"""
     
@@ -2031,16 +6315,16 @@ async def list_approval_requests(req: func.HttpRequest) -> func.HttpResponse:
         request_dict = {}
         
         # First add blob storage requests
-        for req in blob_requests:
-            request_id = req.get("id", "")
+        for blob_request in blob_requests:
+            request_id = blob_request.get("id", "")
             if request_id:
-                request_dict[request_id] = req
+                request_dict[request_id] = blob_request
                 
         # Then add/update with memory requests (these are more recent)
-        for req in all_requests:
-            request_id = req.get("id", "")
+        for memory_request in all_requests:
+            request_id = memory_request.get("id", "")
             if request_id:
-                request_dict[request_id] = req
+                request_dict[request_id] = memory_request
         
         response_data = {
             "requests": list(request_dict.values()),
@@ -2053,10 +6337,10 @@ async def list_approval_requests(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
             status_code=200
         )
-        return add_cors_headers(response)
+        return add_cors_headers(compress_response(req, response))
         
     except Exception as e:
-        logging.exception("[Error] List approval requests failed")
+        approval_logger.exception("[Error] List approval requests failed")
         error_response = func.HttpResponse(
             json.dumps({"error": f"Internal error: {str(e)}"}),
             mimetype="application/json",